@@ -0,0 +1,75 @@
+"""
+Agendador Prazos Module
+Worker em background que varre itens vencidos e dorme até o próximo prazo
+
+Usado pelas flags de atraso (tarefas de marketing, pedidos de marketplace): a cada
+ciclo executa a varredura do módulo e dorme até o próximo prazo informado por ele,
+no máximo INTERVALO_VARREDURA_SEGUNDOS. Rotas que criam ou alteram prazos chamam
+reagendar() para o worker recalcular o próximo prazo na hora.
+"""
+import asyncio
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+
+INTERVALO_VARREDURA_SEGUNDOS = 60
+# Folga após o prazo, para a varredura não acordar um instante antes do vencimento
+FOLGA_SEGUNDOS = 0.5
+
+# Varredura async (db, agora, *args) e consulta async (db, agora) -> próximo prazo
+Varredura = Callable[..., Awaitable[None]]
+ProximoPrazo = Callable[..., Awaitable[Optional[datetime]]]
+
+def ler_prazo(valor) -> Optional[datetime]:
+    """Prazo lido do banco (datetime BSON) como datetime UTC; None se não for data"""
+    if not isinstance(valor, datetime):
+        return None
+    return valor if valor.tzinfo else valor.replace(tzinfo=timezone.utc)
+
+class AgendadorPrazos:
+    """Um worker por processo; `nome` identifica o agendador nas mensagens de erro"""
+
+    def __init__(self, nome: str, varrer: Varredura, proximo_prazo: ProximoPrazo,
+                 intervalo_segundos: float = INTERVALO_VARREDURA_SEGUNDOS):
+        self.nome = nome
+        self.varrer = varrer
+        self.proximo_prazo = proximo_prazo
+        self.intervalo = intervalo_segundos
+        self._acordar = asyncio.Event()
+        self._worker = None
+
+    def reagendar(self):
+        """Acorda o worker para varrer e recalcular o próximo prazo"""
+        self._acordar.set()
+
+    async def _executar(self, db, *args):
+        while True:
+            espera = self.intervalo
+            try:
+                agora = datetime.now(timezone.utc)
+                await self.varrer(db, agora, *args)
+                prazo = await self.proximo_prazo(db, agora)
+                if prazo:
+                    espera = min(espera, max((prazo - datetime.now(timezone.utc)).total_seconds(), 0) + FOLGA_SEGUNDOS)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ {self.nome}: erro na varredura de prazos: {e}")
+            try:
+                await asyncio.wait_for(self._acordar.wait(), timeout=espera)
+            except asyncio.TimeoutError:
+                pass
+            self._acordar.clear()
+
+    def iniciar(self, db, *args):
+        """Inicia o worker no event loop da aplicação; args extras vão para a varredura"""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._executar(db, *args))
+
+    async def parar(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
@@ -0,0 +1,144 @@
+"""
+Blob Store Module
+Armazenamento local de arquivos enviados, endereçados pelo SHA-256 do conteúdo
+
+Os arquivos ficam em UPLOAD_DIR/blobs/<2 primeiros hex>/<sha256><extensão> e são
+servidos pelo mount /uploads. Conteúdos iguais viram o mesmo arquivo (dedup) e os
+documentos guardam apenas a URL.
+"""
+import os
+import asyncio
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from fastapi import UploadFile
+
+UPLOAD_DIR = Path(os.environ.get('UPLOAD_DIR', '/app/uploads'))
+BLOBS_DIR = UPLOAD_DIR / 'blobs'
+
+TAMANHO_CHUNK = 1024 * 1024
+
+# Limite de tamanho dos anexos do kanban (MB), configurável por ambiente
+TAMANHO_MAXIMO_ANEXO = int(os.environ.get('MAX_UPLOAD_ANEXO_MB', '100')) * 1024 * 1024
+
+EXTENSOES_POR_TIPO = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+    'image/gif': '.gif',
+    'application/pdf': '.pdf',
+}
+
+# Fotos de pedidos e de produção: tipo declarado -> formato conferido pelo Pillow
+TIPOS_IMAGEM = {
+    'image/jpeg': 'JPEG',
+    'image/png': 'PNG',
+    'image/webp': 'WEBP',
+}
+
+class ArquivoMuitoGrande(Exception):
+    """Upload maior que o tamanho máximo permitido"""
+
+    def __init__(self, tamanho_maximo: int):
+        self.tamanho_maximo = tamanho_maximo
+        super().__init__(f"Arquivo excede o limite de {tamanho_maximo // (1024 * 1024)} MB")
+
+class ArquivoInvalido(Exception):
+    """Upload com tipo não permitido ou conteúdo que não corresponde ao tipo declarado"""
+
+def extensao_arquivo(content_type: Optional[str], nome_arquivo: Optional[str] = None) -> str:
+    """Extensão do blob a partir do content-type, ou do nome original do arquivo"""
+    if content_type in EXTENSOES_POR_TIPO:
+        return EXTENSOES_POR_TIPO[content_type]
+    return Path(nome_arquivo or '').suffix.lower()
+
+def caminho_blob(sha256: str, extensao: str) -> Path:
+    return BLOBS_DIR / sha256[:2] / f"{sha256}{extensao}"
+
+def url_blob(sha256: str, extensao: str) -> str:
+    return f"/uploads/blobs/{sha256[:2]}/{sha256}{extensao}"
+
+def _verificar_imagem(caminho: str, formato: str):
+    """Confere com o Pillow que o arquivo é uma imagem íntegra do formato esperado"""
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(caminho) as imagem:
+            formato_lido = imagem.format
+            imagem.verify()
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        raise ArquivoInvalido("Arquivo não é uma imagem válida")
+    if formato_lido != formato:
+        raise ArquivoInvalido("Conteúdo do arquivo não corresponde ao tipo informado")
+
+def _mover_para_destino(temporario: str, destino: Path):
+    """Move o arquivo temporário para o caminho definitivo; se o blob já existe, descarta a cópia"""
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    if destino.exists():
+        os.unlink(temporario)
+    else:
+        os.replace(temporario, destino)
+
+async def salvar_upload(file: UploadFile, tamanho_maximo: Optional[int] = None, somente_imagens: bool = False) -> dict:
+    """
+    Grava o upload em disco em chunks (escrita fora do event loop), calculando SHA-256
+    e tamanho durante a leitura, e move atomicamente o arquivo para o caminho final.
+    Levanta ArquivoMuitoGrande assim que o tamanho passa de tamanho_maximo.
+    Com somente_imagens, aceita apenas TIPOS_IMAGEM e confere o conteúdo com o Pillow
+    antes de publicar o blob (levanta ArquivoInvalido).
+    Retorna {sha256, url, tamanho, content_type}.
+    """
+    if tamanho_maximo and file.size is not None and file.size > tamanho_maximo:
+        raise ArquivoMuitoGrande(tamanho_maximo)
+    if somente_imagens and file.content_type not in TIPOS_IMAGEM:
+        raise ArquivoInvalido("Envie uma imagem JPEG, PNG ou WebP")
+
+    BLOBS_DIR.mkdir(parents=True, exist_ok=True)
+    extensao = extensao_arquivo(file.content_type, file.filename)
+    hash_conteudo = hashlib.sha256()
+    tamanho = 0
+
+    fd, temporario = tempfile.mkstemp(dir=BLOBS_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as destino:
+            while chunk := await file.read(TAMANHO_CHUNK):
+                tamanho += len(chunk)
+                if tamanho_maximo and tamanho > tamanho_maximo:
+                    raise ArquivoMuitoGrande(tamanho_maximo)
+                hash_conteudo.update(chunk)
+                await asyncio.to_thread(destino.write, chunk)
+        if somente_imagens:
+            await asyncio.to_thread(_verificar_imagem, temporario, TIPOS_IMAGEM[file.content_type])
+        sha256 = hash_conteudo.hexdigest()
+        await asyncio.to_thread(_mover_para_destino, temporario, caminho_blob(sha256, extensao))
+    except BaseException:
+        if os.path.exists(temporario):
+            os.unlink(temporario)
+        raise
+
+    return {
+        'sha256': sha256,
+        'url': url_blob(sha256, extensao),
+        'tamanho': tamanho,
+        'content_type': file.content_type
+    }
+
+def salvar_bytes(conteudo: bytes, content_type: Optional[str] = None) -> dict:
+    """Versão síncrona de salvar_upload para conteúdos já em memória (ex: migrações)"""
+    BLOBS_DIR.mkdir(parents=True, exist_ok=True)
+    sha256 = hashlib.sha256(conteudo).hexdigest()
+    extensao = extensao_arquivo(content_type)
+    destino = caminho_blob(sha256, extensao)
+    if not destino.exists():
+        fd, temporario = tempfile.mkstemp(dir=BLOBS_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as arquivo:
+            arquivo.write(conteudo)
+        _mover_para_destino(temporario, destino)
+    return {
+        'sha256': sha256,
+        'url': url_blob(sha256, extensao),
+        'tamanho': len(conteudo),
+        'content_type': content_type
+    }
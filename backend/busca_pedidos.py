@@ -0,0 +1,149 @@
+"""
+Busca Pedidos Module
+Busca, facetas e paginação por cursor dos pedidos de marketplace
+
+Monta as agregações da busca no servidor: filtros por número do pedido, SKU e
+cliente (prefixo), busca livre pelo índice de texto, faixas de data, facetas de
+status_producao/status_logistica/status_montagem com contagens e paginação por
+cursor (keyset) sobre a ordenação escolhida + id, que não degrada com o número
+da página como skip/limit.
+"""
+import base64
+import json
+import re
+from datetime import datetime, timezone
+from typing import Optional
+
+from pedidos_atrasados import expressao_dias_atraso
+
+CAMPOS_FACETA = ("status_producao", "status_logistica", "status_montagem")
+ORDENACOES = ("created_at", "prazo_entrega", "numero_pedido")
+CAMPOS_DATA = ("created_at", "prazo_entrega", "data_prevista_envio")
+LIMITE_MAXIMO = 500
+
+# Campos cobertos pelo índice de texto da coleção pedidos_marketplace
+CAMPOS_TEXTO = (
+    "numero_pedido", "sku", "numero_referencia_sku", "cliente_nome", "nome_usuario_comprador", "produto_nome", "tipo_envio"
+)
+
+class BuscaInvalida(ValueError):
+    """Parâmetro de busca inválido (ordenação, campo de data ou cursor)"""
+
+def _como_utc(valor: datetime) -> datetime:
+    return valor if valor.tzinfo else valor.replace(tzinfo=timezone.utc)
+
+def codificar_cursor(valor, pedido_id: str) -> str:
+    """Cursor opaco com o valor da ordenação e o id do último pedido da página"""
+    if isinstance(valor, datetime):
+        valor = {"d": _como_utc(valor).isoformat()}
+    bruto = json.dumps([valor, pedido_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip('=')
+
+def decodificar_cursor(cursor: str) -> tuple:
+    try:
+        valor, pedido_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if isinstance(valor, dict):
+            valor = _como_utc(datetime.fromisoformat(valor['d']))
+    except (ValueError, TypeError, KeyError):
+        raise BuscaInvalida("Cursor inválido")
+    return valor, pedido_id
+
+def filtro_busca(
+    projeto_id: Optional[str] = None,
+    busca: Optional[str] = None,
+    numero_pedido: Optional[str] = None,
+    sku: Optional[str] = None,
+    cliente_nome: Optional[str] = None,
+    campo_data: str = "created_at",
+    data_inicio: Optional[datetime] = None,
+    data_fim: Optional[datetime] = None,
+    status: Optional[str] = None,
+    atrasado: Optional[bool] = None,
+) -> dict:
+    """Filtros comuns a página e facetas (sem os filtros de faceta). data_fim é exclusiva."""
+    if campo_data not in CAMPOS_DATA:
+        raise BuscaInvalida(f"campo_data deve ser um de {', '.join(CAMPOS_DATA)}")
+    filtro = {}
+    if projeto_id:
+        filtro['projeto_id'] = projeto_id
+    if busca and busca.strip():
+        filtro['$text'] = {"$search": busca.strip()}
+    # Prefixos com âncora usam os índices (projeto_id, numero_pedido) e (projeto_id, sku)
+    if numero_pedido:
+        filtro['numero_pedido'] = {"$regex": f"^{re.escape(numero_pedido.strip())}"}
+    if sku:
+        filtro['sku'] = {"$regex": f"^{re.escape(sku.strip())}"}
+    if cliente_nome:
+        filtro['cliente_nome'] = {"$regex": f"^{re.escape(cliente_nome.strip())}", "$options": "i"}
+    if data_inicio or data_fim:
+        faixa = {}
+        if data_inicio:
+            faixa['$gte'] = _como_utc(data_inicio)
+        if data_fim:
+            faixa['$lt'] = _como_utc(data_fim)
+        filtro[campo_data] = faixa
+    if status:
+        filtro['status'] = status
+    if atrasado is not None:
+        filtro['atrasado'] = atrasado
+    return filtro
+
+def filtro_facetas(selecionadas: dict, exceto: Optional[str] = None) -> dict:
+    """Filtros das facetas selecionadas; `exceto` deixa de fora a própria faceta ao contá-la"""
+    return {campo: valor for campo, valor in selecionadas.items() if valor and campo != exceto}
+
+def pipeline_pagina(filtro: dict, facetas: dict, ordenar: str = "created_at", direcao: str = "desc",
+                    cursor: Optional[str] = None, limite: int = 50, agora: Optional[datetime] = None) -> list:
+    """Uma página da busca. Traz limite + 1 pedidos: o excedente indica que há próxima página."""
+    if ordenar not in ORDENACOES:
+        raise BuscaInvalida(f"ordenar deve ser um de {', '.join(ORDENACOES)}")
+    if direcao not in ("asc", "desc"):
+        raise BuscaInvalida("direcao deve ser asc ou desc")
+    sentido = 1 if direcao == "asc" else -1
+
+    # $text só é aceito no primeiro $match; o cursor vai num $match separado
+    etapas = [{"$match": {**filtro, **filtro_facetas(facetas)}}]
+    if cursor:
+        valor, pedido_id = decodificar_cursor(cursor)
+        operador = "$gt" if sentido == 1 else "$lt"
+        etapas.append({"$match": {"$or": [
+            {ordenar: {operador: valor}},
+            {ordenar: valor, "id": {operador: pedido_id}}
+        ]}})
+    etapas += [
+        {"$sort": {ordenar: sentido, "id": sentido}},
+        {"$limit": min(limite, LIMITE_MAXIMO) + 1},
+        {"$project": {"_id": 0}},
+        {"$addFields": {"dias_atraso": expressao_dias_atraso(agora or datetime.now(timezone.utc))}},
+    ]
+    return etapas
+
+def pipeline_facetas(filtro: dict, facetas: dict) -> list:
+    """Contagens de cada faceta com os demais filtros aplicados, mais o total da busca"""
+    ramos = {
+        campo: [
+            {"$match": filtro_facetas(facetas, exceto=campo)},
+            {"$group": {"_id": f"${campo}", "total": {"$sum": 1}}},
+            {"$sort": {"total": -1, "_id": 1}}
+        ]
+        for campo in CAMPOS_FACETA
+    }
+    ramos['total'] = [{"$match": filtro_facetas(facetas)}, {"$count": "total"}]
+    return [{"$match": filtro}, {"$facet": ramos}]
+
+def montar_resposta(pedidos: list, limite: int, ordenar: str, facetas: Optional[dict] = None) -> dict:
+    """Corta o excedente da página, gera o próximo cursor e formata as facetas"""
+    limite = min(limite, LIMITE_MAXIMO)
+    proximo_cursor = None
+    if len(pedidos) > limite:
+        pedidos = pedidos[:limite]
+        ultimo = pedidos[-1]
+        proximo_cursor = codificar_cursor(ultimo.get(ordenar), ultimo['id'])
+    resposta = {"pedidos": pedidos, "proximo_cursor": proximo_cursor}
+    if facetas is not None:
+        resposta['facetas'] = {
+            campo: [{"valor": grupo['_id'], "total": grupo['total']} for grupo in facetas.get(campo, [])]
+            for campo in CAMPOS_FACETA
+        }
+        resposta['total'] = facetas['total'][0]['total'] if facetas.get('total') else 0
+    return resposta
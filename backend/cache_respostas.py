@@ -0,0 +1,211 @@
+"""
+Cache Respostas Module
+Cache HTTP das respostas GET de leitura pesada (dashboards, relatórios, mensagem do dia)
+
+Middleware ASGI configurado por rota: cada rota tem um TTL e, opcionalmente, varia
+por usuário ou por role (extraídos do token JWT). As respostas 200 em JSON ficam em
+um LRU em memória limitado por bytes, com ETag gerada pelo hash do corpo; o cliente
+que reenviar a ETag em If-None-Match recebe 304 sem corpo. Requisições iguais que
+chegam durante o cálculo esperam a primeira, então cada resposta é calculada uma vez
+por TTL, não importa quantos terminais estejam consultando.
+
+Requisições sem token válido não usam o cache: seguem para a rota, que responde 401.
+As listas de referência (status, categorias, contas...) não passam por aqui: usam o
+CacheReferencia do server, invalidado pelas escritas.
+"""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+VARIAR_POR = (None, "usuario", "role")
+
+# Estimativa do custo fixo de cada entrada (chave, cabeçalhos, estruturas)
+CUSTO_ENTRADA_BYTES = 512
+
+class RegraCache:
+    """Configuração de cache de uma rota"""
+
+    def __init__(self, ttl_segundos: float, variar_por: Optional[str] = None):
+        if variar_por not in VARIAR_POR:
+            raise ValueError(f"variar_por deve ser um de {VARIAR_POR}")
+        self.ttl = ttl_segundos
+        self.variar_por = variar_por
+
+class CacheRespostas:
+    """LRU de respostas limitado pelo total de bytes, com métricas de acerto"""
+
+    def __init__(self, limite_bytes: int, limite_entrada_bytes: Optional[int] = None):
+        self.limite_bytes = limite_bytes
+        self.limite_entrada_bytes = limite_entrada_bytes or limite_bytes // 4
+        self._entradas: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._bytes = 0
+        self._em_andamento: Dict[tuple, asyncio.Event] = {}
+        self._contadores = {"hits": 0, "misses": 0, "esperas": 0, "respostas_304": 0, "removidas_lru": 0, "expiradas": 0}
+        self._por_rota: Dict[str, Dict[str, int]] = {}
+
+    def contar(self, rota: str, evento: str):
+        self._contadores[evento] += 1
+        if evento in ("hits", "misses"):
+            self._por_rota.setdefault(rota, {"hits": 0, "misses": 0})[evento] += 1
+
+    def get(self, chave: tuple) -> Optional[dict]:
+        entrada = self._entradas.get(chave)
+        if entrada is None:
+            return None
+        if time.monotonic() > entrada['expira_em']:
+            self._remover(chave)
+            self._contadores['expiradas'] += 1
+            return None
+        self._entradas.move_to_end(chave)
+        return entrada
+
+    def set(self, chave: tuple, entrada: dict) -> bool:
+        """Guarda a entrada e remove as menos usadas até caber no limite. False se for grande demais."""
+        if entrada['tamanho'] > self.limite_entrada_bytes:
+            return False
+        self._remover(chave)
+        self._entradas[chave] = entrada
+        self._bytes += entrada['tamanho']
+        while self._bytes > self.limite_bytes and self._entradas:
+            self._remover(next(iter(self._entradas)))
+            self._contadores['removidas_lru'] += 1
+        return True
+
+    def _remover(self, chave: tuple):
+        entrada = self._entradas.pop(chave, None)
+        if entrada is not None:
+            self._bytes -= entrada['tamanho']
+
+    async def aguardar_calculo(self, chave: tuple) -> Optional[dict]:
+        """Se outra requisição está calculando a mesma resposta, espera e devolve a entrada guardada"""
+        calculo = self._em_andamento.get(chave)
+        if calculo is None:
+            return None
+        self._contadores['esperas'] += 1
+        await calculo.wait()
+        return self.get(chave)
+
+    def iniciar_calculo(self, chave: tuple):
+        self._em_andamento[chave] = asyncio.Event()
+
+    def concluir_calculo(self, chave: tuple):
+        calculo = self._em_andamento.pop(chave, None)
+        if calculo is not None:
+            calculo.set()
+
+    def invalidar(self, prefixo: str = ""):
+        """Remove as respostas das rotas que começam com prefixo (todas, por padrão)"""
+        for chave in [c for c in self._entradas if c[0].startswith(prefixo)]:
+            self._remover(chave)
+
+    def metricas(self) -> dict:
+        consultas = self._contadores['hits'] + self._contadores['misses']
+        return {
+            **self._contadores,
+            "taxa_acerto": round(self._contadores['hits'] / consultas, 4) if consultas else None,
+            "entradas": len(self._entradas),
+            "bytes": self._bytes,
+            "limite_bytes": self.limite_bytes,
+            "por_rota": self._por_rota,
+        }
+
+def gerar_etag(corpo: bytes) -> bytes:
+    return b'W/"' + hashlib.sha1(corpo).hexdigest()[:20].encode() + b'"'
+
+def etag_confere(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match com comparação fraca: o prefixo W/ é ignorado dos dois lados.
+    Usada também pelo server (listas de referência) e pelo serviço de /uploads."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    etag = etag.removeprefix('W/')
+    return any(valor.strip().removeprefix('W/') == etag for valor in if_none_match.split(','))
+
+class CacheRespostasMiddleware:
+    """
+    Middleware ASGI. rotas: {caminho completo (ex.: /api/gestao/marketing/dashboard): RegraCache}.
+    identificar(token) devolve o payload do JWT, ou None se o token for inválido.
+    """
+
+    def __init__(self, app, cache: CacheRespostas, rotas: Dict[str, RegraCache], identificar: Callable[[str], Optional[dict]]):
+        self.app = app
+        self.cache = cache
+        self.rotas = rotas
+        self.identificar = identificar
+
+    async def __call__(self, scope, receive, send):
+        regra = self.rotas.get(scope.get('path')) if scope['type'] == 'http' and scope['method'] == 'GET' else None
+        if regra is None:
+            await self.app(scope, receive, send)
+            return
+
+        cabecalhos = dict(scope['headers'])
+        autorizacao = cabecalhos.get(b'authorization', b'').decode('latin-1')
+        usuario = self.identificar(autorizacao[7:]) if autorizacao.startswith('Bearer ') else None
+        if usuario is None:
+            await self.app(scope, receive, send)
+            return
+
+        variacao = None
+        if regra.variar_por == 'usuario':
+            variacao = usuario.get('user_id')
+        elif regra.variar_por == 'role':
+            variacao = usuario.get('role')
+        rota = scope['path']
+        chave = (rota, scope.get('query_string', b''), variacao)
+        if_none_match = cabecalhos.get(b'if-none-match')
+
+        entrada = self.cache.get(chave) or await self.cache.aguardar_calculo(chave)
+        if entrada is not None:
+            self.cache.contar(rota, 'hits')
+            await self._enviar(send, entrada, if_none_match, b'HIT')
+            return
+
+        self.cache.contar(rota, 'misses')
+        self.cache.iniciar_calculo(chave)
+        try:
+            inicio, partes = None, []
+
+            async def capturar(mensagem):
+                nonlocal inicio
+                if mensagem['type'] == 'http.response.start':
+                    inicio = mensagem
+                elif mensagem['type'] == 'http.response.body':
+                    partes.append(mensagem.get('body', b''))
+
+            await self.app(scope, receive, capturar)
+            corpo = b''.join(partes)
+            resposta_cabecalhos = [(nome.lower(), valor) for nome, valor in inicio['headers'] if nome.lower() != b'content-length']
+            if inicio['status'] != 200 or not dict(resposta_cabecalhos).get(b'content-type', b'').startswith(b'application/json'):
+                await send(inicio)
+                await send({'type': 'http.response.body', 'body': corpo})
+                return
+
+            entrada = {
+                'cabecalhos': [(nome, valor) for nome, valor in resposta_cabecalhos if nome not in (b'etag', b'cache-control')],
+                'corpo': corpo,
+                'etag': dict(resposta_cabecalhos).get(b'etag') or gerar_etag(corpo),
+                'expira_em': time.monotonic() + regra.ttl,
+                'tamanho': len(corpo) + CUSTO_ENTRADA_BYTES,
+            }
+            self.cache.set(chave, entrada)
+            await self._enviar(send, entrada, if_none_match, b'MISS')
+        finally:
+            self.cache.concluir_calculo(chave)
+
+    async def _enviar(self, send, entrada: dict, if_none_match: Optional[bytes], situacao: bytes):
+        cabecalhos_cache = [(b'etag', entrada['etag']), (b'cache-control', b'private, no-cache'), (b'x-cache', situacao)]
+        if if_none_match and etag_confere(if_none_match.decode('latin-1'), entrada['etag'].decode('latin-1')):
+            self.cache.contar(None, 'respostas_304')
+            await send({'type': 'http.response.start', 'status': 304, 'headers': cabecalhos_cache})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': entrada['cabecalhos'] + cabecalhos_cache + [(b'content-length', str(len(entrada['corpo'])).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': entrada['corpo']})
@@ -0,0 +1,122 @@
+"""
+Contas a Receber Service
+Geração das parcelas de contas a receber de um pedido de manufatura
+"""
+import uuid
+from datetime import datetime, timezone, timedelta
+
+from pymongo.errors import BulkWriteError, OperationFailure
+
+# Campos do pedido usados na geração das parcelas
+CAMPOS_PEDIDO = {
+    "_id": 0, "id": 1, "numero_pedido": 1, "cliente_nome": 1, "loja_id": 1,
+    "forma_pagamento_id": 1, "forma_pagamento_nome": 1, "conta_bancaria_id": 1, "conta_bancaria_nome": 1,
+    "valor_bruto": 1, "valor_final": 1, "taxa_percentual": 1, "valor_liquido_empresa": 1
+}
+
+# Campos da forma de pagamento usados na geração das parcelas
+CAMPOS_FORMA = {"_id": 0, "numero_parcelas": 1, "espaco_parcelas_dias": 1}
+
+async def criar_indices_contas_receber(db):
+    """Garante no banco que cada parcela de um pedido só é gerada uma vez"""
+    try:
+        await db.contas_receber.create_index(
+            [("pedido_id", 1), ("numero_parcela", 1)],
+            unique=True,
+            partialFilterExpression={"pedido_id": {"$type": "string"}}
+        )
+    except OperationFailure as e:
+        # Parcelas duplicadas já gravadas impedem o índice único: precisam ser revisadas manualmente
+        print(f"⚠️ Índice único de contas a receber não criado: {e}")
+
+def montar_parcelas(pedido: dict, forma_pagamento: dict, usuario: str) -> list:
+    """Monta os documentos de contas a receber, um por parcela"""
+    total_parcelas = forma_pagamento.get('numero_parcelas', 1)
+    espaco_dias = forma_pagamento.get('espaco_parcelas_dias', 30)
+    valor_bruto = pedido.get('valor_bruto', pedido.get('valor_final', 0))
+    taxa_percentual = pedido.get('taxa_percentual', 0)
+    valor_liquido = pedido.get('valor_liquido_empresa', valor_bruto)
+
+    # Calcular valor por parcela
+    valor_bruto_parcela = valor_bruto / total_parcelas
+    valor_liquido_parcela = valor_liquido / total_parcelas
+
+    agora = datetime.now(timezone.utc)
+    numero_pedido = pedido.get('numero_pedido', 0)
+    loja_id = pedido.get('loja_id', 'fabrica')
+
+    parcelas = []
+    for i in range(1, total_parcelas + 1):
+        # Calcular data de vencimento da parcela
+        data_venc = agora + timedelta(days=(i - 1) * espaco_dias)
+
+        parcelas.append({
+            'id': str(uuid.uuid4()),
+            'pedido_id': pedido['id'],
+            'documento': f"Pedido_{numero_pedido}-{i}/{total_parcelas}",
+            'cliente_origem': pedido.get('cliente_nome', 'Cliente não informado'),
+            'loja_id': loja_id,
+            'vendedor': usuario,
+            'valor_bruto': valor_bruto_parcela,
+            'valor_liquido': valor_liquido_parcela,
+            'valor': valor_liquido_parcela,
+            'forma_pagamento_id': pedido.get('forma_pagamento_id'),
+            'forma_pagamento_nome': pedido.get('forma_pagamento_nome', ''),
+            'conta_bancaria_id': pedido.get('conta_bancaria_id', ''),
+            'conta_bancaria_nome': pedido.get('conta_bancaria_nome', ''),
+            'taxa_percentual': taxa_percentual,
+            'numero_parcela': i,
+            'total_parcelas': total_parcelas,
+            'data_emissao': agora,
+            'data_vencimento': data_venc,
+            'data_prevista': data_venc,
+            'data_operacao_bancaria': None,
+            'data_pago_loja': None,
+            'data_recebimento': None,
+            'categoria_id': '',
+            'categoria_nome': 'Venda de Produtos e Serviços',
+            'grupo_categoria': 'Receita Bruta',
+            'status': 'Pendente',
+            'dc': 'C',
+            'recorrencia': 'ÚNICA',
+            'lote': '',
+            'conta_id_interno': '',
+            'descricao': f"Venda {loja_id} - Pedido #{numero_pedido}",
+            'observacoes': f"Parcela {i} de {total_parcelas}",
+            'created_at': agora,
+            'updated_at': agora,
+            'created_by': usuario
+        })
+    return parcelas
+
+async def gerar_contas_receber_pedido(db, pedido: dict, usuario: str) -> int:
+    """
+    Gera as contas a receber (uma por parcela) de um pedido que entrou em Montagem.
+    Todas as parcelas são gravadas em um único insert_many; parcelas já existentes
+    são recusadas pelo índice único (pedido_id, numero_parcela).
+    Retorna a quantidade de parcelas criadas.
+    """
+    if not pedido.get('forma_pagamento_id'):
+        print(f"⚠️ Pedido #{pedido.get('numero_pedido')} sem forma de pagamento definida - pulando criação de contas a receber")
+        return 0
+
+    forma_pagamento = await db.formas_pagamento_banco.find_one({"id": pedido['forma_pagamento_id']}, CAMPOS_FORMA)
+    if not forma_pagamento:
+        print("⚠️ Forma de pagamento não encontrada")
+        return 0
+
+    parcelas = montar_parcelas(pedido, forma_pagamento, usuario)
+    try:
+        resultado = await db.contas_receber.insert_many(parcelas, ordered=False)
+        criadas = len(resultado.inserted_ids)
+    except BulkWriteError as e:
+        erros = e.details.get('writeErrors', [])
+        if any(erro.get('code') != 11000 for erro in erros):
+            raise
+        criadas = e.details.get('nInserted', 0)
+
+    if criadas:
+        print(f"✅ {criadas} Conta(s) a Receber criada(s) para o pedido #{pedido.get('numero_pedido')}")
+    else:
+        print("⚠️ Contas a Receber já existem para este pedido")
+    return criadas
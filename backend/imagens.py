@@ -0,0 +1,106 @@
+"""
+Imagens Module
+Miniaturas (derivados redimensionados) das imagens enviadas para /uploads
+
+Para cada imagem original são gerados, ao lado do arquivo, os derivados
+<nome>.<tamanho>.webp e <nome>.<tamanho>.jpg. A geração roda em um pool de
+processos, fora do caminho da requisição; os derivados são servidos em
+/uploads/<arquivo>?size=<tamanho>.
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from blob_store import UPLOAD_DIR
+
+# Tamanho -> maior lado em pixels
+TAMANHOS = {
+    'small': 320,
+    'medium': 1024,
+}
+
+# Formatos gerados para cada tamanho: extensão -> formato do Pillow
+FORMATOS = {
+    '.webp': 'WEBP',
+    '.jpg': 'JPEG',
+}
+
+EXTENSOES_IMAGEM = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp'}
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def caminho_derivado(original: Path, tamanho: str, extensao: str) -> Path:
+    return original.with_name(f"{original.stem}.{tamanho}{extensao}")
+
+def caminho_upload(url: Optional[str]) -> Optional[Path]:
+    """Converte uma URL /uploads/... no caminho local da imagem original.
+    Retorna None para URLs externas, data URLs ou arquivos que não são imagens."""
+    if not url or not url.startswith('/uploads/'):
+        return None
+    caminho = (UPLOAD_DIR / url[len('/uploads/'):].split('?')[0]).resolve()
+    if UPLOAD_DIR.resolve() not in caminho.parents or caminho.suffix.lower() not in EXTENSOES_IMAGEM:
+        return None
+    return caminho
+
+def gerar_derivados(caminho_original: str) -> int:
+    """Gera os derivados que ainda não existem (executado no pool de processos). Retorna quantos foram gerados."""
+    from PIL import Image, ImageOps
+
+    original = Path(caminho_original)
+    gerados = 0
+    with Image.open(original) as imagem:
+        imagem = ImageOps.exif_transpose(imagem)
+        if imagem.mode not in ('RGB', 'RGBA'):
+            imagem = imagem.convert('RGBA' if 'transparency' in imagem.info else 'RGB')
+
+        for tamanho, lado_maximo in TAMANHOS.items():
+            reduzida = imagem.copy()
+            reduzida.thumbnail((lado_maximo, lado_maximo), Image.LANCZOS)
+            for extensao, formato in FORMATOS.items():
+                destino = caminho_derivado(original, tamanho, extensao)
+                if destino.exists():
+                    continue
+                saida = reduzida.convert('RGB') if formato == 'JPEG' else reduzida
+                temporario = destino.with_name(destino.name + '.tmp')
+                saida.save(temporario, formato, quality=80, optimize=True)
+                temporario.replace(destino)
+                gerados += 1
+    return gerados
+
+def _obter_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=2)
+    return _pool
+
+def _registrar_resultado(futuro: asyncio.Future):
+    if not futuro.cancelled() and futuro.exception():
+        print(f"⚠️ Erro ao gerar miniaturas: {futuro.exception()}")
+
+def agendar_derivados(url: Optional[str]) -> bool:
+    """Agenda a geração das miniaturas de uma imagem em /uploads sem bloquear a requisição.
+    Retorna False se a URL não aponta para uma imagem local."""
+    caminho = caminho_upload(url)
+    if caminho is None:
+        return False
+    futuro = asyncio.get_running_loop().run_in_executor(_obter_pool(), gerar_derivados, str(caminho))
+    futuro.add_done_callback(_registrar_resultado)
+    return True
+
+def derivado_para_requisicao(caminho_original: Path, tamanho: str, accept: str = '') -> Optional[Path]:
+    """Derivado a servir para ?size=, preferindo WebP quando o cliente aceita. None se ainda não existe."""
+    if tamanho not in TAMANHOS:
+        return None
+    extensoes = ['.webp', '.jpg'] if 'image/webp' in accept else ['.jpg']
+    for extensao in extensoes:
+        derivado = caminho_derivado(caminho_original, tamanho, extensao)
+        if derivado.exists():
+            return derivado
+    return None
+
+def encerrar_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,91 @@
+"""
+Kanban Rank Module
+Chaves de ordenação fracionárias (estilo LexoRank) para cards e colunas do kanban
+
+Cada item guarda um rank: uma string em base 36 interpretada como a fração 0.<rank>.
+A ordem dos itens é a ordem lexicográfica dos ranks, e sempre existe um rank entre
+dois ranks quaisquer, então mover um item altera apenas o próprio item. Ranks nunca
+terminam em '0' (o menor dígito), o que garante espaço antes de qualquer rank.
+
+Inserções repetidas no mesmo intervalo fazem os ranks crescerem; quando passam de
+TAMANHO_MAXIMO_RANK a coluna é redistribuída com ranks_distribuidos().
+
+Com espalhar=True o rank é sorteado dentro do intervalo em vez de ser o ponto médio,
+para que dois usuários soltando cards no mesmo lugar ao mesmo tempo não recebam o
+mesmo rank.
+"""
+import random
+from typing import List, Optional
+
+ALFABETO = '0123456789abcdefghijklmnopqrstuvwxyz'
+BASE = len(ALFABETO)
+VALOR_DIGITO = {digito: valor for valor, digito in enumerate(ALFABETO)}
+
+# Dígitos usados pelos ranks "novos" (criação no fim/início da coluna e redistribuição)
+PRECISAO = 6
+# Distância entre um rank e o próximo criado no fim (ou início) da coluna
+PASSO = BASE ** 3
+# Acima deste tamanho a coluna deve ser redistribuída
+TAMANHO_MAXIMO_RANK = 12
+# Menor intervalo (em unidades do último dígito) em que o rank espalhado é sorteado
+INTERVALO_MINIMO_ESPALHADO = BASE ** 2
+
+def _valor(rank: str, digitos: int) -> int:
+    """Inteiro correspondente ao rank completado com zeros até `digitos`"""
+    valor = 0
+    for digito in rank.ljust(digitos, '0'):
+        valor = valor * BASE + VALOR_DIGITO[digito]
+    return valor
+
+def _texto(valor: int, digitos: int) -> str:
+    caracteres = []
+    for _ in range(digitos):
+        valor, resto = divmod(valor, BASE)
+        caracteres.append(ALFABETO[resto])
+    return ''.join(reversed(caracteres)).rstrip('0')
+
+def validar_rank(rank: str) -> bool:
+    return bool(rank) and rank[-1] != '0' and all(digito in VALOR_DIGITO for digito in rank)
+
+def rank_entre(antes: Optional[str] = None, depois: Optional[str] = None, espalhar: bool = False) -> str:
+    """
+    Rank estritamente entre `antes` e `depois` (None = início/fim da coluna).
+    No fim e no início da coluna avança PASSO em vez de dividir o intervalo ao meio,
+    para que cards criados em sequência não façam o rank crescer.
+    Com espalhar=True sorteia o rank na metade central do intervalo (ou em até 1/4
+    de PASSO nas pontas), evitando ranks iguais em inserções simultâneas.
+    Levanta ValueError se antes >= depois.
+    """
+    if antes is not None and depois is not None and antes >= depois:
+        raise ValueError(f"Rank inválido: '{antes}' não é menor que '{depois}'")
+
+    digitos = max(len(antes or ''), len(depois or ''), PRECISAO)
+    inicio = _valor(antes, digitos) if antes else 0
+    fim = _valor(depois, digitos) if depois else BASE ** digitos
+    minimo = INTERVALO_MINIMO_ESPALHADO if espalhar else 2
+    while fim - inicio < minimo:
+        digitos += 1
+        inicio *= BASE
+        fim *= BASE
+
+    if depois is None and inicio + PASSO < fim:
+        novo = inicio + PASSO - (random.randrange(PASSO // 4) if espalhar else 0)
+    elif antes is None and fim - PASSO > 0:
+        novo = fim - PASSO + (random.randrange(PASSO // 4) if espalhar else 0)
+    elif espalhar:
+        quarto = (fim - inicio) // 4
+        novo = random.randrange(inicio + quarto, fim - quarto)
+    else:
+        novo = (inicio + fim) // 2
+    return _texto(novo, digitos)
+
+def ranks_distribuidos(quantidade: int) -> List[str]:
+    """`quantidade` ranks crescentes, igualmente espaçados e curtos (usado na redistribuição)"""
+    digitos = PRECISAO
+    while BASE ** digitos < (quantidade + 1) * PASSO:
+        digitos += 1
+    intervalo = BASE ** digitos // (quantidade + 1)
+    return [_texto(intervalo * (i + 1), digitos) for i in range(quantidade)]
+
+def precisa_rebalancear(rank: str) -> bool:
+    return len(rank) > TAMANHO_MAXIMO_RANK
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Script para migrar campos de data gravados como string ISO para datetime BSON
+nas coleções financeiras, de pedidos (inclusive de marketplace) e de tarefas de marketing.
+
+Consultas por faixa de data (contas a receber, extrato, DRE, estatísticas)
+só funcionam - e só usam índice - quando o campo é datetime no banco.
+Pode ser executado mais de uma vez: só converte o que ainda for string.
+"""
+
+import sys
+import os
+from datetime import datetime, timezone
+from pymongo import MongoClient, UpdateOne
+from dotenv import load_dotenv
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+mongo_url = os.environ.get('MONGO_URL')
+db_name = os.environ.get('DB_NAME', 'gestao_manufatura')
+
+if not mongo_url:
+    print("❌ ERRO: MONGO_URL não encontrado no .env")
+    sys.exit(1)
+
+# Coleção -> campos de data no nível raiz
+CAMPOS_POR_COLECAO = {
+    'pedidos_manufatura': ['data_abertura', 'prazo_entrega', 'created_at', 'updated_at'],
+    'contas_receber': [
+        'data_emissao', 'data_vencimento', 'data_prevista', 'data_operacao_bancaria',
+        'data_pago_loja', 'data_recebimento', 'created_at', 'updated_at'
+    ],
+    'contas_pagar': ['data_emissao', 'data_vencimento', 'data_pagamento', 'created_at'],
+    'movimentacoes_financeiras': ['data', 'created_at'],
+    'lancamentos_financeiros': ['data', 'created_at'],
+    'ordens_producao': [
+        'data_pedido', 'data_pagamento', 'data_entrega_prometida', 'data_entrada',
+        'data_aprovacao_gerencia', 'data_aprovacao_financeiro', 'created_at', 'updated_at'
+    ],
+    'pedidos_lojas': ['prazo_entrega', 'created_at', 'updated_at'],
+    # A flag atrasado é mantida pelo agendador a partir de prazo_entrega (datetime)
+    'pedidos_marketplace': [
+        'prazo_entrega', 'data_prevista_envio', 'created_at', 'updated_at',
+        'data_producao', 'data_pronto', 'data_embalagem', 'data_envio', 'data_entrega'
+    ],
+    'tarefas_marketing': ['data_hora', 'concluida_em', 'created_at', 'updated_at'],
+    # "data" do relatório é o dia (YYYY-MM-DD), chave do relatório diário: continua string
+    'relatorios_progresso': ['created_at'],
+}
+
+# Coleção -> (array, campo de data de cada item)
+CAMPOS_EM_ARRAYS = {
+    'pedidos_manufatura': [('historico_status', 'data')],
+    'ordens_producao': [('timeline', 'data_hora'), ('historico_aprovacoes', 'data_aprovacao')],
+    'tarefas_marketing': [('checklist', 'created_at'), ('comentarios', 'created_at'), ('arquivos', 'created_at')],
+}
+
+def para_datetime(valor):
+    """Converte string ISO em datetime UTC. Retorna None se não for possível."""
+    if not isinstance(valor, str) or not valor:
+        return None
+    try:
+        dt = datetime.fromisoformat(valor.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+def migrar_colecao(db, nome, campos, arrays):
+    colecao = db[nome]
+    filtro = {"$or": [{campo: {"$type": "string"}} for campo in campos] +
+                     [{f"{array}.{campo}": {"$type": "string"}} for array, campo in arrays]}
+
+    operacoes = []
+    convertidos = 0
+    invalidos = 0
+    for doc in colecao.find(filtro, {campo: 1 for campo in campos} | {array: 1 for array, _ in arrays}):
+        update = {}
+        for campo in campos:
+            if isinstance(doc.get(campo), str):
+                dt = para_datetime(doc[campo])
+                if dt:
+                    update[campo] = dt
+                else:
+                    invalidos += 1
+        for array, campo in arrays:
+            itens = doc.get(array) or []
+            alterado = False
+            for item in itens:
+                if isinstance(item, dict) and isinstance(item.get(campo), str):
+                    dt = para_datetime(item[campo])
+                    if dt:
+                        item[campo] = dt
+                        alterado = True
+            if alterado:
+                update[array] = itens
+        if update:
+            operacoes.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+
+        if len(operacoes) >= 1000:
+            convertidos += colecao.bulk_write(operacoes, ordered=False).modified_count
+            operacoes = []
+
+    if operacoes:
+        convertidos += colecao.bulk_write(operacoes, ordered=False).modified_count
+    return convertidos, invalidos
+
+try:
+    client = MongoClient(mongo_url)
+    db = client[db_name]
+
+    print(f"\n🔧 Migrando datas para datetime BSON no banco '{db_name}'...")
+    print("=" * 60)
+
+    for nome, campos in CAMPOS_POR_COLECAO.items():
+        convertidos, invalidos = migrar_colecao(db, nome, campos, CAMPOS_EM_ARRAYS.get(nome, []))
+        print(f"✅ {nome}: documentos convertidos: {convertidos}")
+        if invalidos:
+            print(f"⚠️  {nome}: {invalidos} valor(es) não reconhecidos como data ISO foram mantidos")
+
+    print("\n" + "=" * 60)
+    print("✅ Migração concluída!")
+
+except Exception as e:
+    print(f"\n❌ ERRO: {e}")
+    sys.exit(1)
+finally:
+    if 'client' in locals():
+        client.close()
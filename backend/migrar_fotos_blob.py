@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Script para extrair imagens gravadas como data URL (base64) dentro dos documentos
+e movê-las para o blob store em /app/uploads, deixando apenas a URL no documento.
+
+Afeta:
+- ordens_producao: fotos_entrada_material, fotos_trabalho_pronto (listas)
+- pedidos_manufatura: imagem_anexada
+
+Pode ser executado mais de uma vez: só converte o que ainda for data URL.
+"""
+
+import sys
+import os
+import base64
+import binascii
+from pymongo import MongoClient, UpdateOne
+from dotenv import load_dotenv
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+from blob_store import salvar_bytes
+
+mongo_url = os.environ.get('MONGO_URL')
+db_name = os.environ.get('DB_NAME', 'gestao_manufatura')
+
+if not mongo_url:
+    print("❌ ERRO: MONGO_URL não encontrado no .env")
+    sys.exit(1)
+
+# Coleção -> campos com imagens (string ou lista de strings)
+CAMPOS_POR_COLECAO = {
+    'ordens_producao': ['fotos_entrada_material', 'fotos_trabalho_pronto'],
+    'pedidos_manufatura': ['imagem_anexada'],
+}
+
+def extrair_data_url(valor):
+    """Grava o conteúdo de uma data URL no blob store e retorna a URL do blob.
+    Retorna None se o valor não for uma data URL base64 válida."""
+    if not isinstance(valor, str) or not valor.startswith('data:') or ';base64,' not in valor:
+        return None
+    cabecalho, dados = valor.split(',', 1)
+    content_type = cabecalho[len('data:'):].split(';')[0] or None
+    try:
+        conteudo = base64.b64decode(dados, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return salvar_bytes(conteudo, content_type)['url']
+
+def migrar_colecao(db, nome, campos):
+    colecao = db[nome]
+    filtro = {"$or": [{campo: {"$regex": "^data:"}} for campo in campos]}
+
+    operacoes = []
+    convertidos = 0
+    imagens = 0
+    for doc in colecao.find(filtro, {campo: 1 for campo in campos}):
+        update = {}
+        for campo in campos:
+            valor = doc.get(campo)
+            if isinstance(valor, list):
+                novos = []
+                alterado = False
+                for item in valor:
+                    url = extrair_data_url(item)
+                    if url:
+                        alterado = True
+                        imagens += 1
+                    novos.append(url or item)
+                if alterado:
+                    update[campo] = novos
+            else:
+                url = extrair_data_url(valor)
+                if url:
+                    update[campo] = url
+                    imagens += 1
+        if update:
+            operacoes.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+
+        if len(operacoes) >= 100:
+            convertidos += colecao.bulk_write(operacoes, ordered=False).modified_count
+            operacoes = []
+
+    if operacoes:
+        convertidos += colecao.bulk_write(operacoes, ordered=False).modified_count
+    return convertidos, imagens
+
+try:
+    client = MongoClient(mongo_url)
+    db = client[db_name]
+
+    print(f"\n🔧 Extraindo imagens base64 para o blob store no banco '{db_name}'...")
+    print("=" * 60)
+
+    for nome, campos in CAMPOS_POR_COLECAO.items():
+        convertidos, imagens = migrar_colecao(db, nome, campos)
+        print(f"✅ {nome}: {imagens} imagem(ns) extraída(s) de {convertidos} documento(s)")
+
+    print("\n" + "=" * 60)
+    print("✅ Migração concluída!")
+
+except Exception as e:
+    print(f"\n❌ ERRO: {e}")
+    sys.exit(1)
+finally:
+    if 'client' in locals():
+        client.close()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Script para mover o histórico de atividades embutido nos cards do kanban
+(campo atividades) para a coleção kanban_atividades.
+
+Cada atividade vira um documento com card_id e data (datetime BSON); o array é
+removido do card. Pode ser executado mais de uma vez: só processa cards que ainda
+têm o array.
+"""
+
+import sys
+import os
+from datetime import datetime, timezone
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from dotenv import load_dotenv
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+mongo_url = os.environ.get('MONGO_URL')
+db_name = os.environ.get('DB_NAME', 'gestao_manufatura')
+
+if not mongo_url:
+    print("❌ ERRO: MONGO_URL não encontrado no .env")
+    sys.exit(1)
+
+def para_datetime(valor):
+    """Datas antigas estão como string ISO; ausentes viram o início da época"""
+    if isinstance(valor, str) and valor:
+        try:
+            valor = datetime.fromisoformat(valor.replace('Z', '+00:00'))
+        except ValueError:
+            valor = None
+    if not isinstance(valor, datetime):
+        return datetime.fromtimestamp(0, timezone.utc)
+    return valor if valor.tzinfo else valor.replace(tzinfo=timezone.utc)
+
+try:
+    client = MongoClient(mongo_url)
+    db = client[db_name]
+
+    print(f"\n🔧 Movendo atividades dos cards para kanban_atividades no banco '{db_name}'...")
+    print("=" * 60)
+
+    db.kanban_atividades.create_index([("card_id", ASCENDING), ("data", DESCENDING)])
+
+    cards_migrados = 0
+    total_atividades = 0
+    for card in db.kanban_cards.find({"atividades": {"$exists": True}}, {"id": 1, "atividades": 1}):
+        atividades = [
+            {**atividade, "card_id": card["id"], "data": para_datetime(atividade.get("data"))}
+            for atividade in card.get("atividades") or []
+        ]
+        if atividades:
+            db.kanban_atividades.insert_many(atividades)
+        db.kanban_cards.update_one({"_id": card["_id"]}, {"$unset": {"atividades": ""}})
+        cards_migrados += 1
+        total_atividades += len(atividades)
+
+    print(f"✅ kanban_cards: {cards_migrados} card(s) migrado(s), {total_atividades} atividade(s) gravada(s)")
+    print("\n" + "=" * 60)
+    print("✅ Migração concluída!")
+
+except Exception as e:
+    print(f"\n❌ ERRO: {e}")
+    sys.exit(1)
+finally:
+    if 'client' in locals():
+        client.close()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Script para converter a ordenação do kanban de posições inteiras (posicao) para
+ranks fracionários (rank), usados por mover_card e reordenar_colunas.
+
+Mantém a ordem atual de cada coluna (cards) e de cada board (colunas) e remove o
+campo posicao. Pode ser executado mais de uma vez: só processa documentos sem rank.
+"""
+
+import sys
+import os
+from pymongo import MongoClient, UpdateOne, ASCENDING
+from dotenv import load_dotenv
+
+from kanban_rank import ranks_distribuidos
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+mongo_url = os.environ.get('MONGO_URL')
+db_name = os.environ.get('DB_NAME', 'gestao_manufatura')
+
+if not mongo_url:
+    print("❌ ERRO: MONGO_URL não encontrado no .env")
+    sys.exit(1)
+
+def migrar_colecao(colecao, campo_grupo):
+    """Atribui ranks por grupo (coluna_id ou board_id), na ordem de posicao"""
+    grupos = colecao.distinct(campo_grupo, {"rank": {"$exists": False}})
+    atualizados = 0
+    for grupo in grupos:
+        itens = list(colecao.find({campo_grupo: grupo}, {"_id": 1, "posicao": 1}).sort([("posicao", ASCENDING), ("_id", ASCENDING)]))
+        operacoes = [
+            UpdateOne({"_id": item["_id"]}, {"$set": {"rank": rank}, "$unset": {"posicao": ""}})
+            for item, rank in zip(itens, ranks_distribuidos(len(itens)))
+        ]
+        if operacoes:
+            colecao.bulk_write(operacoes, ordered=False)
+            atualizados += len(operacoes)
+    return len(grupos), atualizados
+
+try:
+    client = MongoClient(mongo_url)
+    db = client[db_name]
+
+    print(f"\n🔧 Convertendo posições do kanban para ranks no banco '{db_name}'...")
+    print("=" * 60)
+
+    boards, colunas = migrar_colecao(db.kanban_colunas, "board_id")
+    print(f"✅ kanban_colunas: {colunas} coluna(s) em {boards} board(s)")
+
+    grupos, cards = migrar_colecao(db.kanban_cards, "coluna_id")
+    print(f"✅ kanban_cards: {cards} card(s) em {grupos} coluna(s)")
+
+    db.kanban_cards.create_index([("coluna_id", ASCENDING), ("rank", ASCENDING)])
+    db.kanban_colunas.create_index([("board_id", ASCENDING), ("rank", ASCENDING)])
+
+    print("\n" + "=" * 60)
+    print("✅ Migração concluída!")
+
+except Exception as e:
+    print(f"\n❌ ERRO: {e}")
+    sys.exit(1)
+finally:
+    if 'client' in locals():
+        client.close()
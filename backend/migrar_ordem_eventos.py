@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Script para mover a timeline e o histórico de aprovações embutidos nas ordens de
+produção para a coleção append-only ordem_eventos.
+
+Cada ordem fica apenas com ultimos_eventos (os 5 mais recentes); os arrays
+timeline e historico_aprovacoes são removidos do documento.
+Pode ser executado mais de uma vez: só processa ordens que ainda têm os arrays.
+"""
+
+import sys
+import os
+import uuid
+from datetime import datetime, timezone
+from pymongo import MongoClient, ASCENDING
+from dotenv import load_dotenv
+
+# Carregar variáveis de ambiente
+load_dotenv()
+
+mongo_url = os.environ.get('MONGO_URL')
+db_name = os.environ.get('DB_NAME', 'gestao_manufatura')
+
+if not mongo_url:
+    print("❌ ERRO: MONGO_URL não encontrado no .env")
+    sys.exit(1)
+
+ULTIMOS_EVENTOS_ORDEM = 5
+
+def para_datetime(valor):
+    """Datas antigas podem estar como string ISO; ausentes viram o início da época"""
+    if isinstance(valor, str) and valor:
+        try:
+            valor = datetime.fromisoformat(valor.replace('Z', '+00:00'))
+        except ValueError:
+            valor = None
+    if not isinstance(valor, datetime):
+        return datetime.fromtimestamp(0, timezone.utc)
+    return valor if valor.tzinfo else valor.replace(tzinfo=timezone.utc)
+
+def eventos_da_ordem(ordem):
+    eventos = []
+    for entrada in ordem.get('timeline') or []:
+        eventos.append({
+            'id': str(uuid.uuid4()),
+            'ordem_id': ordem['id'],
+            'tipo': 'timeline',
+            'data_hora': para_datetime(entrada.get('data_hora')),
+            'usuario': entrada.get('usuario', ''),
+            'mudanca': entrada.get('mudanca', ''),
+            'comentario': entrada.get('comentario') or ''
+        })
+    for aprovacao in ordem.get('historico_aprovacoes') or []:
+        eventos.append({
+            'id': str(uuid.uuid4()),
+            'ordem_id': ordem['id'],
+            'tipo': 'aprovacao',
+            'data_hora': para_datetime(aprovacao.get('data_aprovacao')),
+            'usuario': '',
+            'mudanca': f"Aprovada por {aprovacao.get('responsavel', '')}",
+            'comentario': aprovacao.get('observacao') or '',
+            'responsavel': aprovacao.get('responsavel', '')
+        })
+    eventos.sort(key=lambda evento: evento['data_hora'])
+    return eventos
+
+try:
+    client = MongoClient(mongo_url)
+    db = client[db_name]
+
+    print(f"\n🔧 Movendo timeline/aprovações para ordem_eventos no banco '{db_name}'...")
+    print("=" * 60)
+
+    db.ordem_eventos.create_index([("ordem_id", ASCENDING), ("data_hora", ASCENDING)])
+
+    ordens_migradas = 0
+    total_eventos = 0
+    filtro = {"$or": [{"timeline": {"$exists": True}}, {"historico_aprovacoes": {"$exists": True}}]}
+    for ordem in db.ordens_producao.find(filtro, {"id": 1, "timeline": 1, "historico_aprovacoes": 1, "ultimos_eventos": 1}):
+        eventos = eventos_da_ordem(ordem)
+        if eventos:
+            db.ordem_eventos.insert_many([dict(evento) for evento in eventos])
+        ultimos = sorted((ordem.get('ultimos_eventos') or []) + eventos, key=lambda e: para_datetime(e.get('data_hora')))
+        db.ordens_producao.update_one(
+            {"_id": ordem["_id"]},
+            {
+                "$set": {"ultimos_eventos": ultimos[-ULTIMOS_EVENTOS_ORDEM:]},
+                "$unset": {"timeline": "", "historico_aprovacoes": ""}
+            }
+        )
+        ordens_migradas += 1
+        total_eventos += len(eventos)
+
+    print(f"✅ ordens_producao: {ordens_migradas} ordem(ns) migrada(s), {total_eventos} evento(s) gravado(s)")
+    print("\n" + "=" * 60)
+    print("✅ Migração concluída!")
+
+except Exception as e:
+    print(f"\n❌ ERRO: {e}")
+    sys.exit(1)
+finally:
+    if 'client' in locals():
+        client.close()
@@ -0,0 +1,40 @@
+"""
+Notificações Module
+Canal de eventos em memória (pub/sub por destinatário) para os streams SSE
+"""
+import asyncio
+import json
+from typing import Dict, Set
+
+from fastapi.encoders import jsonable_encoder
+
+class CanalEventos:
+    """Entrega eventos aos streams inscritos para um destinatário neste processo"""
+
+    def __init__(self, tamanho_fila: int = 100):
+        self.tamanho_fila = tamanho_fila
+        self._inscritos: Dict[str, Set[asyncio.Queue]] = {}
+
+    def inscrever(self, destinatario: str) -> asyncio.Queue:
+        fila = asyncio.Queue(maxsize=self.tamanho_fila)
+        self._inscritos.setdefault(destinatario, set()).add(fila)
+        return fila
+
+    def cancelar(self, destinatario: str, fila: asyncio.Queue):
+        filas = self._inscritos.get(destinatario)
+        if filas is not None:
+            filas.discard(fila)
+            if not filas:
+                del self._inscritos[destinatario]
+
+    def publicar(self, destinatario: str, tipo: str, dados: dict):
+        for fila in list(self._inscritos.get(destinatario, ())):
+            try:
+                fila.put_nowait({'tipo': tipo, 'dados': dados})
+            except asyncio.QueueFull:
+                # Cliente lento: descarta o evento; a ressincronização periódica do stream recupera o estado
+                pass
+
+def formatar_sse(tipo: str, dados) -> str:
+    """Formata uma mensagem Server-Sent Events"""
+    return f"event: {tipo}\ndata: {json.dumps(jsonable_encoder(dados))}\n\n"
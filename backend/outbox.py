@@ -0,0 +1,186 @@
+"""
+Outbox Module
+Efeitos colaterais confiáveis para mudanças de estado (transactional outbox)
+
+A rota grava o evento dentro do próprio documento alterado, no mesmo update_one
+da mudança de estado (operação atômica em um único documento). Um worker em
+background entrega cada evento aos handlers registrados para o seu tipo, com
+retentativas e sem repetir handlers que já concluíram. Eventos que esgotam as
+tentativas saem do documento e ficam na coleção outbox_falhas para análise.
+"""
+import asyncio
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Callable, Dict, List
+
+# Coleções cujos documentos podem carregar eventos pendentes no campo "outbox"
+COLECOES_OUTBOX = ['pedidos_manufatura']
+
+MAX_TENTATIVAS = 5
+RESERVA_SEGUNDOS = 60
+INTERVALO_VARREDURA_SEGUNDOS = 30
+
+# tipo do evento -> handlers async (db, evento) registrados
+_handlers: Dict[str, List[Callable]] = {}
+
+_acordar = asyncio.Event()
+_worker = None
+
+def handler(tipo: str):
+    """Decorator que registra um handler async (db, evento) para um tipo de evento"""
+    def registrar(func):
+        _handlers.setdefault(tipo, []).append(func)
+        return func
+    return registrar
+
+def novo_evento(tipo: str, payload: dict) -> dict:
+    """Monta um evento pendente para ser gravado com $push no campo "outbox" do documento"""
+    agora = datetime.now(timezone.utc)
+    return {
+        'id': str(uuid.uuid4()),
+        'tipo': tipo,
+        'payload': payload,
+        'status': 'pendente',
+        'tentativas': 0,
+        'handlers_concluidos': [],
+        'ultimo_erro': None,
+        'proxima_tentativa': agora,
+        'created_at': agora
+    }
+
+def notificar():
+    """Acorda o worker para processar imediatamente os eventos recém gravados"""
+    _acordar.set()
+
+async def criar_indices_outbox(db):
+    """Índice para a varredura de eventos pendentes"""
+    for nome in COLECOES_OUTBOX:
+        await db[nome].create_index(
+            [("outbox.status", 1), ("outbox.proxima_tentativa", 1)],
+            partialFilterExpression={"outbox.status": "pendente"}
+        )
+
+async def _arquivar_falha(db, colecao, documento_id, evento):
+    """Move o evento que esgotou as tentativas para outbox_falhas, fora do documento"""
+    await db.outbox_falhas.update_one(
+        {"id": evento['id']},
+        {"$setOnInsert": {**evento, 'colecao': colecao, 'documento_id': documento_id, 'falhou_em': datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    await db[colecao].update_one({"id": documento_id}, {"$pull": {"outbox": {"id": evento['id']}}})
+
+async def arquivar_falhas_existentes(db) -> int:
+    """Move para outbox_falhas os eventos "falhou" gravados nos documentos antes do arquivamento"""
+    arquivados = 0
+    for colecao in COLECOES_OUTBOX:
+        async for documento in db[colecao].find({"outbox.status": "falhou"}, {"_id": 0, "id": 1, "outbox": 1}):
+            for evento in documento.get('outbox', []):
+                if evento.get('status') == 'falhou':
+                    await _arquivar_falha(db, colecao, documento['id'], evento)
+                    arquivados += 1
+    return arquivados
+
+async def _processar_evento(db, colecao, documento_id, evento):
+    """Executa os handlers ainda não concluídos de um evento e atualiza seu estado no documento"""
+    filtro = {"id": documento_id}
+    filtro_evento = [{"e.id": evento['id']}]
+    
+    # Reserva o evento por alguns segundos para que outro worker (outro processo) não o execute junto
+    agora = datetime.now(timezone.utc)
+    reserva = await db[colecao].update_one(
+        {"id": documento_id, "outbox": {"$elemMatch": {
+            "id": evento['id'], "status": "pendente", "proxima_tentativa": {"$lte": agora}
+        }}},
+        {"$set": {"outbox.$[e].proxima_tentativa": agora + timedelta(seconds=RESERVA_SEGUNDOS)}},
+        array_filters=filtro_evento
+    )
+    if reserva.modified_count == 0:
+        return False
+    
+    concluidos = list(evento.get('handlers_concluidos', []))
+
+    for func in _handlers.get(evento['tipo'], []):
+        if func.__name__ in concluidos:
+            continue
+        try:
+            await func(db, evento)
+        except Exception as e:
+            tentativas = evento.get('tentativas', 0) + 1
+            atualizacao = {
+                "outbox.$[e].tentativas": tentativas,
+                "outbox.$[e].ultimo_erro": f"{func.__name__}: {e}",
+                # Backoff exponencial: 10s, 20s, 40s...
+                "outbox.$[e].proxima_tentativa": datetime.now(timezone.utc) + timedelta(seconds=10 * 2 ** (tentativas - 1))
+            }
+            if tentativas >= MAX_TENTATIVAS:
+                await _arquivar_falha(db, colecao, documento_id, {
+                    **evento, 'status': 'falhou', 'tentativas': tentativas,
+                    'ultimo_erro': atualizacao["outbox.$[e].ultimo_erro"], 'handlers_concluidos': concluidos
+                })
+            else:
+                await db[colecao].update_one(filtro, {"$set": atualizacao}, array_filters=filtro_evento)
+            print(f"❌ Outbox: evento {evento['tipo']} ({evento['id']}) falhou em {func.__name__} "
+                  f"[tentativa {tentativas}/{MAX_TENTATIVAS}]: {e}")
+            return True
+
+        # Marca o handler como concluído para não repeti-lo em uma nova tentativa
+        concluidos.append(func.__name__)
+        await db[colecao].update_one(
+            filtro,
+            {"$addToSet": {"outbox.$[e].handlers_concluidos": func.__name__}},
+            array_filters=filtro_evento
+        )
+
+    # Todos os handlers concluídos: remove o evento do documento
+    await db[colecao].update_one(filtro, {"$pull": {"outbox": {"id": evento['id']}}})
+    return True
+
+async def processar_pendentes(db) -> int:
+    """Processa os eventos pendentes cuja próxima tentativa já venceu. Retorna quantos foram processados."""
+    processados = 0
+    agora = datetime.now(timezone.utc)
+    for colecao in COLECOES_OUTBOX:
+        documentos = db[colecao].find(
+            {"outbox": {"$elemMatch": {"status": "pendente", "proxima_tentativa": {"$lte": agora}}}},
+            {"_id": 0, "id": 1, "outbox": 1}
+        )
+        async for documento in documentos:
+            for evento in documento.get('outbox', []):
+                proxima = evento.get('proxima_tentativa')
+                if proxima and proxima.tzinfo is None:
+                    proxima = proxima.replace(tzinfo=timezone.utc)
+                if evento.get('status') != 'pendente' or (proxima and proxima > agora):
+                    continue
+                if await _processar_evento(db, colecao, documento['id'], evento):
+                    processados += 1
+    return processados
+
+async def _executar_worker(db):
+    while True:
+        try:
+            await processar_pendentes(db)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Outbox: erro ao processar eventos pendentes: {e}")
+        try:
+            await asyncio.wait_for(_acordar.wait(), timeout=INTERVALO_VARREDURA_SEGUNDOS)
+        except asyncio.TimeoutError:
+            pass
+        _acordar.clear()
+
+def iniciar_worker(db):
+    """Inicia o worker do outbox no event loop da aplicação"""
+    global _worker
+    if _worker is None or _worker.done():
+        _worker = asyncio.create_task(_executar_worker(db))
+
+async def parar_worker():
+    global _worker
+    if _worker is not None:
+        _worker.cancel()
+        try:
+            await _worker
+        except asyncio.CancelledError:
+            pass
+        _worker = None
@@ -0,0 +1,83 @@
+"""
+Pedidos Atrasados Module
+Flag "atrasado" dos pedidos de marketplace mantida no banco
+
+prazo_entrega é gravado como datetime BSON e a flag atrasado é calculada na escrita
+(criação, importação, edição). Entre as escritas, um worker em background vira a
+flag em lote quando o prazo vence (índice status + prazo_entrega) e a desfaz para
+pedidos entregues, cancelados ou com prazo adiado. Assim a listagem, o filtro
+?atrasado= e as contagens dos dashboards leem o mesmo valor. dias_atraso não é
+gravado: a listagem calcula com expressao_dias_atraso() em um $addFields.
+"""
+from datetime import datetime, timezone
+from typing import Optional
+
+from agendador_prazos import AgendadorPrazos, ler_prazo
+
+STATUS_FINALIZADOS = ["Entregue", "Cancelado"]
+
+MS_POR_DIA = 24 * 60 * 60 * 1000
+
+def esta_atrasado(pedido: dict, agora: Optional[datetime] = None) -> bool:
+    """Valor da flag para o pedido como será gravado (prazo_entrega já normalizado)"""
+    prazo = ler_prazo(pedido.get('prazo_entrega'))
+    if prazo is None or pedido.get('status') in STATUS_FINALIZADOS:
+        return False
+    return prazo < (agora or datetime.now(timezone.utc))
+
+def filtro_vencidos(agora: datetime) -> dict:
+    """Pedidos em aberto com prazo vencido que ainda não estão marcados"""
+    return {"status": {"$nin": STATUS_FINALIZADOS}, "prazo_entrega": {"$lt": agora}, "atrasado": {"$ne": True}}
+
+def filtro_em_dia(agora: datetime) -> dict:
+    """Pedidos marcados como atrasados que não estão mais: finalizados ou com prazo adiado"""
+    return {"atrasado": True, "$or": [
+        {"status": {"$in": STATUS_FINALIZADOS}},
+        {"prazo_entrega": {"$not": {"$lt": agora}}}
+    ]}
+
+def expressao_dias_atraso(agora: datetime) -> dict:
+    """Expressão de agregação: dias inteiros desde o prazo para pedidos atrasados, senão 0"""
+    return {"$cond": [
+        {"$and": [{"$eq": ["$atrasado", True]}, {"$eq": [{"$type": "$prazo_entrega"}, "date"]}]},
+        {"$max": [0, {"$floor": {"$divide": [{"$subtract": [agora, "$prazo_entrega"]}, MS_POR_DIA]}}]},
+        0
+    ]}
+
+async def atualizar_pedidos_atrasados(db, agora: Optional[datetime] = None) -> tuple:
+    """Vira a flag em lote nos dois sentidos. Retorna (marcados, desmarcados)."""
+    agora = agora or datetime.now(timezone.utc)
+    marcados = await db.pedidos_marketplace.update_many(
+        filtro_vencidos(agora), {"$set": {"atrasado": True}, "$inc": {"version": 1}}
+    )
+    desmarcados = await db.pedidos_marketplace.update_many(
+        filtro_em_dia(agora), {"$set": {"atrasado": False}, "$inc": {"version": 1}}
+    )
+    return marcados.modified_count, desmarcados.modified_count
+
+async def proximo_prazo(db, agora: datetime) -> Optional[datetime]:
+    """Prazo do próximo pedido em aberto a vencer"""
+    pedido = await db.pedidos_marketplace.find_one(
+        {"status": {"$nin": STATUS_FINALIZADOS}, "prazo_entrega": {"$gte": agora}},
+        {"_id": 0, "prazo_entrega": 1},
+        sort=[("prazo_entrega", 1)]
+    )
+    return ler_prazo(pedido['prazo_entrega']) if pedido else None
+
+async def _varrer(db, agora: datetime):
+    marcados, desmarcados = await atualizar_pedidos_atrasados(db, agora)
+    if marcados or desmarcados:
+        print(f"⏰ Pedidos marketplace: {marcados} marcado(s) e {desmarcados} desmarcado(s) como atrasado(s)")
+
+_agendador = AgendadorPrazos("Pedidos marketplace", _varrer, proximo_prazo)
+
+def reagendar():
+    """Acorda o agendador para recalcular o próximo prazo (pedido criado ou alterado)"""
+    _agendador.reagendar()
+
+def iniciar_agendador(db):
+    """Inicia o agendador no event loop da aplicação"""
+    _agendador.iniciar(db)
+
+async def parar_agendador():
+    await _agendador.parar()
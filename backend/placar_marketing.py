@@ -0,0 +1,169 @@
+"""
+Placar Marketing Module
+Estatísticas dos membros de marketing (gamificação) mantidas por incrementos
+
+Cada tarefa contribui para o placar do seu membro com um contador do seu status
+e com os pontos ganhos; cada relatório de progresso contribui com seus pontos.
+As rotas aplicam com $inc apenas a diferença entre a contribuição anterior e a
+nova, então o custo de uma edição não depende do histórico do membro. Uma
+reconciliação periódica recalcula o placar a partir das tarefas e relatórios,
+reporta as divergências encontradas e as corrige.
+"""
+import asyncio
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+# Status da tarefa -> contador do placar do membro
+CONTADORES_STATUS = {
+    "Concluído": "tarefas_concluidas",
+    "Atrasado": "tarefas_atrasadas",
+    "Em Andamento": "tarefas_em_andamento",
+}
+CAMPOS_PLACAR = (*CONTADORES_STATUS.values(), "pontuacao")
+
+INTERVALO_RECONCILIACAO_SEGUNDOS = 6 * 60 * 60
+
+_worker = None
+ultima_reconciliacao: Optional[dict] = None
+
+def contribuicao_tarefa(tarefa: Optional[dict]) -> Counter:
+    """Quanto uma tarefa soma no placar do seu membro"""
+    contribuicao = Counter()
+    if not tarefa:
+        return contribuicao
+    contador = CONTADORES_STATUS.get(tarefa.get('status'))
+    if contador:
+        contribuicao[contador] += 1
+    contribuicao['pontuacao'] += tarefa.get('pontos_ganhos') or 0
+    return contribuicao
+
+def deltas_tarefa(antes: Optional[dict], depois: Optional[dict]) -> Dict[str, Counter]:
+    """Incrementos por membro para a transição antes -> depois de uma tarefa
+    (None = tarefa inexistente: criação ou exclusão). Trata troca de membro."""
+    deltas: Dict[str, Counter] = {}
+    if antes:
+        deltas.setdefault(antes['membro_id'], Counter()).subtract(contribuicao_tarefa(antes))
+    if depois:
+        deltas.setdefault(depois['membro_id'], Counter()).update(contribuicao_tarefa(depois))
+    return deltas
+
+async def aplicar_deltas(db, deltas: Dict[str, Counter]):
+    """Aplica os incrementos com um $inc por membro (membros sem diferença são ignorados)"""
+    for membro_id, delta in deltas.items():
+        incrementos = {campo: valor for campo, valor in delta.items() if valor}
+        if incrementos:
+            await db.membros_marketing.update_one(
+                {"id": membro_id},
+                {"$inc": incrementos, "$set": {"updated_at": datetime.now(timezone.utc)}}
+            )
+
+async def registrar_transicao_tarefa(db, antes: Optional[dict], depois: Optional[dict]):
+    await aplicar_deltas(db, deltas_tarefa(antes, depois))
+
+async def registrar_atrasos(db, membro_id: str, grupos):
+    """Tarefas do membro que o agendador marcou como atrasadas: [(status_anterior, quantidade), ...]"""
+    delta = Counter()
+    for status_anterior, quantidade in grupos:
+        contador = CONTADORES_STATUS.get(status_anterior)
+        if contador:
+            delta[contador] -= quantidade
+        delta['tarefas_atrasadas'] += quantidade
+    await aplicar_deltas(db, {membro_id: delta})
+
+async def registrar_relatorio(db, relatorio: dict):
+    await aplicar_deltas(db, {relatorio['membro_id']: Counter(pontuacao=relatorio.get('total_pontos_dia', 0))})
+
+async def calcular_placar(db) -> Dict[str, Counter]:
+    """Placar de todos os membros recalculado do zero (duas agregações)"""
+    placar: Dict[str, Counter] = {}
+    grupos_status = {
+        contador: {"$sum": {"$cond": [{"$eq": ["$status", status]}, 1, 0]}}
+        for status, contador in CONTADORES_STATUS.items()
+    }
+    tarefas = await db.tarefas_marketing.aggregate([
+        {"$group": {"_id": "$membro_id", **grupos_status, "pontuacao": {"$sum": {"$ifNull": ["$pontos_ganhos", 0]}}}}
+    ]).to_list(None)
+    for grupo in tarefas:
+        placar[grupo['_id']] = Counter({campo: grupo.get(campo, 0) for campo in CAMPOS_PLACAR})
+
+    relatorios = await db.relatorios_progresso.aggregate([
+        {"$group": {"_id": "$membro_id", "pontuacao": {"$sum": {"$ifNull": ["$total_pontos_dia", 0]}}}}
+    ]).to_list(None)
+    for grupo in relatorios:
+        placar.setdefault(grupo['_id'], Counter())['pontuacao'] += grupo['pontuacao']
+    return placar
+
+async def reconciliar_placar(db, corrigir: bool = True) -> dict:
+    """Compara o placar gravado com o recalculado. Retorna as divergências e, se corrigir, corrige cada
+    membro com $inc da diferença, condicionado aos valores lidos: um membro que recebeu incrementos
+    das rotas durante a reconciliação fica como está e é conferido na próxima execução."""
+    global ultima_reconciliacao
+    # Membros lidos antes do recálculo: incrementos posteriores mudam updated_at e barram a correção
+    membros = await db.membros_marketing.find(
+        {}, {"_id": 0, "id": 1, "nome": 1, "updated_at": 1, **{c: 1 for c in CAMPOS_PLACAR}}
+    ).to_list(None)
+    placar = await calcular_placar(db)
+    divergencias: List[dict] = []
+    for membro in membros:
+        correto = placar.get(membro['id'], Counter())
+        diferencas = {
+            campo: {"gravado": membro.get(campo, 0), "correto": correto.get(campo, 0)}
+            for campo in CAMPOS_PLACAR
+            if (membro.get(campo) or 0) != correto.get(campo, 0)
+        }
+        if not diferencas:
+            continue
+        divergencia = {"membro_id": membro['id'], "membro_nome": membro.get('nome'), "campos": diferencas, "corrigido": False}
+        divergencias.append(divergencia)
+        if corrigir:
+            resultado = await db.membros_marketing.update_one(
+                {
+                    "id": membro['id'],
+                    "updated_at": membro.get('updated_at'),
+                    **{campo: membro.get(campo) for campo in CAMPOS_PLACAR}
+                },
+                {
+                    "$inc": {campo: valores['correto'] - (valores['gravado'] or 0) for campo, valores in diferencas.items()},
+                    "$set": {"updated_at": datetime.now(timezone.utc)}
+                }
+            )
+            divergencia['corrigido'] = resultado.modified_count == 1
+
+    ultima_reconciliacao = {
+        "executada_em": datetime.now(timezone.utc),
+        "membros_verificados": len(membros),
+        "divergencias": divergencias,
+        "corrigido": corrigir
+    }
+    if divergencias:
+        corrigidas = sum(d['corrigido'] for d in divergencias)
+        print(f"⚠️ Placar marketing: {len(divergencias)} membro(s) com placar divergente"
+              f"{f' ({corrigidas} corrigido(s))' if corrigir else ''}: {[d['membro_nome'] for d in divergencias]}")
+    return ultima_reconciliacao
+
+async def _executar_reconciliacao(db):
+    while True:
+        try:
+            await reconciliar_placar(db)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Placar marketing: erro na reconciliação: {e}")
+        await asyncio.sleep(INTERVALO_RECONCILIACAO_SEGUNDOS)
+
+def iniciar_reconciliacao(db):
+    """Inicia a reconciliação periódica no event loop da aplicação"""
+    global _worker
+    if _worker is None or _worker.done():
+        _worker = asyncio.create_task(_executar_reconciliacao(db))
+
+async def parar_reconciliacao():
+    global _worker
+    if _worker is not None:
+        _worker.cancel()
+        try:
+            await _worker
+        except asyncio.CancelledError:
+            pass
+        _worker = None
@@ -1,25 +1,45 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, File, UploadFile, Request, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, ValidationError
+from pydantic import BaseModel, Field, ConfigDict, ValidationError, TypeAdapter
 from typing import List, Optional
 import uuid
+import time
+import hashlib
+import orjson
+import asyncio
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
 
+import outbox
+import blob_store
+import imagens
+import tarefas_atrasadas
+import pedidos_atrasados
+import busca_pedidos
+import placar_marketing
+from cache_respostas import CacheRespostas, CacheRespostasMiddleware, RegraCache, etag_confere
+from notificacoes import CanalEventos, formatar_sse
+from kanban_rank import rank_entre, ranks_distribuidos, precisa_rebalancear
+from uploads_static import UploadsStaticFiles
+from contas_receber_service import CAMPOS_PEDIDO, criar_indices_contas_receber, gerar_contas_receber_pedido
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Datas voltam do banco com fuso UTC: serializadas com offset, o navegador não as lê como hora local
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, tzinfo=timezone.utc)
 db = client[os.environ['DB_NAME']]
 
 # JWT Configuration
@@ -30,8 +50,40 @@ JWT_EXPIRATION_HOURS = 24
 # Security
 security = HTTPBearer()
 
+# ============= RESPOSTAS JSON E CONSULTAS SEM _id =============
+
+def _serializar_extra(valor):
+    """Tipos que o orjson não conhece: modelos Pydantic viram dict; o resto (ObjectId, Decimal128...) vira string"""
+    if isinstance(valor, BaseModel):
+        return valor.model_dump(mode='json')
+    return str(valor)
+
+class RespostaJSON(ORJSONResponse):
+    """Resposta padrão da API, serializada com orjson (datetimes em ISO, sempre com offset;
+    datetime sem fuso é tratado como UTC). Rotas que devolvem RespostaJSON(documentos)
+    direto também pulam o jsonable_encoder."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_serializar_extra, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC)
+
+def sem_id(projecao: Optional[dict] = None) -> dict:
+    """Projeção que nunca traz o _id (ObjectId não é serializável em JSON)"""
+    return {**(projecao or {}), "_id": 0}
+
+def buscar(colecao, filtro: Optional[dict] = None, projecao: Optional[dict] = None, **opcoes):
+    """find() que já exclui o _id no banco: os documentos saem prontos para a resposta"""
+    return colecao.find(filtro or {}, sem_id(projecao), **opcoes)
+
+async def buscar_um(colecao, filtro: dict, projecao: Optional[dict] = None, **opcoes) -> Optional[dict]:
+    return await colecao.find_one(filtro, sem_id(projecao), **opcoes)
+
+async def inserir(colecao, documento: dict) -> dict:
+    """insert_one de uma cópia: o _id que o driver acrescenta não aparece no documento devolvido"""
+    await colecao.insert_one(dict(documento))
+    return documento
+
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=RespostaJSON)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -340,6 +392,182 @@ def is_director_or_manager(user: dict) -> bool:
     role = user.get('role', '').lower()
     return role in ['diretor', 'gerente', 'director', 'manager']
 
+# Campos de data que devem ser gravados como datetime BSON (nunca como string ISO)
+CAMPOS_DATA = (
+    'data', 'data_abertura', 'data_emissao', 'data_vencimento', 'data_prevista',
+    'data_operacao_bancaria', 'data_pago_loja', 'data_recebimento', 'data_pagamento',
+    'data_pedido', 'data_entrega_prometida', 'prazo_entrega', 'created_at', 'updated_at'
+)
+
+def para_datetime(valor):
+    """Converte string ISO (com 'Z', offset ou sem fuso) em datetime UTC. Outros valores passam intactos."""
+    if isinstance(valor, str) and valor:
+        try:
+            valor = datetime.fromisoformat(valor.replace('Z', '+00:00'))
+        except ValueError:
+            return valor
+    if isinstance(valor, datetime) and valor.tzinfo is None:
+        valor = valor.replace(tzinfo=timezone.utc)
+    return valor
+
+def normalizar_datas(doc: dict, campos=CAMPOS_DATA) -> dict:
+    """Normaliza (in-place) os campos de data de um documento antes de gravar no MongoDB"""
+    for campo in campos:
+        if campo in doc:
+            doc[campo] = para_datetime(doc[campo])
+    return doc
+
+class CacheLocal:
+    """Cache em memória do processo, com expiração opcional (TTL) por entrada"""
+    
+    def __init__(self, ttl_segundos: Optional[float] = None):
+        self.ttl = ttl_segundos
+        self._dados = {}
+    
+    def get(self, chave):
+        entrada = self._dados.get(chave)
+        if entrada is None:
+            return None
+        valor, expira_em = entrada
+        if expira_em is not None and time.monotonic() > expira_em:
+            self._dados.pop(chave, None)
+            return None
+        return valor
+    
+    def set(self, chave, valor):
+        expira_em = time.monotonic() + self.ttl if self.ttl else None
+        self._dados[chave] = (valor, expira_em)
+    
+    def invalidar(self, afetado=None):
+        """Remove todas as entradas, ou apenas as chaves para as quais afetado(chave) é True"""
+        if afetado is None:
+            self._dados.clear()
+            return
+        for chave in [c for c in self._dados if afetado(c)]:
+            self._dados.pop(chave, None)
+
+class CacheReferencia(CacheLocal):
+    """Listas de referência (status, categorias, contas...) já serializadas, com versão.
+    
+    invalidar() é chamado pelos endpoints de create/update/delete da entidade e
+    incrementa a versão: uma leitura que começou antes da invalidação não grava o
+    resultado antigo no cache. O TTL limita a defasagem entre workers e scripts
+    que escrevem direto no banco.
+    """
+    
+    def __init__(self, ttl_segundos: float = 300):
+        super().__init__(ttl_segundos=ttl_segundos)
+        self.versao = 0
+    
+    def set(self, chave, valor, versao: int):
+        if versao == self.versao:
+            super().set(chave, valor)
+    
+    def invalidar(self):
+        self.versao += 1
+        super().invalidar()
+
+def serializar_com_etag(dados):
+    """Corpo JSON da resposta e ETag fraca derivada do seu hash"""
+    corpo = RespostaJSON(dados).body
+    return corpo, f'W/"{hashlib.sha1(corpo).hexdigest()[:20]}"'
+
+def resposta_com_etag(request: Request, corpo: bytes, etag: str) -> Response:
+    """200 com o corpo, ou 304 sem corpo se o cliente já tem essa versão (If-None-Match)"""
+    cabecalhos = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_confere(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=cabecalhos)
+    return Response(content=corpo, media_type="application/json", headers=cabecalhos)
+
+async def responder_referencia(request: Request, cache: CacheReferencia, chave, carregar):
+    """Serve uma lista de referência do cache; carregar() só roda em cache miss"""
+    entrada = cache.get(chave)
+    if entrada is None:
+        versao = cache.versao
+        entrada = serializar_com_etag(await carregar())
+        cache.set(chave, entrada, versao)
+    return resposta_com_etag(request, *entrada)
+
+# Dados de referência lidos em toda troca de tela
+cache_status_customizados = CacheReferencia()
+cache_grupos_categorias = CacheReferencia()
+cache_categorias = CacheReferencia()
+cache_contas_bancarias = CacheReferencia()
+cache_projetos_marketplace = CacheReferencia()
+
+MENSAGEM_VERSAO_DIVERGENTE = "Registro alterado por outro usuário. Recarregue antes de salvar."
+
+# Campos que PATCH nunca altera
+CAMPOS_PATCH_PROTEGIDOS = {'id', 'version', 'created_at', 'created_by', 'updated_at'}
+
+def validar_campos_patch(modelo, dados: dict, protegidos=frozenset()) -> dict:
+    """Valida um conjunto esparso de campos contra os tipos do modelo Pydantic.
+    Campos desconhecidos ou protegidos geram 422."""
+    invalidos = [campo for campo in dados if campo not in modelo.model_fields or campo in CAMPOS_PATCH_PROTEGIDOS | set(protegidos)]
+    if invalidos:
+        raise HTTPException(status_code=422, detail=f"Campos não podem ser alterados via PATCH: {', '.join(invalidos)}")
+    validados = {}
+    try:
+        for campo, valor in dados.items():
+            adaptador = TypeAdapter(modelo.model_fields[campo].annotation)
+            # dump_python converte sub-modelos em dicts, prontos para o MongoDB
+            validados[campo] = adaptador.dump_python(adaptador.validate_python(valor))
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+    return validados
+
+async def aplicar_patch(colecao, documento_id: str, campos: dict, versao_esperada: Optional[int], extras=None, campos_leitura=()):
+    """
+    Aplica uma atualização parcial com concorrência otimista pelo campo `version`.
+    Grava apenas os campos cujo valor mudou, mais o que extras(anterior, alteracoes)
+    retornar (ex: datas carimbadas pela mudança de status), e retorna
+    (documento_anterior, alteracoes, nova_versao).
+    Levanta 404 se o documento não existe e 409 se a versão não confere.
+    """
+    anterior = await colecao.find_one(
+        {"id": documento_id}, {"_id": 0, "version": 1, **{campo: 1 for campo in (*campos, *campos_leitura)}}
+    )
+    if anterior is None:
+        raise HTTPException(status_code=404, detail="Registro não encontrado")
+    
+    versao_atual = anterior.get('version', 0)
+    if versao_esperada is not None and versao_esperada != versao_atual:
+        raise HTTPException(status_code=409, detail={"message": MENSAGEM_VERSAO_DIVERGENTE, "version": versao_atual})
+    
+    alteracoes = {
+        campo: valor for campo, valor in campos.items()
+        if para_datetime(valor) != para_datetime(anterior.get(campo))
+    }
+    if not alteracoes:
+        return anterior, {}, versao_atual
+    if extras:
+        alteracoes.update(extras(anterior, alteracoes))
+    alteracoes.setdefault('updated_at', datetime.now(timezone.utc))
+    filtro_versao = {"version": versao_atual} if 'version' in anterior else {"version": {"$exists": False}}
+    resultado = await colecao.update_one(
+        {"id": documento_id, **filtro_versao},
+        {"$set": alteracoes, "$inc": {"version": 1}}
+    )
+    if resultado.matched_count == 0:
+        # Outra escrita aconteceu entre a leitura e a gravação
+        raise HTTPException(status_code=409, detail={"message": MENSAGEM_VERSAO_DIVERGENTE})
+    return anterior, alteracoes, versao_atual + 1
+
+def filtro_versao_put(documento_id: str, versao: Optional[int]) -> dict:
+    """Filtro de um PUT: com a `version` lida pelo cliente, a escrita só acontece se
+    ninguém alterou o documento depois da leitura (sem version, grava como antes)"""
+    if versao is None:
+        return {"id": documento_id}
+    # Documentos anteriores ao campo version valem como versão 0
+    return {"id": documento_id, "version": versao if versao else {"$in": [0, None]}}
+
+async def recusar_put_sem_match(colecao, documento_id: str):
+    """PUT que não encontrou o documento na versão enviada: 404 se ele não existe, senão 409"""
+    atual = await colecao.find_one({"id": documento_id}, {"_id": 0, "version": 1})
+    if atual is None:
+        raise HTTPException(status_code=404, detail="Registro não encontrado")
+    raise HTTPException(status_code=409, detail={"message": MENSAGEM_VERSAO_DIVERGENTE, "version": atual.get('version', 0)})
+
 # ============= AUTH ROUTES =============
 
 @api_router.get("/auth/me")
@@ -409,16 +637,8 @@ async def get_usuarios(current_user: dict = Depends(get_current_user)):
     if current_user.get('role') not in ['director', 'manager']:
         raise HTTPException(status_code=403, detail="Acesso negado")
     
-    usuarios = await db.users.find().to_list(None)
-    
-    # Remover _id e password_hash
-    for usuario in usuarios:
-        if '_id' in usuario:
-            del usuario['_id']
-        if 'password_hash' in usuario:
-            del usuario['password_hash']
-    
-    return usuarios
+    usuarios = await buscar(db.users, {}, {"password_hash": 0}).to_list(None)
+    return RespostaJSON(usuarios)
 
 class UserUpdate(BaseModel):
     username: str
@@ -445,11 +665,9 @@ async def create_usuario(user_data: UserRegister, current_user: dict = Depends(g
     
     doc = user.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
-    await db.users.insert_one(doc)
+    await inserir(db.users, doc)
     
-    # Remover _id e password_hash da resposta
-    if '_id' in doc:
-        del doc['_id']
+    # Remover password_hash da resposta
     if 'password_hash' in doc:
         del doc['password_hash']
     
@@ -479,13 +697,7 @@ async def update_usuario(user_id: str, user_data: UserUpdate, current_user: dict
     await db.users.update_one({"id": user_id}, {"$set": update_data})
     
     # Buscar e retornar usuário atualizado
-    usuario = await db.users.find_one({"id": user_id})
-    if usuario:
-        if '_id' in usuario:
-            del usuario['_id']
-        if 'password_hash' in usuario:
-            del usuario['password_hash']
-    
+    usuario = await buscar_um(db.users, {"id": user_id}, {"password_hash": 0})
     return usuario
 
 @api_router.delete("/gestao/usuarios/{user_id}")
@@ -560,7 +772,7 @@ async def create_production_item(item: ProductionItemCreate, current_user: dict
 
 @api_router.get("/production", response_model=List[ProductionItem])
 async def get_production_items(current_user: dict = Depends(get_current_user)):
-    items = await db.production_items.find({}, {"_id": 0}).to_list(1000)
+    items = await buscar(db.production_items, {}).to_list(1000)
     for item in items:
         if isinstance(item.get('created_at'), str):
             item['created_at'] = datetime.fromisoformat(item['created_at'])
@@ -588,7 +800,7 @@ async def create_return(item: ReturnItemCreate, current_user: dict = Depends(get
 
 @api_router.get("/returns", response_model=List[ReturnItem])
 async def get_returns(current_user: dict = Depends(get_current_user)):
-    items = await db.returns.find({}, {"_id": 0}).to_list(1000)
+    items = await buscar(db.returns, {}).to_list(1000)
     for item in items:
         if isinstance(item.get('created_at'), str):
             item['created_at'] = datetime.fromisoformat(item['created_at'])
@@ -616,7 +828,7 @@ async def create_marketing_task(task: MarketingTaskCreate, current_user: dict =
 
 @api_router.get("/marketing", response_model=List[MarketingTask])
 async def get_marketing_tasks(current_user: dict = Depends(get_current_user)):
-    tasks = await db.marketing_tasks.find({}, {"_id": 0}).to_list(1000)
+    tasks = await buscar(db.marketing_tasks, {}).to_list(1000)
     for task in tasks:
         if isinstance(task.get('created_at'), str):
             task['created_at'] = datetime.fromisoformat(task['created_at'])
@@ -644,7 +856,7 @@ async def create_purchase_request(request: PurchaseRequestCreate, current_user:
 
 @api_router.get("/purchase-requests", response_model=List[PurchaseRequest])
 async def get_purchase_requests(current_user: dict = Depends(get_current_user)):
-    requests = await db.purchase_requests.find({}, {"_id": 0}).to_list(1000)
+    requests = await buscar(db.purchase_requests, {}).to_list(1000)
     for req in requests:
         if isinstance(req.get('created_at'), str):
             req['created_at'] = datetime.fromisoformat(req['created_at'])
@@ -677,7 +889,7 @@ async def create_purchase_order(order: PurchaseOrderCreate, current_user: dict =
 
 @api_router.get("/purchase-orders", response_model=List[PurchaseOrder])
 async def get_purchase_orders(current_user: dict = Depends(get_current_user)):
-    orders = await db.purchase_orders.find({}, {"_id": 0}).to_list(1000)
+    orders = await buscar(db.purchase_orders, {}).to_list(1000)
     for order in orders:
         if isinstance(order.get('created_at'), str):
             order['created_at'] = datetime.fromisoformat(order['created_at'])
@@ -701,7 +913,7 @@ async def create_account_payable(account: AccountPayableCreate, current_user: di
 @api_router.get("/accounts-payable", response_model=List[AccountPayable])
 async def get_accounts_payable(entity: Optional[str] = None, current_user: dict = Depends(get_current_user)):
     query = {"entity": entity} if entity else {}
-    accounts = await db.accounts_payable.find(query, {"_id": 0}).to_list(1000)
+    accounts = await buscar(db.accounts_payable, query).to_list(1000)
     for account in accounts:
         if isinstance(account.get('created_at'), str):
             account['created_at'] = datetime.fromisoformat(account['created_at'])
@@ -724,7 +936,7 @@ async def create_sale(sale: SaleCreate, current_user: dict = Depends(get_current
 
 @api_router.get("/sales", response_model=List[Sale])
 async def get_sales(current_user: dict = Depends(get_current_user)):
-    sales = await db.sales.find({}, {"_id": 0}).to_list(1000)
+    sales = await buscar(db.sales, {}).to_list(1000)
     for sale in sales:
         if isinstance(sale.get('created_at'), str):
             sale['created_at'] = datetime.fromisoformat(sale['created_at'])
@@ -743,7 +955,7 @@ async def create_cost_center(cost: CostCenterCreate, current_user: dict = Depend
 @api_router.get("/cost-center", response_model=List[CostCenter])
 async def get_cost_centers(entity: Optional[str] = None, current_user: dict = Depends(get_current_user)):
     query = {"entity": entity} if entity else {}
-    centers = await db.cost_centers.find(query, {"_id": 0}).to_list(1000)
+    centers = await buscar(db.cost_centers, query).to_list(1000)
     for center in centers:
         if isinstance(center.get('created_at'), str):
             center['created_at'] = datetime.fromisoformat(center['created_at'])
@@ -818,7 +1030,7 @@ async def create_store_production(item: StoreProductionCreate, current_user: dic
 @api_router.get("/store-production", response_model=List[StoreProduction])
 async def get_store_production(store: Optional[str] = None, current_user: dict = Depends(get_current_user)):
     query = {"store": store} if store else {}
-    items = await db.store_production.find(query, {"_id": 0}).to_list(1000)
+    items = await buscar(db.store_production, query).to_list(1000)
     for item in items:
         if isinstance(item.get('created_at'), str):
             item['created_at'] = datetime.fromisoformat(item['created_at'])
@@ -846,7 +1058,7 @@ async def create_complaint(complaint: ComplaintCreate, current_user: dict = Depe
 
 @api_router.get("/complaints", response_model=List[Complaint])
 async def get_complaints(current_user: dict = Depends(get_current_user)):
-    complaints = await db.complaints.find({}, {"_id": 0}).to_list(1000)
+    complaints = await buscar(db.complaints, {}).to_list(1000)
     for complaint in complaints:
         if isinstance(complaint.get('created_at'), str):
             complaint['created_at'] = datetime.fromisoformat(complaint['created_at'])
@@ -870,7 +1082,7 @@ async def create_lead(lead: LeadCreate, current_user: dict = Depends(get_current
 @api_router.get("/leads", response_model=List[Lead])
 async def get_leads(store: Optional[str] = None, current_user: dict = Depends(get_current_user)):
     query = {"store": store} if store else {}
-    leads = await db.leads.find(query, {"_id": 0}).to_list(1000)
+    leads = await buscar(db.leads, query).to_list(1000)
     for lead in leads:
         if isinstance(lead.get('created_at'), str):
             lead['created_at'] = datetime.fromisoformat(lead['created_at'])
@@ -937,12 +1149,8 @@ async def get_produtos(loja: Optional[str] = None, current_user: dict = Depends(
     if loja and loja != 'fabrica':
         query['loja_id'] = loja
     
-    produtos = await db.produtos_gestao.find(query).to_list(None)
-    # Remove _id do MongoDB para evitar problemas de serialização
-    for produto in produtos:
-        if '_id' in produto:
-            del produto['_id']
-    return produtos
+    produtos = await buscar(db.produtos_gestao, query).to_list(None)
+    return RespostaJSON(produtos)
 
 @api_router.post("/gestao/produtos")
 async def create_produto(produto: Produto, current_user: dict = Depends(get_current_user)):
@@ -1047,12 +1255,8 @@ async def get_insumos(loja: Optional[str] = None, tipo: Optional[str] = None, cu
     if tipo:
         query['tipo_insumo'] = tipo
     
-    insumos = await db.insumos.find(query).to_list(None)
-    # Remove _id do MongoDB
-    for insumo in insumos:
-        if '_id' in insumo:
-            del insumo['_id']
-    return insumos
+    insumos = await buscar(db.insumos, query).to_list(None)
+    return RespostaJSON(insumos)
 
 @api_router.post("/gestao/insumos")
 async def create_insumo(insumo: Insumo, current_user: dict = Depends(get_current_user)):
@@ -1213,12 +1417,8 @@ async def get_orcamentos(loja: Optional[str] = None, current_user: dict = Depend
     if loja and loja != 'fabrica':
         query['loja_id'] = loja
     
-    orcamentos = await db.orcamentos.find(query).to_list(None)
-    # Remove _id do MongoDB
-    for orcamento in orcamentos:
-        if '_id' in orcamento:
-            del orcamento['_id']
-    return orcamentos
+    orcamentos = await buscar(db.orcamentos, query).to_list(None)
+    return RespostaJSON(orcamentos)
 
 @api_router.get("/gestao/orcamentos/{orcamento_id}")
 async def get_orcamento(orcamento_id: str, current_user: dict = Depends(get_current_user)):
@@ -1299,29 +1499,22 @@ async def get_clientes(loja: Optional[str] = None, busca: Optional[str] = None,
             {'telefone': {'$regex': busca, '$options': 'i'}}
         ]
     
-    clientes = await db.clientes.find(query).sort("nome", 1).to_list(None)
-    for cliente in clientes:
-        if '_id' in cliente:
-            del cliente['_id']
-    return clientes
+    clientes = await buscar(db.clientes, query).sort("nome", 1).to_list(None)
+    return RespostaJSON(clientes)
 
 @api_router.post("/gestao/clientes")
 async def create_cliente(cliente: Cliente, current_user: dict = Depends(get_current_user)):
     """Cria um novo cliente"""
     cliente_dict = cliente.model_dump()
-    await db.clientes.insert_one(cliente_dict)
-    if '_id' in cliente_dict:
-        del cliente_dict['_id']
+    await inserir(db.clientes, cliente_dict)
     return cliente_dict
 
 @api_router.get("/gestao/clientes/{cliente_id}")
 async def get_cliente(cliente_id: str, current_user: dict = Depends(get_current_user)):
     """Retorna um cliente específico"""
-    cliente = await db.clientes.find_one({"id": cliente_id})
+    cliente = await buscar_um(db.clientes, {"id": cliente_id})
     if not cliente:
         raise HTTPException(status_code=404, detail="Cliente não encontrado")
-    if '_id' in cliente:
-        del cliente['_id']
     return cliente
 
 @api_router.put("/gestao/clientes/{cliente_id}")
@@ -1377,6 +1570,7 @@ class PedidoCalculoRequest(BaseModel):
 class PedidoManufatura(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    version: Optional[int] = Field(None, exclude=True)  # Versão lida pelo cliente (PUT só grava se conferir)
     numero_pedido: int = 0  # Auto-incremental
     loja_id: str = "fabrica"  # fabrica, loja1, loja2, loja3, loja4, loja5 - valor padrão
     
@@ -1502,6 +1696,7 @@ class OrdemProducao(BaseModel):
     model_config = ConfigDict(extra="ignore")
     
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    version: Optional[int] = Field(None, exclude=True)  # Versão lida pelo cliente (PUT só grava se conferir)
     numero_ordem: int = 0  # Auto-incremental
     
     # Dados do pedido original
@@ -1528,7 +1723,7 @@ class OrdemProducao(BaseModel):
     # Sistema de Aprovação em Cascata
     aguardando_aprovacao: bool = False  # Se está aguardando aprovação do próximo responsável
     responsavel_pendente: str = ""  # Quem precisa aprovar para assumir a ordem
-    historico_aprovacoes: List[dict] = []  # Histórico de quem aprovou e quando
+    historico_aprovacoes: List[dict] = []  # Histórico de quem aprovou e quando (gravado em ordem_eventos)
     
     # Aprovação Dupla Inicial (Gerência + Financeiro)
     aprovacao_gerencia_producao: bool = False  # Gerente de produção aprovou?
@@ -1555,7 +1750,7 @@ class OrdemProducao(BaseModel):
     fotos_trabalho_pronto: List[str] = []  # URLs das fotos do trabalho finalizado antes de embalar
     comprovante_pagamento: List[str] = []  # URLs dos comprovantes de pagamento do cliente
     
-    # Timeline / Histórico
+    # Timeline / Histórico: gravados em ordem_eventos; o documento guarda só ultimos_eventos
     timeline: List[TimelineEntry] = []
     
     # Metadata
@@ -1793,6 +1988,7 @@ class PedidoMarketplace(BaseModel):
     model_config = ConfigDict(extra="ignore")
     
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    version: Optional[int] = Field(None, exclude=True)  # Versão lida pelo cliente (PUT só grava se conferir)
     projeto_id: str  # Referência ao ProjetoMarketplace
     plataforma: str  # shopee, mercadolivre, tiktok
     
@@ -2165,6 +2361,10 @@ async def get_next_numero_pedido():
     return 1
 
 # Endpoints de Pedidos de Manufatura
+
+# Eventos pendentes do outbox ficam no documento, mas não são devolvidos aos clientes
+PROJECAO_PEDIDO = {"outbox": 0}
+
 @api_router.get("/gestao/pedidos")
 async def get_pedidos(loja: Optional[str] = None, status: Optional[str] = None, current_user: dict = Depends(get_current_user)):
     """Retorna pedidos filtrados por loja e status"""
@@ -2174,12 +2374,8 @@ async def get_pedidos(loja: Optional[str] = None, status: Optional[str] = None,
     if status:
         query['status'] = status
     
-    pedidos = await db.pedidos_manufatura.find(query).sort("numero_pedido", -1).to_list(None)
-    # Remove _id do MongoDB
-    for pedido in pedidos:
-        if '_id' in pedido:
-            del pedido['_id']
-    return pedidos
+    pedidos = await buscar(db.pedidos_manufatura, query, PROJECAO_PEDIDO).sort("numero_pedido", -1).to_list(None)
+    return RespostaJSON(pedidos)
 
 def get_custo_por_prazo(produto, prazo_selecionado):
     """Obtém o custo unitário baseado no prazo selecionado do produto"""
@@ -2596,11 +2792,8 @@ async def create_pedido(request: Request, current_user: dict = Depends(get_curre
         ]
         
         pedido_dict = pedido.model_dump()
-        await db.pedidos_manufatura.insert_one(pedido_dict)
-        
-        # Remove _id
-        if '_id' in pedido_dict:
-            del pedido_dict['_id']
+        await inserir(db.pedidos_manufatura, pedido_dict)
+        invalidar_relatorio_taxas(pedido_dict.get('data_abertura'), pedido_dict.get('loja_id'))
         
         print(f"✅ PEDIDO CRIADO COM SUCESSO - ID: {pedido_dict.get('id')}\n")
         return pedido_dict
@@ -2617,228 +2810,251 @@ async def create_pedido(request: Request, current_user: dict = Depends(get_curre
 @api_router.get("/gestao/pedidos/{pedido_id}")
 async def get_pedido(pedido_id: str, current_user: dict = Depends(get_current_user)):
     """Retorna um pedido específico"""
-    pedido = await db.pedidos_manufatura.find_one({"id": pedido_id})
+    pedido = await buscar_um(db.pedidos_manufatura, {"id": pedido_id}, PROJECAO_PEDIDO)
     if not pedido:
         raise HTTPException(status_code=404, detail="Pedido não encontrado")
-    if '_id' in pedido:
-        del pedido['_id']
     return pedido
 
 @api_router.put("/gestao/pedidos/{pedido_id}")
 async def update_pedido(pedido_id: str, pedido: PedidoManufatura, current_user: dict = Depends(get_current_user)):
     """Atualiza um pedido existente"""
-    pedido_dict = pedido.model_dump()
-    pedido_dict['updated_at'] = datetime.now(timezone.utc).isoformat()
-    await db.pedidos_manufatura.update_one({"id": pedido_id}, {"$set": pedido_dict})
+    pedido_dict = normalizar_datas(pedido.model_dump())
+    pedido_dict['updated_at'] = datetime.now(timezone.utc)
+    resultado = await db.pedidos_manufatura.update_one(
+        filtro_versao_put(pedido_id, pedido.version), {"$set": pedido_dict, "$inc": {"version": 1}}
+    )
+    if resultado.matched_count == 0:
+        await recusar_put_sem_match(db.pedidos_manufatura, pedido_id)
+    # Data ou loja podem ter mudado: descarta todos os relatórios em cache
+    invalidar_relatorio_taxas()
     return {"message": "Pedido atualizado com sucesso"}
 
+@api_router.patch("/gestao/pedidos/{pedido_id}")
+async def patch_pedido(pedido_id: str, dados: dict, current_user: dict = Depends(get_current_user)):
+    """Atualização parcial de um pedido.
+    Recebe apenas os campos alterados e a `version` lida; retorna só o que mudou.
+    Status muda pela rota /status, que dispara as automações."""
+    versao = dados.pop('version', None)
+    campos = normalizar_datas(validar_campos_patch(
+        PedidoManufatura, dados, protegidos={'status', 'historico_status', 'numero_pedido'}
+    ))
+    
+    _, alteracoes, versao = await aplicar_patch(db.pedidos_manufatura, pedido_id, campos, versao)
+    if alteracoes:
+        invalidar_relatorio_taxas()
+    return {"id": pedido_id, "version": versao, **alteracoes}
+
 @api_router.put("/gestao/pedidos/{pedido_id}/status")
 async def update_status_pedido(pedido_id: str, novo_status: str, observacao: Optional[str] = "", current_user: dict = Depends(get_current_user)):
-    """Atualiza o status de um pedido e registra no histórico"""
-    pedido = await db.pedidos_manufatura.find_one({"id": pedido_id})
-    if not pedido:
-        raise HTTPException(status_code=404, detail="Pedido não encontrado")
-    
-    # Adicionar ao histórico
-    historico = pedido.get('historico_status', [])
-    historico.append({
-        'status': novo_status,
-        'data': datetime.now(timezone.utc).isoformat(),
-        'usuario': current_user.get('username', ''),
-        'observacao': observacao
+    """Atualiza o status de um pedido e registra no histórico.
+    As automações (ordem de produção, contas a receber, lançamento) são disparadas
+    pelo evento gravado no outbox do pedido nesta mesma escrita."""
+    agora = datetime.now(timezone.utc)
+    evento = outbox.novo_evento("pedido.status_alterado", {
+        'pedido_id': pedido_id,
+        'novo_status': novo_status,
+        'usuario': current_user.get('username', '')
     })
     
-    # Atualizar pedido
-    await db.pedidos_manufatura.update_one(
+    # Atualizar pedido, adicionar ao histórico e gravar o evento em uma única operação
+    pedido = await db.pedidos_manufatura.find_one_and_update(
         {"id": pedido_id},
         {
             "$set": {
                 "status": novo_status,
-                "historico_status": historico,
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }
-        }
+                "updated_at": agora
+            },
+            "$push": {
+                "historico_status": {
+                    'status': novo_status,
+                    'data': agora,
+                    'usuario': current_user.get('username', ''),
+                    'observacao': observacao
+                },
+                "outbox": evento
+            },
+            "$inc": {"version": 1}
+        },
+        projection={"_id": 0, "data_abertura": 1, "loja_id": 1}
     )
+    if not pedido:
+        raise HTTPException(status_code=404, detail="Pedido não encontrado")
     
-    # AUTOMAÇÃO: Se status for "Montagem", criar Ordem de Produção automaticamente
-    if novo_status == "Montagem":
-        try:
-            print(f"\n🏭 AUTOMAÇÃO: Criando Ordem de Produção para pedido #{pedido['numero_pedido']}")
-            
-            # Verificar se já existe ordem de produção para este pedido
-            ordem_existente = await db.ordens_producao.find_one({"id_pedido_origem": pedido_id})
-            
-            if not ordem_existente:
-                # Gerar número da ordem
-                ultimo_numero = await db.ordens_producao.find_one({}, sort=[("numero_ordem", -1)])
-                numero_ordem = (ultimo_numero['numero_ordem'] + 1) if ultimo_numero and 'numero_ordem' in ultimo_numero else 1
-                
-                # Criar ordem de produção
-                ordem_producao = {
-                    'id': str(uuid.uuid4()),
-                    'numero_ordem': numero_ordem,
-                    'cliente_nome': pedido.get('cliente_nome', 'Cliente não informado'),
-                    'loja_origem': pedido.get('loja_id', 'fabrica'),
-                    'id_pedido_origem': pedido_id,
-                    'numero_pedido_origem': pedido.get('numero_pedido', 0),
-                    'status_producao': 'Em Fila',  # Status inicial
-                    'responsavel_atual': '',
-                    'timeline': [{
-                        'data_hora': datetime.now(timezone.utc).isoformat(),
-                        'usuario': current_user.get('username', ''),
-                        'mudanca': 'Ordem criada automaticamente',
-                        'comentario': f'Pedido #{pedido.get("numero_pedido")} entrou em Montagem'
-                    }],
-                    'checklist': {
-                        'arte_aprovada': False,
-                        'insumos_conferidos': False,
-                        'pagamento_confirmado': False,
-                        'qualidade_concluida': False,
-                        'embalado': False
-                    },
-                    'observacoes': f"Tipo: {pedido.get('tipo_produto', 'Quadro')}, Dimensões: {pedido.get('altura', 0)}x{pedido.get('largura', 0)}cm",
-                    'anexos': [],
-                    'sla_status': 'No Prazo',
-                    'prioridade': 'Normal',
-                    'dias_em_producao': 0,
-                    'data_entrada': datetime.now(timezone.utc).isoformat(),
-                    'data_previsao': None,
-                    'data_conclusao': None,
-                    'created_at': datetime.now(timezone.utc).isoformat(),
-                    'updated_at': datetime.now(timezone.utc).isoformat(),
-                    'created_by': current_user.get('username', '')
-                }
-                
-                await db.ordens_producao.insert_one(ordem_producao)
-                print(f"✅ Ordem de Produção #{numero_ordem} criada com sucesso!")
-            else:
-                print(f"⚠️ Ordem de Produção já existe para este pedido")
-                
-        except Exception as e:
-            print(f"❌ Erro ao criar ordem de produção: {e}")
-            # Não interromper o fluxo, apenas logar o erro
+    invalidar_relatorio_taxas(pedido.get('data_abertura'), pedido.get('loja_id'))
+    outbox.notificar()
     
-    # AUTOMAÇÃO: Se status for "Montagem", criar Contas a Receber automaticamente
-    if novo_status == "Montagem":
-        try:
-            print(f"\n💰 AUTOMAÇÃO: Criando Contas a Receber para pedido #{pedido['numero_pedido']}")
-            
-            # Verificar se tem forma de pagamento definida
-            if not pedido.get('forma_pagamento_id'):
-                print(f"⚠️ Pedido sem forma de pagamento definida - pulando criação de contas a receber")
-            else:
-                # Verificar se já existem contas a receber para este pedido
-                contas_existentes = await db.contas_receber.find_one({"pedido_id": pedido_id})
-                
-                if not contas_existentes:
-                    # Buscar dados da forma de pagamento
-                    forma_pagamento = await db.formas_pagamento_banco.find_one({"id": pedido.get('forma_pagamento_id')})
-                    
-                    if forma_pagamento:
-                        total_parcelas = forma_pagamento.get('numero_parcelas', 1)
-                        espaco_dias = forma_pagamento.get('espaco_parcelas_dias', 30)
-                        valor_bruto = pedido.get('valor_bruto', pedido.get('valor_final', 0))
-                        taxa_percentual = pedido.get('taxa_percentual', 0)
-                        valor_liquido = pedido.get('valor_liquido_empresa', valor_bruto)
-                        
-                        # Calcular valor por parcela
-                        valor_bruto_parcela = valor_bruto / total_parcelas
-                        valor_liquido_parcela = valor_liquido / total_parcelas
-                        
-                        print(f"📊 Gerando {total_parcelas} parcela(s) - Valor bruto: R${valor_bruto:.2f} - Valor líquido: R${valor_liquido:.2f}")
-                        
-                        # Criar uma conta a receber para cada parcela
-                        for i in range(1, total_parcelas + 1):
-                            # Calcular data de vencimento da parcela
-                            dias_adicionar = (i - 1) * espaco_dias
-                            data_venc = datetime.now(timezone.utc) + timedelta(days=dias_adicionar)
-                            
-                            conta_receber = {
-                                'id': str(uuid.uuid4()),
-                                'pedido_id': pedido_id,
-                                'documento': f"Pedido_{pedido.get('numero_pedido', 0)}-{i}/{total_parcelas}",
-                                'cliente_origem': pedido.get('cliente_nome', 'Cliente não informado'),
-                                'loja_id': pedido.get('loja_id', 'fabrica'),
-                                'vendedor': current_user.get('username', ''),
-                                'valor_bruto': valor_bruto_parcela,
-                                'valor_liquido': valor_liquido_parcela,
-                                'valor': valor_liquido_parcela,
-                                'forma_pagamento_id': pedido.get('forma_pagamento_id'),
-                                'forma_pagamento_nome': pedido.get('forma_pagamento_nome', ''),
-                                'conta_bancaria_id': pedido.get('conta_bancaria_id', ''),
-                                'conta_bancaria_nome': pedido.get('conta_bancaria_nome', ''),
-                                'taxa_percentual': taxa_percentual,
-                                'numero_parcela': i,
-                                'total_parcelas': total_parcelas,
-                                'data_emissao': datetime.now(timezone.utc).isoformat(),
-                                'data_vencimento': data_venc.isoformat(),
-                                'data_prevista': data_venc.isoformat(),
-                                'data_operacao_bancaria': None,
-                                'data_pago_loja': None,
-                                'data_recebimento': None,
-                                'categoria_id': '',
-                                'categoria_nome': 'Venda de Produtos e Serviços',
-                                'grupo_categoria': 'Receita Bruta',
-                                'status': 'Pendente',
-                                'dc': 'C',
-                                'recorrencia': 'ÚNICA',
-                                'lote': '',
-                                'conta_id_interno': '',
-                                'descricao': f"Venda {pedido.get('loja_id', 'fabrica')} - Pedido #{pedido.get('numero_pedido', 0)}",
-                                'observacoes': f"Parcela {i} de {total_parcelas}",
-                                'created_at': datetime.now(timezone.utc).isoformat(),
-                                'updated_at': datetime.now(timezone.utc).isoformat(),
-                                'created_by': current_user.get('username', '')
-                            }
-                            
-                            await db.contas_receber.insert_one(conta_receber)
-                            print(f"✅ Conta a Receber criada: Parcela {i}/{total_parcelas} - Vencimento: {data_venc.strftime('%d/%m/%Y')}")
-                        
-                        print(f"✅ Total de {total_parcelas} Conta(s) a Receber criada(s) com sucesso!")
-                    else:
-                        print(f"⚠️ Forma de pagamento não encontrada")
-                else:
-                    print(f"⚠️ Contas a Receber já existem para este pedido")
-                    
-        except Exception as e:
-            print(f"❌ Erro ao criar contas a receber: {e}")
-            import traceback
-            print(traceback.format_exc())
-            # Não interromper o fluxo, apenas logar o erro
+    return {"message": f"Status atualizado para {novo_status}"}
+
+# AUTOMAÇÕES DA MUDANÇA DE STATUS (handlers do outbox)
+
+async def buscar_pedido_evento(db, evento) -> dict:
+    pedido = await db.pedidos_manufatura.find_one({"id": evento['payload']['pedido_id']}, {
+        **CAMPOS_PEDIDO, "tipo_produto": 1, "altura": 1, "largura": 1,
+        "custo_total": 1, "preco_venda": 1, "margem_percentual": 1
+    })
+    if not pedido:
+        raise ValueError(f"Pedido {evento['payload']['pedido_id']} não encontrado")
+    return pedido
+
+@outbox.handler("pedido.status_alterado")
+async def criar_ordem_producao_pedido(db, evento):
+    """Se status for "Montagem", criar Ordem de Produção automaticamente"""
+    if evento['payload']['novo_status'] != "Montagem":
+        return
     
-    # Se status for "Pronto" ou "Entregue", gerar lançamento financeiro
-    if novo_status in ["Pronto", "Entregue"]:
-        try:
-            lancamento = {
-                'id': str(uuid.uuid4()),
-                'pedido_id': pedido_id,
-                'numero_pedido': pedido['numero_pedido'],
-                'tipo': 'Receita',
-                'categoria': 'Venda de Manufatura',
-                'descricao': f"Pedido #{pedido['numero_pedido']} - {pedido.get('cliente_nome', 'Cliente')}",
-                'valor_custo': pedido.get('custo_total', 0),
-                'valor_venda': pedido.get('preco_venda', 0),
-                'margem_percentual': pedido.get('margem_percentual', 0),
-                'loja_id': pedido.get('loja_id', 'fabrica'),
-                'data': datetime.now(timezone.utc).isoformat(),
-                'status': 'Concluído' if novo_status == 'Entregue' else 'Pendente',
-                'created_at': datetime.now(timezone.utc).isoformat(),
-                'created_by': current_user.get('username', '')
-            }
-            await db.lancamentos_financeiros.insert_one(lancamento)
-        except Exception as e:
-            print(f"Erro ao criar lançamento financeiro: {e}")
+    pedido_id = evento['payload']['pedido_id']
     
-    return {"message": f"Status atualizado para {novo_status}"}
+    # Verificar se já existe ordem de produção para este pedido
+    if await db.ordens_producao.find_one({"id_pedido_origem": pedido_id}, {"_id": 1}):
+        return
+    
+    pedido = await buscar_pedido_evento(db, evento)
+    
+    # Gerar número da ordem
+    ultimo_numero = await db.ordens_producao.find_one({}, {"_id": 0, "numero_ordem": 1}, sort=[("numero_ordem", -1)])
+    numero_ordem = (ultimo_numero['numero_ordem'] + 1) if ultimo_numero and 'numero_ordem' in ultimo_numero else 1
+    
+    agora = datetime.now(timezone.utc)
+    usuario = evento['payload']['usuario']
+    ordem_producao = {
+        'id': str(uuid.uuid4()),
+        'numero_ordem': numero_ordem,
+        'cliente_nome': pedido.get('cliente_nome', 'Cliente não informado'),
+        'loja_origem': pedido.get('loja_id', 'fabrica'),
+        'id_pedido_origem': pedido_id,
+        'numero_pedido_origem': pedido.get('numero_pedido', 0),
+        'status_producao': 'Em Fila',  # Status inicial
+        'responsavel_atual': '',
+        'checklist': {
+            'arte_aprovada': False,
+            'insumos_conferidos': False,
+            'pagamento_confirmado': False,
+            'qualidade_concluida': False,
+            'embalado': False
+        },
+        'observacoes': f"Tipo: {pedido.get('tipo_produto', 'Quadro')}, Dimensões: {pedido.get('altura', 0)}x{pedido.get('largura', 0)}cm",
+        'anexos': [],
+        'sla_status': 'No Prazo',
+        'prioridade': 'Normal',
+        'dias_em_producao': 0,
+        'data_entrada': agora,
+        'data_previsao': None,
+        'data_conclusao': None,
+        'created_at': agora,
+        'updated_at': agora,
+        'created_by': usuario
+    }
+    evento = novo_evento_ordem(
+        ordem_producao['id'], 'timeline', usuario,
+        mudanca='Ordem criada automaticamente',
+        comentario=f'Pedido #{pedido.get("numero_pedido")} entrou em Montagem',
+        data_hora=agora
+    )
+    ordem_producao['ultimos_eventos'] = [evento]
+    
+    # Índice único em id_pedido_origem: uma execução repetida do handler não duplica a ordem
+    try:
+        await db.ordens_producao.insert_one(ordem_producao)
+    except DuplicateKeyError:
+        return
+    await db.ordem_eventos.insert_one(dict(evento))
+    print(f"✅ Ordem de Produção #{numero_ordem} criada para o pedido #{pedido.get('numero_pedido')}")
+
+@outbox.handler("pedido.status_alterado")
+async def criar_contas_receber_pedido(db, evento):
+    """Se status for "Montagem", criar Contas a Receber automaticamente"""
+    if evento['payload']['novo_status'] != "Montagem":
+        return
+    pedido = await buscar_pedido_evento(db, evento)
+    await gerar_contas_receber_pedido(db, pedido, evento['payload']['usuario'])
+
+@outbox.handler("pedido.status_alterado")
+async def criar_lancamento_pedido(db, evento):
+    """Se status for "Pronto" ou "Entregue", gerar lançamento financeiro"""
+    novo_status = evento['payload']['novo_status']
+    if novo_status not in ["Pronto", "Entregue"]:
+        return
+    
+    # Um lançamento por evento, mesmo que o handler seja executado novamente
+    if await db.lancamentos_financeiros.find_one({"evento_id": evento['id']}, {"_id": 1}):
+        return
+    
+    pedido = await buscar_pedido_evento(db, evento)
+    agora = datetime.now(timezone.utc)
+    lancamento = {
+        'id': str(uuid.uuid4()),
+        'evento_id': evento['id'],
+        'pedido_id': pedido['id'],
+        'numero_pedido': pedido['numero_pedido'],
+        'tipo': 'Receita',
+        'categoria': 'Venda de Manufatura',
+        'descricao': f"Pedido #{pedido['numero_pedido']} - {pedido.get('cliente_nome', 'Cliente')}",
+        'valor_custo': pedido.get('custo_total', 0),
+        'valor_venda': pedido.get('preco_venda', 0),
+        'margem_percentual': pedido.get('margem_percentual', 0),
+        'loja_id': pedido.get('loja_id', 'fabrica'),
+        'data': agora,
+        'status': 'Concluído' if novo_status == 'Entregue' else 'Pendente',
+        'created_at': agora,
+        'created_by': evento['payload']['usuario']
+    }
+    # Índice único em evento_id: se outra execução já gravou, o evento está concluído
+    try:
+        await db.lancamentos_financeiros.insert_one(lancamento)
+    except DuplicateKeyError:
+        pass
 
 @api_router.delete("/gestao/pedidos/{pedido_id}")
 async def delete_pedido(pedido_id: str, current_user: dict = Depends(get_current_user)):
     """Deleta um pedido"""
     await db.pedidos_manufatura.delete_one({"id": pedido_id})
+    invalidar_relatorio_taxas()
     return {"message": "Pedido excluído com sucesso"}
 
 # ============= ENDPOINTS: ORDEM DE PRODUÇÃO (FÁBRICA) =============
 
+# Timeline e histórico de aprovações ficam na coleção append-only ordem_eventos;
+# a ordem mantém apenas os últimos eventos para as listagens
+ULTIMOS_EVENTOS_ORDEM = 5
+CAMPOS_EVENTOS_ORDEM = {'timeline', 'historico_aprovacoes', 'ultimos_eventos'}
+
+def novo_evento_ordem(ordem_id: str, tipo: str, usuario: str, mudanca: str, comentario: Optional[str] = "", **extras) -> dict:
+    """Monta um evento de ordem: tipo "timeline" ou "aprovacao" """
+    return {
+        'id': str(uuid.uuid4()),
+        'ordem_id': ordem_id,
+        'tipo': tipo,
+        'data_hora': extras.pop('data_hora', None) or datetime.now(timezone.utc),
+        'usuario': usuario,
+        'mudanca': mudanca,
+        'comentario': comentario or "",
+        **extras
+    }
+
+def eventos_alteracao_ordem(ordem_id: str, anterior: dict, alteracoes: dict, usuario: str) -> List[dict]:
+    """Eventos de timeline para mudanças de status e de responsável"""
+    eventos = []
+    if 'status_interno' in alteracoes:
+        eventos.append(novo_evento_ordem(
+            ordem_id, 'timeline', usuario,
+            mudanca=f"Status alterado: {anterior.get('status_interno')} → {alteracoes['status_interno']}"
+        ))
+    if 'responsavel_atual' in alteracoes:
+        eventos.append(novo_evento_ordem(
+            ordem_id, 'timeline', usuario,
+            mudanca=f"Responsável alterado: {anterior.get('responsavel_atual')} → {alteracoes['responsavel_atual']}"
+        ))
+    return eventos
+
+def push_eventos_ordem(eventos: List[dict]) -> dict:
+    """$push que atualiza ultimos_eventos da ordem com os novos eventos"""
+    return {"ultimos_eventos": {"$each": eventos, "$slice": -ULTIMOS_EVENTOS_ORDEM}}
+
+async def registrar_eventos_ordem(eventos: List[dict]):
+    """Grava os eventos em ordem_eventos. Chamado só depois que o update confirmou que a
+    ordem existe, para não deixar eventos de ordens inexistentes na coleção."""
+    await db.ordem_eventos.insert_many([dict(evento) for evento in eventos])
+
 @api_router.get("/gestao/producao")
 async def get_ordens_producao(loja: Optional[str] = None, status: Optional[str] = None, responsavel: Optional[str] = None, current_user: dict = Depends(get_current_user)):
     """Lista todas as ordens de produção com filtros opcionais"""
@@ -2851,11 +3067,10 @@ async def get_ordens_producao(loja: Optional[str] = None, status: Optional[str]
     if responsavel:
         filtro['responsavel_atual'] = responsavel
     
-    ordens = await db.ordens_producao.find(filtro).sort("created_at", -1).to_list(length=1000)
-    
-    # Remover _id
-    for ordem in ordens:
-        ordem.pop('_id', None)
+    # Listagem: apenas os últimos eventos (ultimos_eventos), sem timeline/histórico completos
+    ordens = await db.ordens_producao.find(
+        filtro, {"_id": 0, "timeline": 0, "historico_aprovacoes": 0}
+    ).sort("created_at", -1).to_list(length=1000)
     
     return ordens
 
@@ -2866,143 +3081,215 @@ async def create_ordem_producao(ordem: OrdemProducao, current_user: dict = Depen
     ordem.created_by = current_user.get('username', '')
     
     # Adicionar entrada inicial na timeline
-    entrada_inicial = TimelineEntry(
-        usuario=current_user.get('username', ''),
+    evento = novo_evento_ordem(
+        ordem.id, 'timeline', current_user.get('username', ''),
         mudanca=f"Ordem de Produção #{ordem.numero_ordem} criada",
         comentario=f"Status inicial: {ordem.status_interno}"
     )
-    ordem.timeline.append(entrada_inicial)
     
-    ordem_dict = ordem.model_dump()
+    ordem_dict = ordem.model_dump(exclude=CAMPOS_EVENTOS_ORDEM)
+    ordem_dict['ultimos_eventos'] = [evento]
     await db.ordens_producao.insert_one(ordem_dict)
+    await db.ordem_eventos.insert_one(dict(evento))
     
     ordem_dict.pop('_id', None)
     return ordem_dict
 
 @api_router.get("/gestao/producao/{ordem_id}")
 async def get_ordem_producao(ordem_id: str, current_user: dict = Depends(get_current_user)):
-    """Busca uma ordem de produção por ID"""
-    ordem = await db.ordens_producao.find_one({"id": ordem_id})
+    """Busca uma ordem de produção por ID, com timeline e histórico de aprovações completos"""
+    ordem = await buscar_um(db.ordens_producao, {"id": ordem_id})
     if not ordem:
         raise HTTPException(status_code=404, detail="Ordem não encontrada")
     
-    ordem.pop('_id', None)
+    eventos = await buscar(db.ordem_eventos, {"ordem_id": ordem_id}).sort("data_hora", 1).to_list(None)
+    ordem['timeline'] = ordem.get('timeline', []) + [
+        {k: e.get(k) for k in ('data_hora', 'usuario', 'mudanca', 'comentario')}
+        for e in eventos if e['tipo'] == 'timeline'
+    ]
+    ordem['historico_aprovacoes'] = ordem.get('historico_aprovacoes', []) + [
+        {'responsavel': e.get('responsavel'), 'data_aprovacao': e['data_hora'], 'observacao': e.get('comentario', '')}
+        for e in eventos if e['tipo'] == 'aprovacao'
+    ]
     return ordem
 
+@api_router.get("/gestao/producao/{ordem_id}/eventos")
+async def get_eventos_ordem(
+    ordem_id: str,
+    tipo: Optional[str] = None,
+    limite: int = 100,
+    current_user: dict = Depends(get_current_user)
+):
+    """Eventos da ordem (timeline e aprovações), do mais recente para o mais antigo"""
+    filtro = {"ordem_id": ordem_id}
+    if tipo:
+        filtro['tipo'] = tipo
+    eventos = await buscar(db.ordem_eventos, filtro).sort("data_hora", -1).limit(limite).to_list(limite)
+    return RespostaJSON(eventos)
+
 @api_router.put("/gestao/producao/{ordem_id}")
 async def update_ordem_producao(ordem_id: str, ordem: OrdemProducao, current_user: dict = Depends(get_current_user)):
-    """Atualiza uma ordem de produção"""
-    ordem_existente = await db.ordens_producao.find_one({"id": ordem_id})
-    if not ordem_existente:
+    """Atualiza uma ordem de produção (apenas os campos enviados que mudaram)"""
+    novos_valores = ordem.model_dump(
+        exclude_unset=True,
+        exclude=CAMPOS_EVENTOS_ORDEM | {'id', 'numero_ordem', 'created_at', 'created_by', 'updated_at'}
+    )
+    ordem_existente = await db.ordens_producao.find_one(
+        {"id": ordem_id}, {"_id": 0, "id": 1, **{campo: 1 for campo in novos_valores}}
+    )
+    if ordem_existente is None:
         raise HTTPException(status_code=404, detail="Ordem não encontrada")
     
-    ordem.updated_at = datetime.now(timezone.utc)
+    alteracoes = {
+        campo: valor for campo, valor in novos_valores.items()
+        if para_datetime(valor) != para_datetime(ordem_existente.get(campo))
+    }
     
     # Verificar mudanças e adicionar na timeline
-    if ordem_existente.get('status_interno') != ordem.status_interno:
-        entrada_timeline = TimelineEntry(
-            usuario=current_user.get('username', ''),
-            mudanca=f"Status alterado: {ordem_existente.get('status_interno')} → {ordem.status_interno}",
-            comentario=""
-        )
-        ordem.timeline.append(entrada_timeline)
-    
-    if ordem_existente.get('responsavel_atual') != ordem.responsavel_atual:
-        entrada_timeline = TimelineEntry(
-            usuario=current_user.get('username', ''),
-            mudanca=f"Responsável alterado: {ordem_existente.get('responsavel_atual')} → {ordem.responsavel_atual}",
-            comentario=""
-        )
-        ordem.timeline.append(entrada_timeline)
+    eventos = eventos_alteracao_ordem(ordem_id, ordem_existente, alteracoes, current_user.get('username', ''))
     
-    ordem_dict = ordem.model_dump()
-    await db.ordens_producao.replace_one({"id": ordem_id}, ordem_dict)
+    update = {"$set": {**alteracoes, "updated_at": datetime.now(timezone.utc)}, "$inc": {"version": 1}}
+    if eventos:
+        update["$push"] = push_eventos_ordem(eventos)
     
-    ordem_dict.pop('_id', None)
+    ordem_dict = await db.ordens_producao.find_one_and_update(
+        filtro_versao_put(ordem_id, ordem.version), update,
+        projection={"_id": 0, "timeline": 0, "historico_aprovacoes": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if ordem_dict is None:
+        await recusar_put_sem_match(db.ordens_producao, ordem_id)
+    if eventos:
+        await registrar_eventos_ordem(eventos)
     return ordem_dict
 
+@api_router.patch("/gestao/producao/{ordem_id}")
+async def patch_ordem_producao(ordem_id: str, dados: dict, current_user: dict = Depends(get_current_user)):
+    """Atualização parcial de uma ordem de produção.
+    Recebe apenas os campos alterados e a `version` lida; retorna só o que mudou."""
+    versao = dados.pop('version', None)
+    campos = validar_campos_patch(OrdemProducao, dados, protegidos=CAMPOS_EVENTOS_ORDEM | {'numero_ordem'})
+    
+    anterior, alteracoes, versao = await aplicar_patch(db.ordens_producao, ordem_id, campos, versao)
+    
+    eventos = eventos_alteracao_ordem(ordem_id, anterior, alteracoes, current_user.get('username', ''))
+    if eventos:
+        resultado = await db.ordens_producao.update_one(
+            {"id": ordem_id}, {"$push": push_eventos_ordem(eventos), "$inc": {"version": 1}}
+        )
+        if resultado.matched_count:
+            await registrar_eventos_ordem(eventos)
+    
+    return {"id": ordem_id, "version": versao, **alteracoes}
+
 @api_router.delete("/gestao/producao/{ordem_id}")
 async def delete_ordem_producao(ordem_id: str, current_user: dict = Depends(get_current_user)):
-    """Deleta uma ordem de produção"""
+    """Deleta uma ordem de produção e seus eventos"""
     await db.ordens_producao.delete_one({"id": ordem_id})
+    await db.ordem_eventos.delete_many({"ordem_id": ordem_id})
     return {"message": "Ordem de produção excluída com sucesso"}
 
 @api_router.post("/gestao/producao/{ordem_id}/timeline")
 async def add_timeline_entry(ordem_id: str, mudanca: str, comentario: Optional[str] = "", current_user: dict = Depends(get_current_user)):
     """Adiciona uma entrada manual na timeline"""
-    ordem = await db.ordens_producao.find_one({"id": ordem_id})
-    if not ordem:
-        raise HTTPException(status_code=404, detail="Ordem não encontrada")
-    
-    entrada = {
-        'data_hora': datetime.now(timezone.utc).isoformat(),
-        'usuario': current_user.get('username', ''),
-        'mudanca': mudanca,
-        'comentario': comentario
-    }
-    
-    await db.ordens_producao.update_one(
+    evento = novo_evento_ordem(ordem_id, 'timeline', current_user.get('username', ''), mudanca, comentario)
+    resultado = await db.ordens_producao.update_one(
         {"id": ordem_id},
-        {"$push": {"timeline": entrada}}
+        {"$push": push_eventos_ordem([evento]), "$inc": {"version": 1}}
     )
+    if resultado.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Ordem não encontrada")
+    await registrar_eventos_ordem([evento])
     
     return {"message": "Entrada adicionada à timeline"}
 
+STATUS_DASHBOARD = ["Armazenado na Loja", "Aguardando Arte", "Armazenado Fábrica", "Pronto para Impressão", "Impresso", "Produção", "Acabamento", "Pronto", "Entregue", "Reparo"]
+LOJAS_DASHBOARD = ["fabrica", "loja1", "loja2", "loja3", "loja4", "loja5"]
+
 @api_router.get("/gestao/producao/dashboard/stats")
 async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
-    """Retorna estatísticas para o dashboard"""
-    # Total por status
-    stats_status = {}
-    for status in ["Armazenado na Loja", "Aguardando Arte", "Armazenado Fábrica", "Pronto para Impressão", "Impresso", "Produção", "Acabamento", "Pronto", "Entregue", "Reparo"]:
-        count = await db.ordens_producao.count_documents({"status_interno": status})
-        stats_status[status] = count
-    
-    # Total por loja
-    stats_lojas = {}
-    for loja in ["fabrica", "loja1", "loja2", "loja3", "loja4", "loja5"]:
-        count = await db.ordens_producao.count_documents({"loja_origem": loja})
-        stats_lojas[loja] = count
-    
-    # Atrasados (data_entrega_prometida < hoje e status != Entregue)
+    """Retorna estatísticas para o dashboard
+    (o cache de respostas, ROTAS_CACHE_RESPOSTAS, limita o recálculo a um a cada 5s por processo)"""
+    # Uma única agregação: totais por status, por loja e atrasados. Percorre a coleção inteira
+    # (as contagens por loja incluem qualquer status), então só os campos usados seguem adiante
     hoje = datetime.now(timezone.utc)
-    atrasados = await db.ordens_producao.count_documents({
-        "data_entrega_prometida": {"$lt": hoje},
-        "status_interno": {"$ne": "Entregue"}
-    })
+    resultado = await db.ordens_producao.aggregate([
+        {"$project": {"_id": 0, "status_interno": 1, "loja_origem": 1, "data_entrega_prometida": 1}},
+        {"$facet": {
+            "por_status": [
+                {"$match": {"status_interno": {"$in": STATUS_DASHBOARD}}},
+                {"$group": {"_id": "$status_interno", "total": {"$sum": 1}}}
+            ],
+            "por_loja": [
+                {"$match": {"loja_origem": {"$in": LOJAS_DASHBOARD}}},
+                {"$group": {"_id": "$loja_origem", "total": {"$sum": 1}}}
+            ],
+            # Atrasados (data_entrega_prometida < hoje e status != Entregue)
+            "atrasados": [
+                {"$match": {"data_entrega_prometida": {"$lt": hoje}, "status_interno": {"$ne": "Entregue"}}},
+                {"$count": "total"}
+            ]
+        }}
+    ]).to_list(1)
+    resultado = resultado[0] if resultado else {}
     
-    # Em reparo
-    em_reparo = await db.ordens_producao.count_documents({"status_interno": "Reparo"})
+    # Total por status / por loja (zerados quando não há ordens)
+    stats_status = {status: 0 for status in STATUS_DASHBOARD}
+    stats_status.update({grupo['_id']: grupo['total'] for grupo in resultado.get('por_status', [])})
+    stats_lojas = {loja: 0 for loja in LOJAS_DASHBOARD}
+    stats_lojas.update({grupo['_id']: grupo['total'] for grupo in resultado.get('por_loja', [])})
+    atrasados = resultado['atrasados'][0]['total'] if resultado.get('atrasados') else 0
     
-    return {
+    stats = {
         "por_status": stats_status,
         "por_loja": stats_lojas,
         "atrasados": atrasados,
-        "em_reparo": em_reparo,
+        "em_reparo": stats_status["Reparo"],
         "total": sum(stats_status.values())
     }
+    return stats
 
 @api_router.post("/gestao/pedidos/upload-imagem")
 async def upload_imagem_pedido(file: UploadFile, current_user: dict = Depends(get_current_user)):
     """Upload de imagem do objeto do cliente"""
-    import base64
-    from datetime import datetime
-    
-    # Ler arquivo
-    contents = await file.read()
-    
-    # Converter para base64
-    image_base64 = base64.b64encode(contents).decode('utf-8')
+    # Gravar no blob store (só JPEG/PNG/WebP conferidos); o pedido guarda apenas a URL
+    try:
+        blob = await blob_store.salvar_upload(file, somente_imagens=True)
+    except blob_store.ArquivoInvalido as e:
+        raise HTTPException(status_code=415, detail=str(e))
     
-    # Retornar URL data
     return {
         "success": True,
-        "url": f"data:image/jpeg;base64,{image_base64}",
+        "url": blob['url'],
         "filename": file.filename
     }
 
 
 # ============= SISTEMA DE APROVAÇÃO EM CASCATA =============
 
+# Campos exibidos na fila de aprovação (sem fotos, timeline etc.)
+CAMPOS_FILA_APROVACAO = {
+    "_id": 0, "id": 1, "numero_ordem": 1, "cliente_nome": 1, "loja_origem": 1, "descricao_itens": 1,
+    "responsavel_atual": 1, "responsavel_pendente": 1, "status_interno": 1, "prioridade": 1,
+    "data_entrega_prometida": 1, "updated_at": 1
+}
+
+# Streams SSE da fila de aprovação, por responsável
+canal_aprovacoes = CanalEventos()
+
+async def buscar_fila_aprovacao(responsavel: Optional[str] = None) -> List[dict]:
+    query = {"aguardando_aprovacao": True}
+    if responsavel:
+        query["responsavel_pendente"] = responsavel
+    return await db.ordens_producao.find(query, CAMPOS_FILA_APROVACAO).sort("updated_at", -1).to_list(length=1000)
+
+async def notificar_fila_aprovacao(ordem_id: str):
+    """Publica a ordem (agora pendente) no stream do seu responsável pendente"""
+    ordem = await db.ordens_producao.find_one({"id": ordem_id}, {**CAMPOS_FILA_APROVACAO, "aguardando_aprovacao": 1})
+    if ordem and ordem.get("aguardando_aprovacao"):
+        ordem.pop("aguardando_aprovacao")
+        canal_aprovacoes.publicar(ordem["responsavel_pendente"], "pendente", ordem)
+
 @api_router.get("/gestao/producao/pendentes-aprovacao")
 async def get_ordens_pendentes_aprovacao(
     responsavel: Optional[str] = None,
@@ -3010,12 +3297,7 @@ async def get_ordens_pendentes_aprovacao(
 ):
     """Listar ordens que aguardam aprovação de um responsável específico"""
     try:
-        query = {"aguardando_aprovacao": True}
-        
-        if responsavel:
-            query["responsavel_pendente"] = responsavel
-        
-        ordens = await db.ordens_producao.find(query).to_list(length=1000)
+        ordens = await buscar_fila_aprovacao(responsavel)
         
         return {
             "success": True,
@@ -3026,6 +3308,54 @@ async def get_ordens_pendentes_aprovacao(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@api_router.get("/gestao/producao/pendentes-aprovacao/stream")
+async def stream_ordens_pendentes_aprovacao(request: Request, responsavel: str, token: str):
+    """Stream SSE da fila de aprovação de um responsável.
+    EventSource não envia cabeçalhos, por isso o JWT vem em ?token=.
+    Eventos: "snapshot" (fila inicial), "pendente" (ordem entrou na fila), "removida" (ordem saiu)."""
+    decode_token(token)
+    
+    async def eventos():
+        fila = canal_aprovacoes.inscrever(responsavel)
+        try:
+            ordens = await buscar_fila_aprovacao(responsavel)
+            ultima_alteracao = max((o['updated_at'] for o in ordens if o.get('updated_at')), default=datetime.now(timezone.utc))
+            # Ids que o cliente tem na fila, para saber o que saiu dela em outro processo
+            enviadas = {o['id'] for o in ordens}
+            yield formatar_sse("snapshot", {"ordens": ordens})
+            
+            while not await request.is_disconnected():
+                try:
+                    evento = await asyncio.wait_for(fila.get(), timeout=25)
+                    if evento['tipo'] == "removida":
+                        enviadas.discard(evento['dados']['id'])
+                    else:
+                        enviadas.add(evento['dados']['id'])
+                    yield formatar_sse(evento['tipo'], evento['dados'])
+                except asyncio.TimeoutError:
+                    # Ressincroniza pelo índice: ordens enviadas, aprovadas ou recusadas por outros processos
+                    atuais = await buscar_fila_aprovacao(responsavel)
+                    for ordem in atuais:
+                        alterada = ordem.get('updated_at') and para_datetime(ordem['updated_at']) > para_datetime(ultima_alteracao)
+                        if ordem['id'] not in enviadas or alterada:
+                            if alterada:
+                                ultima_alteracao = max(para_datetime(ultima_alteracao), para_datetime(ordem['updated_at']))
+                            yield formatar_sse("pendente", ordem)
+                    ids_atuais = {o['id'] for o in atuais}
+                    for ordem_id in enviadas - ids_atuais:
+                        yield formatar_sse("removida", {"id": ordem_id})
+                    enviadas = ids_atuais
+                    yield ": keepalive\n\n"
+        finally:
+            canal_aprovacoes.cancelar(responsavel, fila)
+    
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @api_router.post("/gestao/producao/{ordem_id}/aprovar")
 async def aprovar_ordem(
     ordem_id: str,
@@ -3035,7 +3365,9 @@ async def aprovar_ordem(
     """Aprovar e assumir responsabilidade sobre uma ordem de produção"""
     try:
         # Buscar a ordem
-        ordem = await db.ordens_producao.find_one({"id": ordem_id})
+        ordem = await db.ordens_producao.find_one(
+            {"id": ordem_id}, {"_id": 0, "aguardando_aprovacao": 1, "responsavel_pendente": 1}
+        )
         if not ordem:
             raise HTTPException(status_code=404, detail="Ordem não encontrada")
         
@@ -3052,14 +3384,13 @@ async def aprovar_ordem(
             )
         
         # Registrar aprovação no histórico
-        aprovacao = {
-            "responsavel": current_user.get("nome") or current_user.get("username"),
-            "data_aprovacao": datetime.now(timezone.utc).isoformat(),
-            "observacao": dados.get("observacao", "")
-        }
-        
-        historico = ordem.get("historico_aprovacoes", [])
-        historico.append(aprovacao)
+        aprovador = current_user.get("nome") or current_user.get("username")
+        aprovacao = novo_evento_ordem(
+            ordem_id, 'aprovacao', current_user.get("username", ""),
+            mudanca=f"Aprovada por {aprovador}",
+            comentario=dados.get("observacao", ""),
+            responsavel=aprovador
+        )
         
         # Atualizar ordem
         resultado = await db.ordens_producao.update_one(
@@ -3069,14 +3400,18 @@ async def aprovar_ordem(
                     "aguardando_aprovacao": False,
                     "responsavel_atual": responsavel_pendente,
                     "responsavel_pendente": "",
-                    "historico_aprovacoes": historico,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
+                    "updated_at": datetime.now(timezone.utc)
+                },
+                "$push": push_eventos_ordem([aprovacao]),
+                "$inc": {"version": 1}
             }
         )
         
         if resultado.modified_count == 0:
             raise HTTPException(status_code=500, detail="Erro ao aprovar ordem")
+        await registrar_eventos_ordem([aprovacao])
+        
+        canal_aprovacoes.publicar(responsavel_pendente, "removida", {"id": ordem_id})
         
         return {
             "success": True,
@@ -3103,7 +3438,9 @@ async def rejeitar_ordem(
             raise HTTPException(status_code=400, detail="Motivo da rejeição é obrigatório")
         
         # Buscar a ordem
-        ordem = await db.ordens_producao.find_one({"id": ordem_id})
+        ordem = await db.ordens_producao.find_one(
+            {"id": ordem_id}, {"_id": 0, "observacoes_internas": 1, "responsavel_pendente": 1}
+        )
         if not ordem:
             raise HTTPException(status_code=404, detail="Ordem não encontrada")
         
@@ -3115,11 +3452,15 @@ async def rejeitar_ordem(
                     "aguardando_aprovacao": False,
                     "responsavel_pendente": "",
                     "observacoes_internas": f"{ordem.get('observacoes_internas', '')}\n\n❌ REJEITADO por {current_user.get('nome')}: {motivo}",
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
+                    "updated_at": datetime.now(timezone.utc)
+                },
+                "$inc": {"version": 1}
             }
         )
         
+        if ordem.get("responsavel_pendente"):
+            canal_aprovacoes.publicar(ordem["responsavel_pendente"], "removida", {"id": ordem_id})
+        
         return {
             "success": True,
             "message": "Ordem rejeitada e devolvida"
@@ -3144,20 +3485,26 @@ async def transferir_responsavel(
             raise HTTPException(status_code=400, detail="Novo responsável é obrigatório")
         
         # Atualizar ordem para aguardar aprovação
-        resultado = await db.ordens_producao.update_one(
+        anterior = await db.ordens_producao.find_one_and_update(
             {"id": ordem_id},
             {
                 "$set": {
                     "aguardando_aprovacao": True,
                     "responsavel_pendente": novo_responsavel,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
-            }
+                    "updated_at": datetime.now(timezone.utc)
+                },
+                "$inc": {"version": 1}
+            },
+            projection={"_id": 0, "aguardando_aprovacao": 1, "responsavel_pendente": 1}
         )
         
-        if resultado.modified_count == 0:
+        if anterior is None:
             raise HTTPException(status_code=404, detail="Ordem não encontrada")
         
+        if anterior.get("aguardando_aprovacao") and anterior.get("responsavel_pendente") not in ("", None, novo_responsavel):
+            canal_aprovacoes.publicar(anterior["responsavel_pendente"], "removida", {"id": ordem_id})
+        await notificar_fila_aprovacao(ordem_id)
+        
         return {
             "success": True,
             "message": "Ordem transferida com sucesso",
@@ -3186,10 +3533,11 @@ async def aprovar_gerencia_producao(
                 "$set": {
                     "aprovacao_gerencia_producao": True,
                     "gerente_que_aprovou": current_user.get("nome") or current_user.get("username"),
-                    "data_aprovacao_gerencia": datetime.now(timezone.utc).isoformat(),
+                    "data_aprovacao_gerencia": datetime.now(timezone.utc),
                     "observacoes_gerencia": observacoes,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
+                    "updated_at": datetime.now(timezone.utc)
+                },
+                "$inc": {"version": 1}
             }
         )
         
@@ -3222,10 +3570,11 @@ async def aprovar_financeiro(
                 "$set": {
                     "aprovacao_financeiro": True,
                     "financeiro_que_aprovou": current_user.get("nome") or current_user.get("username"),
-                    "data_aprovacao_financeiro": datetime.now(timezone.utc).isoformat(),
+                    "data_aprovacao_financeiro": datetime.now(timezone.utc),
                     "observacoes_financeiro": observacoes,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
+                    "updated_at": datetime.now(timezone.utc)
+                },
+                "$inc": {"version": 1}
             }
         )
         
@@ -3279,7 +3628,9 @@ async def enviar_para_setor(
             raise HTTPException(status_code=400, detail="Próximo setor é obrigatório")
         
         # Verificar se tem as duas aprovações
-        ordem = await db.ordens_producao.find_one({"id": ordem_id})
+        ordem = await db.ordens_producao.find_one(
+            {"id": ordem_id}, {"_id": 0, "aprovacao_gerencia_producao": 1, "aprovacao_financeiro": 1}
+        )
         if not ordem:
             raise HTTPException(status_code=404, detail="Ordem não encontrada")
         
@@ -3296,10 +3647,12 @@ async def enviar_para_setor(
                 "$set": {
                     "aguardando_aprovacao": True,
                     "responsavel_pendente": proximo_setor,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
+                    "updated_at": datetime.now(timezone.utc)
+                },
+                "$inc": {"version": 1}
             }
         )
+        await notificar_fila_aprovacao(ordem_id)
         
         return {
             "success": True,
@@ -3331,21 +3684,20 @@ async def upload_fotos_producao(
     current_user: dict = Depends(get_current_user)
 ):
     """Upload de fotos para ordem de produção"""
-    import base64
-    
     try:
-        # Ler arquivo
-        contents = await file.read()
-        
-        # Converter para base64
-        image_base64 = base64.b64encode(contents).decode('utf-8')
-        foto_url = f"data:image/jpeg;base64,{image_base64}"
+        # Gravar no blob store (só JPEG/PNG/WebP conferidos); a ordem guarda apenas a URL
+        try:
+            blob = await blob_store.salvar_upload(file, somente_imagens=True)
+        except blob_store.ArquivoInvalido as e:
+            raise HTTPException(status_code=415, detail=str(e))
+        foto_url = blob['url']
+        imagens.agendar_derivados(foto_url)
         
         # Atualizar ordem com a nova foto
         campo_foto = f"fotos_{tipo_foto}"
         resultado = await db.ordens_producao.update_one(
             {"id": ordem_id},
-            {"$push": {campo_foto: foto_url}}
+            {"$push": {campo_foto: foto_url}, "$set": {"updated_at": datetime.now(timezone.utc)}, "$inc": {"version": 1}}
         )
         
         if resultado.modified_count == 0:
@@ -3357,6 +3709,8 @@ async def upload_fotos_producao(
             "filename": file.filename,
             "tipo": tipo_foto
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -3388,11 +3742,8 @@ async def get_lancamentos(loja: Optional[str] = None, tipo: Optional[str] = None
     if tipo:
         query['tipo'] = tipo
     
-    lancamentos = await db.lancamentos_financeiros.find(query).sort("data", -1).to_list(None)
-    for lancamento in lancamentos:
-        if '_id' in lancamento:
-            del lancamento['_id']
-    return lancamentos
+    lancamentos = await buscar(db.lancamentos_financeiros, query).sort("data", -1).to_list(None)
+    return RespostaJSON(lancamentos)
 
 @api_router.get("/gestao/financeiro/resumo")
 async def get_resumo_financeiro(loja: Optional[str] = None, current_user: dict = Depends(get_current_user)):
@@ -3422,8 +3773,8 @@ async def get_resumo_financeiro(loja: Optional[str] = None, current_user: dict =
 
 # CONTAS BANCÁRIAS
 @api_router.get("/gestao/financeiro/contas-bancarias")
-async def get_contas_bancarias(loja: Optional[str] = None, status: Optional[str] = None, banco: Optional[str] = None, current_user: dict = Depends(get_current_user)):
-    """Lista todas as contas bancárias"""
+async def get_contas_bancarias(request: Request, loja: Optional[str] = None, status: Optional[str] = None, banco: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Lista todas as contas bancárias (cache de referência com ETag)"""
     query = {}
     if loja:
         query['loja_id'] = loja
@@ -3432,45 +3783,44 @@ async def get_contas_bancarias(loja: Optional[str] = None, status: Optional[str]
     if banco:
         query['banco'] = banco
     
-    contas = await db.contas_bancarias.find(query).to_list(None)
-    for conta in contas:
-        if '_id' in conta:
-            del conta['_id']
-    return contas
+    async def carregar():
+        return await buscar(db.contas_bancarias, query).to_list(None)
+    return await responder_referencia(request, cache_contas_bancarias, (loja, status, banco), carregar)
 
 @api_router.post("/gestao/financeiro/contas-bancarias")
 async def create_conta_bancaria(conta: ContaBancaria, current_user: dict = Depends(get_current_user)):
     """Cria uma nova conta bancária"""
     conta.saldo_atual = conta.saldo_inicial
     conta_dict = conta.model_dump()
-    await db.contas_bancarias.insert_one(conta_dict)
-    if '_id' in conta_dict:
-        del conta_dict['_id']
+    await inserir(db.contas_bancarias, conta_dict)
+    cache_formas_pagamento_ativas.invalidar()
+    cache_contas_bancarias.invalidar()
     return conta_dict
 
 @api_router.put("/gestao/financeiro/contas-bancarias/{conta_id}")
 async def update_conta_bancaria(conta_id: str, conta: ContaBancaria, current_user: dict = Depends(get_current_user)):
     """Atualiza uma conta bancária"""
     conta_dict = conta.model_dump()
-    conta_dict['updated_at'] = datetime.now(timezone.utc).isoformat()
+    conta_dict['updated_at'] = datetime.now(timezone.utc)
     await db.contas_bancarias.update_one({"id": conta_id}, {"$set": conta_dict})
+    cache_formas_pagamento_ativas.invalidar()
+    cache_contas_bancarias.invalidar()
     return {"message": "Conta atualizada com sucesso"}
 
 @api_router.delete("/gestao/financeiro/contas-bancarias/{conta_id}")
 async def delete_conta_bancaria(conta_id: str, current_user: dict = Depends(get_current_user)):
     """Deleta uma conta bancária"""
     await db.contas_bancarias.delete_one({"id": conta_id})
+    cache_formas_pagamento_ativas.invalidar()
+    cache_contas_bancarias.invalidar()
     return {"message": "Conta excluída com sucesso"}
 
 # FORMAS DE PAGAMENTO POR BANCO
 @api_router.get("/gestao/financeiro/contas-bancarias/{conta_id}/formas-pagamento")
 async def get_formas_pagamento(conta_id: str, current_user: dict = Depends(get_current_user)):
     """Lista formas de pagamento de uma conta bancária"""
-    formas = await db.formas_pagamento_banco.find({"conta_bancaria_id": conta_id}).to_list(None)
-    for forma in formas:
-        if '_id' in forma:
-            del forma['_id']
-    return formas
+    formas = await buscar(db.formas_pagamento_banco, {"conta_bancaria_id": conta_id}).to_list(None)
+    return RespostaJSON(formas)
 
 @api_router.post("/gestao/financeiro/contas-bancarias/{conta_id}/formas-pagamento")
 async def create_forma_pagamento(conta_id: str, request: Request, current_user: dict = Depends(get_current_user)):
@@ -3489,10 +3839,8 @@ async def create_forma_pagamento(conta_id: str, request: Request, current_user:
         forma.conta_bancaria_id = conta_id
         
         forma_dict = forma.model_dump()
-        await db.formas_pagamento_banco.insert_one(forma_dict)
-        
-        if '_id' in forma_dict:
-            del forma_dict['_id']
+        await inserir(db.formas_pagamento_banco, forma_dict)
+        cache_formas_pagamento_ativas.invalidar()
         
         print(f"✅ Forma de pagamento criada: {forma_dict.get('id')}\n")
         return forma_dict
@@ -3515,34 +3863,34 @@ async def update_forma_pagamento(forma_id: str, forma: FormaPagamentoBanco, curr
     if 'id' in forma_dict:
         del forma_dict['id']
     await db.formas_pagamento_banco.update_one({"id": forma_id}, {"$set": forma_dict})
+    cache_formas_pagamento_ativas.invalidar()
     return {"message": "Forma de pagamento atualizada com sucesso"}
 
 @api_router.delete("/gestao/financeiro/formas-pagamento/{forma_id}")
 async def delete_forma_pagamento(forma_id: str, current_user: dict = Depends(get_current_user)):
     """Deleta uma forma de pagamento"""
     await db.formas_pagamento_banco.delete_one({"id": forma_id})
+    cache_formas_pagamento_ativas.invalidar()
     return {"message": "Forma de pagamento excluída com sucesso"}
 
 # GRUPOS DE CATEGORIAS
 @api_router.get("/gestao/financeiro/grupos-categorias")
-async def get_grupos_categorias(tipo: Optional[str] = None, current_user: dict = Depends(get_current_user)):
-    """Lista grupos de categorias"""
+async def get_grupos_categorias(request: Request, tipo: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Lista grupos de categorias (cache de referência com ETag)"""
     query = {}
     if tipo:
         query['tipo'] = tipo
-    grupos = await db.grupos_categorias.find(query).to_list(None)
-    for grupo in grupos:
-        if '_id' in grupo:
-            del grupo['_id']
-    return grupos
+    
+    async def carregar():
+        return await buscar(db.grupos_categorias, query).to_list(None)
+    return await responder_referencia(request, cache_grupos_categorias, tipo, carregar)
 
 @api_router.post("/gestao/financeiro/grupos-categorias")
 async def create_grupo_categoria(grupo: GrupoCategoria, current_user: dict = Depends(get_current_user)):
     """Cria um novo grupo de categoria"""
     grupo_dict = grupo.model_dump()
-    await db.grupos_categorias.insert_one(grupo_dict)
-    if '_id' in grupo_dict:
-        del grupo_dict['_id']
+    await inserir(db.grupos_categorias, grupo_dict)
+    cache_grupos_categorias.invalidar()
     return grupo_dict
 
 @api_router.put("/gestao/financeiro/grupos-categorias/{grupo_id}")
@@ -3550,28 +3898,29 @@ async def update_grupo_categoria(grupo_id: str, grupo: GrupoCategoria, current_u
     """Atualiza um grupo de categoria"""
     grupo_dict = grupo.model_dump()
     await db.grupos_categorias.update_one({"id": grupo_id}, {"$set": grupo_dict})
+    cache_grupos_categorias.invalidar()
     return {"message": "Grupo atualizado com sucesso"}
 
 @api_router.delete("/gestao/financeiro/grupos-categorias/{grupo_id}")
 async def delete_grupo_categoria(grupo_id: str, current_user: dict = Depends(get_current_user)):
     """Deleta um grupo de categoria"""
     await db.grupos_categorias.delete_one({"id": grupo_id})
+    cache_grupos_categorias.invalidar()
     return {"message": "Grupo excluído com sucesso"}
 
 # CATEGORIAS FINANCEIRAS
 @api_router.get("/gestao/financeiro/categorias")
-async def get_categorias(tipo: Optional[str] = None, status: Optional[str] = None, current_user: dict = Depends(get_current_user)):
-    """Lista categorias financeiras"""
+async def get_categorias(request: Request, tipo: Optional[str] = None, status: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Lista categorias financeiras (cache de referência com ETag)"""
     query = {}
     if tipo:
         query['tipo'] = tipo
     if status:
         query['status'] = status
-    categorias = await db.categorias_financeiras.find(query).to_list(None)
-    for cat in categorias:
-        if '_id' in cat:
-            del cat['_id']
-    return categorias
+    
+    async def carregar():
+        return await buscar(db.categorias_financeiras, query).to_list(None)
+    return await responder_referencia(request, cache_categorias, (tipo, status), carregar)
 
 @api_router.post("/gestao/financeiro/categorias")
 async def create_categoria(categoria: CategoriaFinanceira, current_user: dict = Depends(get_current_user)):
@@ -3583,9 +3932,8 @@ async def create_categoria(categoria: CategoriaFinanceira, current_user: dict =
             categoria.grupo_nome = grupo.get('nome', '')
     
     categoria_dict = categoria.model_dump()
-    await db.categorias_financeiras.insert_one(categoria_dict)
-    if '_id' in categoria_dict:
-        del categoria_dict['_id']
+    await inserir(db.categorias_financeiras, categoria_dict)
+    cache_categorias.invalidar()
     return categoria_dict
 
 @api_router.put("/gestao/financeiro/categorias/{categoria_id}")
@@ -3598,12 +3946,14 @@ async def update_categoria(categoria_id: str, categoria: CategoriaFinanceira, cu
     
     categoria_dict = categoria.model_dump()
     await db.categorias_financeiras.update_one({"id": categoria_id}, {"$set": categoria_dict})
+    cache_categorias.invalidar()
     return {"message": "Categoria atualizada com sucesso"}
 
 @api_router.delete("/gestao/financeiro/categorias/{categoria_id}")
 async def delete_categoria(categoria_id: str, current_user: dict = Depends(get_current_user)):
     """Deleta uma categoria"""
     await db.categorias_financeiras.delete_one({"id": categoria_id})
+    cache_categorias.invalidar()
     return {"message": "Categoria excluída com sucesso"}
 
 # CONTAS A PAGAR
@@ -3615,11 +3965,8 @@ async def get_contas_pagar(loja: Optional[str] = None, status: Optional[str] = N
         query['loja_id'] = loja
     if status:
         query['status'] = status
-    contas = await db.contas_pagar.find(query).sort("data_vencimento", 1).to_list(None)
-    for conta in contas:
-        if '_id' in conta:
-            del conta['_id']
-    return contas
+    contas = await buscar(db.contas_pagar, query).sort("data_vencimento", 1).to_list(None)
+    return RespostaJSON(contas)
 
 @api_router.post("/gestao/financeiro/contas-pagar")
 async def create_conta_pagar(conta: ContaPagar, current_user: dict = Depends(get_current_user)):
@@ -3637,9 +3984,7 @@ async def create_conta_pagar(conta: ContaPagar, current_user: dict = Depends(get
     
     conta.created_by = current_user.get('username', '')
     conta_dict = conta.model_dump()
-    await db.contas_pagar.insert_one(conta_dict)
-    if '_id' in conta_dict:
-        del conta_dict['_id']
+    await inserir(db.contas_pagar, conta_dict)
     return conta_dict
 
 @api_router.put("/gestao/financeiro/contas-pagar/{conta_id}")
@@ -3659,6 +4004,7 @@ async def update_conta_pagar(conta_id: str, conta: ContaPagar, current_user: dic
                 {"id": conta.conta_bancaria_id},
                 {"$set": {"saldo_atual": novo_saldo}}
             )
+            cache_contas_bancarias.invalidar()
             
             # Criar movimentação no extrato
             movimentacao = MovimentacaoFinanceira(
@@ -3737,35 +4083,31 @@ async def get_contas_receber(
     if data_venc_inicio or data_venc_fim:
         query['data_vencimento'] = {}
         if data_venc_inicio:
-            query['data_vencimento']['$gte'] = datetime.fromisoformat(data_venc_inicio)
+            query['data_vencimento']['$gte'] = para_datetime(data_venc_inicio)
         if data_venc_fim:
-            query['data_vencimento']['$lte'] = datetime.fromisoformat(data_venc_fim)
+            query['data_vencimento']['$lte'] = para_datetime(data_venc_fim)
     
     if data_pag_inicio or data_pag_fim:
         query['data_pago_loja'] = {}
         if data_pag_inicio:
-            query['data_pago_loja']['$gte'] = datetime.fromisoformat(data_pag_inicio)
+            query['data_pago_loja']['$gte'] = para_datetime(data_pag_inicio)
         if data_pag_fim:
-            query['data_pago_loja']['$lte'] = datetime.fromisoformat(data_pag_fim)
+            query['data_pago_loja']['$lte'] = para_datetime(data_pag_fim)
     
     if data_baixa_inicio or data_baixa_fim:
         query['data_recebimento'] = {}
         if data_baixa_inicio:
-            query['data_recebimento']['$gte'] = datetime.fromisoformat(data_baixa_inicio)
+            query['data_recebimento']['$gte'] = para_datetime(data_baixa_inicio)
         if data_baixa_fim:
-            query['data_recebimento']['$lte'] = datetime.fromisoformat(data_baixa_fim)
+            query['data_recebimento']['$lte'] = para_datetime(data_baixa_fim)
     
-    contas = await db.contas_receber.find(query).sort("data_vencimento", 1).to_list(None)
+    contas = await buscar(db.contas_receber, query).sort("data_vencimento", 1).to_list(None)
     
     # Calcular totais
     total_bruto = sum(c.get('valor_bruto', 0) for c in contas)
     total_liquido = sum(c.get('valor_liquido', 0) for c in contas)
     total_pendentes = len([c for c in contas if c.get('status') == 'Pendente'])
     
-    for conta in contas:
-        if '_id' in conta:
-            del conta['_id']
-    
     return {
         "contas": contas,
         "totais": {
@@ -3792,9 +4134,7 @@ async def create_conta_receber(conta: ContaReceber, current_user: dict = Depends
     
     conta.created_by = current_user.get('username', '')
     conta_dict = conta.model_dump()
-    await db.contas_receber.insert_one(conta_dict)
-    if '_id' in conta_dict:
-        del conta_dict['_id']
+    await inserir(db.contas_receber, conta_dict)
     return conta_dict
 
 @api_router.put("/gestao/financeiro/contas-receber/{conta_id}")
@@ -3814,6 +4154,7 @@ async def update_conta_receber(conta_id: str, conta: ContaReceber, current_user:
                 {"id": conta.conta_bancaria_id},
                 {"$set": {"saldo_atual": novo_saldo}}
             )
+            cache_contas_bancarias.invalidar()
             
             # Criar movimentação no extrato
             movimentacao = MovimentacaoFinanceira(
@@ -3862,7 +4203,7 @@ async def baixar_conta_receber(
         # Extrair dados da baixa
         data_baixa = data.get('data_baixa')
         if data_baixa:
-            data_recebimento = datetime.fromisoformat(data_baixa)
+            data_recebimento = para_datetime(data_baixa)
         else:
             data_recebimento = datetime.now(timezone.utc)
         
@@ -3872,10 +4213,10 @@ async def baixar_conta_receber(
         # Atualizar status e datas
         update_data = {
             'status': 'Recebido',
-            'data_recebimento': data_recebimento.isoformat(),
-            'data_pago_loja': data_recebimento.isoformat(),
+            'data_recebimento': data_recebimento,
+            'data_pago_loja': data_recebimento,
             'observacoes': conta.get('observacoes', '') + f" | Baixa: {observacoes_baixa}" if observacoes_baixa else conta.get('observacoes', ''),
-            'updated_at': datetime.now(timezone.utc).isoformat()
+            'updated_at': datetime.now(timezone.utc)
         }
         
         # Atualizar saldo da conta bancária (crédito)
@@ -3889,6 +4230,7 @@ async def baixar_conta_receber(
                     {"id": conta['conta_bancaria_id']},
                     {"$set": {"saldo_atual": novo_saldo}}
                 )
+                cache_contas_bancarias.invalidar()
                 
                 # Criar movimentação no extrato
                 movimentacao = {
@@ -3900,11 +4242,11 @@ async def baixar_conta_receber(
                     'valor': valor_recebido,
                     'saldo_anterior': saldo_anterior,
                     'saldo_posterior': novo_saldo,
-                    'data': data_recebimento.isoformat(),
+                    'data': data_recebimento,
                     'origem_tipo': 'ContaReceber',
                     'origem_id': conta_id,
                     'loja_id': conta.get('loja_id', 'fabrica'),
-                    'created_at': datetime.now(timezone.utc).isoformat()
+                    'created_at': datetime.now(timezone.utc)
                 }
                 await db.movimentacoes_financeiras.insert_one(movimentacao)
                 
@@ -3914,9 +4256,7 @@ async def baixar_conta_receber(
         await db.contas_receber.update_one({"id": conta_id}, {"$set": update_data})
         
         # Buscar conta atualizada
-        conta_atualizada = await db.contas_receber.find_one({"id": conta_id})
-        if '_id' in conta_atualizada:
-            del conta_atualizada['_id']
+        conta_atualizada = await buscar_um(db.contas_receber, {"id": conta_id})
         
         print(f"✅ Baixa realizada com sucesso para conta {conta_id}")
         return {
@@ -3936,11 +4276,8 @@ async def baixar_conta_receber(
 @api_router.get("/gestao/financeiro/transferencias")
 async def get_transferencias(current_user: dict = Depends(get_current_user)):
     """Lista transferências"""
-    transferencias = await db.transferencias.find({}).sort("data", -1).to_list(None)
-    for transf in transferencias:
-        if '_id' in transf:
-            del transf['_id']
-    return transferencias
+    transferencias = await buscar(db.transferencias, {}).sort("data", -1).to_list(None)
+    return RespostaJSON(transferencias)
 
 @api_router.post("/gestao/financeiro/transferencias")
 async def create_transferencia(transf: Transferencia, current_user: dict = Depends(get_current_user)):
@@ -3965,6 +4302,7 @@ async def create_transferencia(transf: Transferencia, current_user: dict = Depen
         {"id": transf.conta_destino_id},
         {"$set": {"saldo_atual": novo_saldo_destino}}
     )
+    cache_contas_bancarias.invalidar()
     
     # Salvar transferência
     transf.conta_origem_nome = conta_origem.get('nome', '')
@@ -3972,7 +4310,7 @@ async def create_transferencia(transf: Transferencia, current_user: dict = Depen
     transf.created_by = current_user.get('username', '')
     
     transf_dict = transf.model_dump()
-    await db.transferencias.insert_one(transf_dict)
+    await inserir(db.transferencias, transf_dict)
     
     # Criar 2 movimentações
     mov_origem = MovimentacaoFinanceira(
@@ -4004,8 +4342,6 @@ async def create_transferencia(transf: Transferencia, current_user: dict = Depen
     await db.movimentacoes_financeiras.insert_one(mov_origem.model_dump())
     await db.movimentacoes_financeiras.insert_one(mov_destino.model_dump())
     
-    if '_id' in transf_dict:
-        del transf_dict['_id']
     return transf_dict
 
 # LANÇAMENTO RÁPIDO
@@ -4035,10 +4371,11 @@ async def create_lancamento_rapido(lanc: LancamentoRapido, current_user: dict =
         {"id": lanc.conta_bancaria_id},
         {"$set": {"saldo_atual": novo_saldo}}
     )
+    cache_contas_bancarias.invalidar()
     
     # Salvar lançamento
     lanc_dict = lanc.model_dump()
-    await db.lancamentos_rapidos.insert_one(lanc_dict)
+    await inserir(db.lancamentos_rapidos, lanc_dict)
     
     # Criar movimentação
     mov = MovimentacaoFinanceira(
@@ -4056,8 +4393,6 @@ async def create_lancamento_rapido(lanc: LancamentoRapido, current_user: dict =
     )
     await db.movimentacoes_financeiras.insert_one(mov.model_dump())
     
-    if '_id' in lanc_dict:
-        del lanc_dict['_id']
     return lanc_dict
 
 # EXTRATO BANCÁRIO
@@ -4075,19 +4410,16 @@ async def get_extrato(
     if data_inicio or data_fim:
         query['data'] = {}
         if data_inicio:
-            query['data']['$gte'] = datetime.fromisoformat(data_inicio)
+            query['data']['$gte'] = para_datetime(data_inicio)
         if data_fim:
-            query['data']['$lte'] = datetime.fromisoformat(data_fim)
+            query['data']['$lte'] = para_datetime(data_fim)
     
     if tipo:
         query['tipo'] = tipo
     
-    movimentacoes = await db.movimentacoes_financeiras.find(query).sort("data", -1).to_list(None)
-    for mov in movimentacoes:
-        if '_id' in mov:
-            del mov['_id']
+    movimentacoes = await buscar(db.movimentacoes_financeiras, query).sort("data", -1).to_list(None)
     
-    return movimentacoes
+    return RespostaJSON(movimentacoes)
 
 # DASHBOARD FINANCEIRO
 @api_router.get("/gestao/financeiro/dashboard")
@@ -4231,34 +4563,65 @@ async def get_dre(mes: int, ano: int, loja: Optional[str] = None, current_user:
     }
 
 # ENDPOINT PARA ORÇAMENTO - FORMAS DE PAGAMENTO ATIVAS
+
+# Lista formatada por banco_id (None = todos os bancos). Invalidada pelas
+# rotas de escrita de contas bancárias e formas de pagamento.
+cache_formas_pagamento_ativas = CacheLocal()
+
 @api_router.get("/gestao/financeiro/formas-pagamento-ativas")
 async def get_formas_pagamento_ativas(banco_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
     """Retorna formas de pagamento ativas para usar no orçamento"""
+    resultado = cache_formas_pagamento_ativas.get(banco_id)
+    if resultado is not None:
+        return resultado
+    
     query = {"ativa": True}
     if banco_id:
         query['conta_bancaria_id'] = banco_id
     
-    formas = await db.formas_pagamento_banco.find(query).to_list(None)
+    formas = await buscar(db.formas_pagamento_banco, query).to_list(None)
+    
+    # Buscar nomes de todos os bancos envolvidos em uma única consulta
+    bancos_ids = list({forma['conta_bancaria_id'] for forma in formas if forma.get('conta_bancaria_id')})
+    bancos = await db.contas_bancarias.find(
+        {"id": {"$in": bancos_ids}}, {"_id": 0, "id": 1, "nome": 1}
+    ).to_list(None)
+    nomes_bancos = {banco['id']: banco.get('nome', '') for banco in bancos}
     
-    # Buscar nome do banco para cada forma
     resultado = []
     for forma in formas:
-        if '_id' in forma:
-            del forma['_id']
-        
-        # Buscar nome do banco
-        if forma.get('conta_bancaria_id'):
-            banco = await db.contas_bancarias.find_one({"id": forma['conta_bancaria_id']})
-            if banco:
-                forma['banco_nome'] = banco.get('nome', '')
-                # Formatar nome completo: [Banco] - [Forma] - [Parcelas]x - Taxa [Taxa%]
-                forma['nome_formatado'] = f"{banco.get('nome', '')} – {forma.get('forma_pagamento', '')} – {forma.get('numero_parcelas', 1)}x – Taxa {forma.get('taxa_banco_percentual', 0)}%"
+        banco_nome = nomes_bancos.get(forma.get('conta_bancaria_id'))
+        if banco_nome is not None:
+            forma['banco_nome'] = banco_nome
+            # Formatar nome completo: [Banco] - [Forma] - [Parcelas]x - Taxa [Taxa%]
+            forma['nome_formatado'] = f"{banco_nome} – {forma.get('forma_pagamento', '')} – {forma.get('numero_parcelas', 1)}x – Taxa {forma.get('taxa_banco_percentual', 0)}%"
         
         resultado.append(forma)
     
+    cache_formas_pagamento_ativas.set(banco_id, resultado)
     return resultado
 
 # RELATÓRIO DE TAXAS - VENDAS × PAGAMENTOS
+
+# Relatórios já calculados, por (data_inicio, data_fim, loja)
+cache_relatorio_taxas = CacheLocal(ttl_segundos=600)
+
+def invalidar_relatorio_taxas(data_abertura=None, loja_id: Optional[str] = None):
+    """Descarta os relatórios em cache cujo período e loja incluem o pedido alterado.
+    Sem data_abertura (ex: pedido excluído), descarta todos os períodos da loja."""
+    data_abertura = para_datetime(data_abertura)
+    
+    def afetado(chave):
+        data_inicio, data_fim, loja = chave
+        if loja and loja_id and loja != loja_id:
+            return False
+        inicio, fim = para_datetime(data_inicio), para_datetime(data_fim)
+        if not isinstance(data_abertura, datetime) or not isinstance(inicio, datetime) or not isinstance(fim, datetime):
+            return True
+        return inicio <= data_abertura <= fim
+    
+    cache_relatorio_taxas.invalidar(afetado)
+
 @api_router.get("/gestao/financeiro/relatorio-taxas")
 async def get_relatorio_taxas(
     data_inicio: Optional[str] = None,
@@ -4267,13 +4630,17 @@ async def get_relatorio_taxas(
     current_user: dict = Depends(get_current_user)
 ):
     """Relatório de análise de taxas por forma de pagamento"""
+    chave_cache = (data_inicio, data_fim, loja)
+    relatorio = cache_relatorio_taxas.get(chave_cache)
+    if relatorio is not None:
+        return relatorio
     
     # Construir filtro de data
     query = {}
     if data_inicio and data_fim:
         query['data_abertura'] = {
-            '$gte': datetime.fromisoformat(data_inicio),
-            '$lte': datetime.fromisoformat(data_fim)
+            '$gte': para_datetime(data_inicio),
+            '$lte': para_datetime(data_fim)
         }
     
     if loja:
@@ -4282,112 +4649,141 @@ async def get_relatorio_taxas(
     # Buscar apenas pedidos com forma de pagamento definida
     query['forma_pagamento_id'] = {'$ne': None}
     
-    pedidos = await db.pedidos_manufatura.find(query).to_list(None)
+    valor_bruto = {"$ifNull": ["$valor_bruto", 0]}
+    taxa_valor = {"$ifNull": ["$taxa_valor_real", 0]}
+    valor_liquido = {"$ifNull": ["$valor_liquido_empresa", 0]}
+    forma_nome = {"$ifNull": ["$forma_pagamento_nome", "Não informado"]}
+    
+    # Uma única passada sobre os pedidos: métricas globais + três rankings
+    resultado = await db.pedidos_manufatura.aggregate([
+        {"$match": query},
+        {"$facet": {
+            "metricas": [
+                {"$group": {
+                    "_id": None,
+                    "faturamento_bruto": {"$sum": valor_bruto},
+                    "total_taxas": {"$sum": taxa_valor},
+                    "valor_liquido": {"$sum": valor_liquido},
+                    "total_vendas": {"$sum": 1}
+                }}
+            ],
+            "por_forma": [
+                {"$group": {
+                    "_id": forma_nome,
+                    "total_vendido": {"$sum": valor_bruto},
+                    "total_taxas": {"$sum": taxa_valor},
+                    "valor_liquido": {"$sum": valor_liquido},
+                    "quantidade": {"$sum": 1}
+                }}
+            ],
+            "por_loja": [
+                {"$group": {
+                    "_id": {"loja": {"$ifNull": ["$loja_id", "Não informado"]}, "forma": forma_nome},
+                    "total_vendido": {"$sum": valor_bruto},
+                    "total_taxas": {"$sum": taxa_valor},
+                    "quantidade": {"$sum": 1}
+                }},
+                {"$sort": {"quantidade": -1}},
+                {"$group": {
+                    "_id": "$_id.loja",
+                    "total_vendido": {"$sum": "$total_vendido"},
+                    "total_taxas": {"$sum": "$total_taxas"},
+                    "quantidade": {"$sum": "$quantidade"},
+                    "formas_usadas": {"$push": {"k": "$_id.forma", "v": "$quantidade"}}
+                }}
+            ],
+            "por_banco": [
+                {"$group": {
+                    "_id": {
+                        "banco": {"$ifNull": ["$conta_bancaria_nome", "Não informado"]},
+                        "parcelas": {"$ifNull": ["$forma_pagamento_parcelas", 1]}
+                    },
+                    "total_processado": {"$sum": valor_bruto},
+                    "total_taxas": {"$sum": taxa_valor},
+                    "quantidade": {"$sum": 1}
+                }},
+                {"$sort": {"quantidade": -1}},
+                {"$group": {
+                    "_id": "$_id.banco",
+                    "total_processado": {"$sum": "$total_processado"},
+                    "total_taxas": {"$sum": "$total_taxas"},
+                    "quantidade": {"$sum": "$quantidade"},
+                    "parcelas_usadas": {"$push": {"k": {"$toString": "$_id.parcelas"}, "v": "$quantidade"}}
+                }}
+            ]
+        }}
+    ]).to_list(1)
+    resultado = resultado[0] if resultado else {}
     
     # Métricas principais
-    faturamento_bruto = sum(p.get('valor_bruto', 0) for p in pedidos)
-    total_taxas = sum(p.get('taxa_valor_real', 0) for p in pedidos)
-    valor_liquido = sum(p.get('valor_liquido_empresa', 0) for p in pedidos)
+    metricas = (resultado.get('metricas') or [{}])[0]
+    faturamento_bruto = metricas.get('faturamento_bruto', 0)
+    total_taxas = metricas.get('total_taxas', 0)
+    total_liquido = metricas.get('valor_liquido', 0)
+    total_vendas = metricas.get('total_vendas', 0)
     taxa_media = (total_taxas / faturamento_bruto * 100) if faturamento_bruto > 0 else 0
-    ticket_medio = valor_liquido / len(pedidos) if pedidos else 0
+    ticket_medio = total_liquido / total_vendas if total_vendas else 0
     
     # Ranking por forma de pagamento
-    ranking_forma = {}
-    for p in pedidos:
-        forma_nome = p.get('forma_pagamento_nome', 'Não informado')
-        if forma_nome not in ranking_forma:
-            ranking_forma[forma_nome] = {
-                'forma': forma_nome,
-                'total_vendido': 0,
-                'total_taxas': 0,
-                'valor_liquido': 0,
-                'quantidade': 0
-            }
-        
-        ranking_forma[forma_nome]['total_vendido'] += p.get('valor_bruto', 0)
-        ranking_forma[forma_nome]['total_taxas'] += p.get('taxa_valor_real', 0)
-        ranking_forma[forma_nome]['valor_liquido'] += p.get('valor_liquido_empresa', 0)
-        ranking_forma[forma_nome]['quantidade'] += 1
-    
-    # Calcular taxa média por forma
-    for forma in ranking_forma.values():
+    ranking_forma = []
+    for grupo in resultado.get('por_forma', []):
+        forma = {
+            'forma': grupo['_id'],
+            'total_vendido': grupo['total_vendido'],
+            'total_taxas': grupo['total_taxas'],
+            'valor_liquido': grupo['valor_liquido'],
+            'quantidade': grupo['quantidade']
+        }
         if forma['total_vendido'] > 0:
             forma['taxa_media_percentual'] = (forma['total_taxas'] / forma['total_vendido']) * 100
-    
-    # Ranking por loja
-    ranking_loja = {}
-    for p in pedidos:
-        loja_id = p.get('loja_id', 'Não informado')
-        if loja_id not in ranking_loja:
-            ranking_loja[loja_id] = {
-                'loja': loja_id,
-                'total_vendido': 0,
-                'total_taxas': 0,
-                'quantidade': 0,
-                'formas_usadas': {}
-            }
-        
-        ranking_loja[loja_id]['total_vendido'] += p.get('valor_bruto', 0)
-        ranking_loja[loja_id]['total_taxas'] += p.get('taxa_valor_real', 0)
-        ranking_loja[loja_id]['quantidade'] += 1
-        
-        # Contar formas usadas
-        forma = p.get('forma_pagamento_nome', 'Não informado')
-        ranking_loja[loja_id]['formas_usadas'][forma] = ranking_loja[loja_id]['formas_usadas'].get(forma, 0) + 1
-    
-    # Determinar forma mais usada por loja
-    for loja_data in ranking_loja.values():
-        if loja_data['formas_usadas']:
-            loja_data['forma_mais_usada'] = max(loja_data['formas_usadas'].items(), key=lambda x: x[1])[0]
-        else:
-            loja_data['forma_mais_usada'] = 'Nenhuma'
-        
+        ranking_forma.append(forma)
+    
+    # Ranking por loja (formas_usadas já vem ordenado pela mais usada)
+    ranking_loja = []
+    for grupo in resultado.get('por_loja', []):
+        formas_usadas = {f['k']: f['v'] for f in grupo['formas_usadas']}
+        loja_data = {
+            'loja': grupo['_id'],
+            'total_vendido': grupo['total_vendido'],
+            'total_taxas': grupo['total_taxas'],
+            'quantidade': grupo['quantidade'],
+            'formas_usadas': formas_usadas,
+            'forma_mais_usada': grupo['formas_usadas'][0]['k'] if grupo['formas_usadas'] else 'Nenhuma'
+        }
         if loja_data['total_vendido'] > 0:
             loja_data['taxa_media_percentual'] = (loja_data['total_taxas'] / loja_data['total_vendido']) * 100
-    
-    # Ranking por banco
-    ranking_banco = {}
-    for p in pedidos:
-        banco_nome = p.get('conta_bancaria_nome', 'Não informado')
-        if banco_nome not in ranking_banco:
-            ranking_banco[banco_nome] = {
-                'banco': banco_nome,
-                'total_processado': 0,
-                'total_taxas': 0,
-                'quantidade': 0,
-                'parcelas_usadas': {}
-            }
-        
-        ranking_banco[banco_nome]['total_processado'] += p.get('valor_bruto', 0)
-        ranking_banco[banco_nome]['total_taxas'] += p.get('taxa_valor_real', 0)
-        ranking_banco[banco_nome]['quantidade'] += 1
-        
-        parcelas = p.get('forma_pagamento_parcelas', 1)
-        ranking_banco[banco_nome]['parcelas_usadas'][parcelas] = ranking_banco[banco_nome]['parcelas_usadas'].get(parcelas, 0) + 1
-    
-    # Determinar parcelamento mais usado
-    for banco_data in ranking_banco.values():
-        if banco_data['parcelas_usadas']:
-            banco_data['parcelamento_mais_usado'] = f"{max(banco_data['parcelas_usadas'].items(), key=lambda x: x[1])[0]}x"
-        else:
-            banco_data['parcelamento_mais_usado'] = '1x'
-        
+        ranking_loja.append(loja_data)
+    
+    # Ranking por banco (parcelas_usadas já vem ordenado pelo parcelamento mais usado)
+    ranking_banco = []
+    for grupo in resultado.get('por_banco', []):
+        banco_data = {
+            'banco': grupo['_id'],
+            'total_processado': grupo['total_processado'],
+            'total_taxas': grupo['total_taxas'],
+            'quantidade': grupo['quantidade'],
+            'parcelas_usadas': {p['k']: p['v'] for p in grupo['parcelas_usadas']},
+            'parcelamento_mais_usado': f"{grupo['parcelas_usadas'][0]['k']}x" if grupo['parcelas_usadas'] else '1x'
+        }
         if banco_data['total_processado'] > 0:
             banco_data['taxa_media_percentual'] = (banco_data['total_taxas'] / banco_data['total_processado']) * 100
+        ranking_banco.append(banco_data)
     
-    return {
+    relatorio = {
         "metricas": {
             "faturamento_bruto_total": faturamento_bruto,
             "valor_total_taxas": total_taxas,
-            "valor_liquido_recebido": valor_liquido,
+            "valor_liquido_recebido": total_liquido,
             "taxa_media_percentual": taxa_media,
             "ticket_medio_liquido": ticket_medio,
-            "total_vendas": len(pedidos)
+            "total_vendas": total_vendas
         },
-        "ranking_por_forma": list(ranking_forma.values()),
-        "ranking_por_loja": list(ranking_loja.values()),
-        "ranking_por_banco": list(ranking_banco.values())
+        "ranking_por_forma": ranking_forma,
+        "ranking_por_loja": ranking_loja,
+        "ranking_por_banco": ranking_banco
     }
+    cache_relatorio_taxas.set(chave_cache, relatorio)
+    return relatorio
 
 # ============= DASHBOARD E RELATÓRIOS =============
 
@@ -4411,32 +4807,31 @@ async def get_estatisticas_pedidos(loja: Optional[str] = None, current_user: dic
     # Pedidos em produção (todos exceto Entregue e Cancelado)
     em_producao = len([p for p in pedidos if p.get('status') not in ['Entregue', 'Cancelado']])
     
-    # Pedidos em atraso (prazo vencido e não entregue)
+    # Pedidos em atraso (prazo vencido e não entregue) - prazo_entrega é datetime BSON
     hoje = datetime.now(timezone.utc)
-    em_atraso = 0
-    for p in pedidos:
-        if p.get('status') not in ['Entregue', 'Cancelado'] and p.get('prazo_entrega'):
-            prazo = p['prazo_entrega']
-            if isinstance(prazo, str):
-                prazo = datetime.fromisoformat(prazo.replace('Z', '+00:00'))
-            if prazo < hoje:
-                em_atraso += 1
+    em_atraso = await db.pedidos_manufatura.count_documents({
+        **query,
+        "status": {"$nin": ["Entregue", "Cancelado"]},
+        "prazo_entrega": {"$lt": hoje}
+    })
     
     # Calcular perdas técnicas do mês
     primeiro_dia_mes = hoje.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    pedidos_mes = [p for p in pedidos if p.get('created_at')]
-    
-    perda_total_cm = 0
-    perda_total_valor = 0
-    for p in pedidos_mes:
-        created = p.get('created_at')
-        if isinstance(created, str):
-            created = datetime.fromisoformat(created.replace('Z', '+00:00'))
-        if created >= primeiro_dia_mes:
-            sobra = p.get('sobra', 0)
-            if sobra > 0 and sobra < 100:
-                perda_total_cm += sobra
-                perda_total_valor += p.get('custo_perda', 0)
+    perdas = await db.pedidos_manufatura.aggregate([
+        {"$match": {
+            **query,
+            "created_at": {"$gte": primeiro_dia_mes},
+            "sobra": {"$gt": 0, "$lt": 100}
+        }},
+        {"$group": {
+            "_id": None,
+            "perda_cm": {"$sum": "$sobra"},
+            "perda_valor": {"$sum": {"$ifNull": ["$custo_perda", 0]}}
+        }}
+    ]).to_list(1)
+    
+    perda_total_cm = perdas[0]['perda_cm'] if perdas else 0
+    perda_total_valor = perdas[0]['perda_valor'] if perdas else 0
     
     # Total de pedidos finalizados
     finalizados = len([p for p in pedidos if p.get('status') in ['Pronto', 'Entregue']])
@@ -4503,24 +4898,20 @@ async def get_evolucao_diaria(dias: int = 30, loja: Optional[str] = None, curren
     hoje = datetime.now(timezone.utc)
     inicio = hoje - timedelta(days=dias)
     
-    pedidos = await db.pedidos_manufatura.find(query).to_list(None)
+    # Agrupar por data direto no banco (created_at é datetime BSON)
+    por_dia = await db.pedidos_manufatura.aggregate([
+        {"$match": {**query, "created_at": {"$gte": inicio}}},
+        {"$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
+            "total": {"$sum": 1}
+        }}
+    ]).to_list(None)
+    contagem = {d['_id']: d['total'] for d in por_dia}
     
-    # Agrupar por data
     evolucao = {}
     for i in range(dias):
-        data = inicio + timedelta(days=i)
-        data_str = data.strftime('%Y-%m-%d')
-        evolucao[data_str] = 0
-    
-    for pedido in pedidos:
-        created = pedido.get('created_at')
-        if created:
-            if isinstance(created, str):
-                created = datetime.fromisoformat(created.replace('Z', '+00:00'))
-            if created >= inicio:
-                data_str = created.strftime('%Y-%m-%d')
-                if data_str in evolucao:
-                    evolucao[data_str] += 1
+        data_str = (inicio + timedelta(days=i)).strftime('%Y-%m-%d')
+        evolucao[data_str] = contagem.get(data_str, 0)
     
     return {
         'labels': list(evolucao.keys()),
@@ -4532,21 +4923,42 @@ async def get_evolucao_diaria(dias: int = 30, loja: Optional[str] = None, curren
 # ========================================
 
 # PROJETOS MARKETPLACE
-@api_router.get("/gestao/marketplaces/projetos")
-async def get_projetos_marketplace(current_user: dict = Depends(get_current_user)):
-    """Lista todos os projetos de marketplace"""
-    projetos = await db.projetos_marketplace.find().to_list(None)
-    
-    # Se não houver projetos, inicializar os 3 principais
-    if not projetos:
-        projetos_iniciais = [
-            {
+# Projetos criados na inicialização quando ainda não há nenhum projeto
+PROJETOS_MARKETPLACE_PADRAO = [
+    {
+        "nome": "Shopee - Diamonds",
+        "plataforma": "shopee",
+        "descricao": "Controle de produção e pedidos integrados à Shopee",
+        "icone": "🛍️",
+        "cor_primaria": "#FF6B00"
+    },
+    {
+        "nome": "Mercado Livre",
+        "plataforma": "mercadolivre",
+        "descricao": "Controle de produção e pedidos integrados ao Mercado Livre",
+        "icone": "💛",
+        "cor_primaria": "#FFE600"
+    },
+    {
+        "nome": "TikTok Shop",
+        "plataforma": "tiktok",
+        "descricao": "Controle de produção e pedidos integrados ao TikTok Shop",
+        "icone": "🎵",
+        "cor_primaria": "#000000"
+    }
+]
+
+async def semear_projetos_marketplace():
+    """Cria os 3 projetos principais se a coleção estiver vazia (upsert por plataforma)"""
+    if await db.projetos_marketplace.count_documents({}, limit=1):
+        return
+    agora = datetime.now(timezone.utc).isoformat()
+    for padrao in PROJETOS_MARKETPLACE_PADRAO:
+        await db.projetos_marketplace.update_one(
+            {"plataforma": padrao['plataforma']},
+            {"$setOnInsert": {
                 "id": str(uuid.uuid4()),
-                "nome": "Shopee - Diamonds",
-                "plataforma": "shopee",
-                "descricao": "Controle de produção e pedidos integrados à Shopee",
-                "icone": "🛍️",
-                "cor_primaria": "#FF6B00",
+                **padrao,
                 "status_ativo": True,
                 "pedidos_em_producao": 0,
                 "pedidos_enviados": 0,
@@ -4556,54 +4968,27 @@ async def get_projetos_marketplace(current_user: dict = Depends(get_current_user
                 "performance_icone": "🚀",
                 "valor_total_vendido": 0,
                 "loja_id": "fabrica",
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat(),
-                "created_by": current_user.get('username', '')
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "nome": "Mercado Livre",
-                "plataforma": "mercadolivre",
-                "descricao": "Controle de produção e pedidos integrados ao Mercado Livre",
-                "icone": "💛",
-                "cor_primaria": "#FFE600",
-                "status_ativo": True,
-                "pedidos_em_producao": 0,
-                "pedidos_enviados": 0,
-                "pedidos_entregues": 0,
-                "pedidos_atrasados": 0,
-                "progresso_percentual": 0,
-                "performance_icone": "🚀",
-                "valor_total_vendido": 0,
-                "loja_id": "fabrica",
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat(),
-                "created_by": current_user.get('username', '')
-            },
-            {
-                "id": str(uuid.uuid4()),
-                "nome": "TikTok Shop",
-                "plataforma": "tiktok",
-                "descricao": "Controle de produção e pedidos integrados ao TikTok Shop",
-                "icone": "🎵",
-                "cor_primaria": "#000000",
-                "status_ativo": True,
-                "pedidos_em_producao": 0,
-                "pedidos_enviados": 0,
-                "pedidos_entregues": 0,
-                "pedidos_atrasados": 0,
-                "progresso_percentual": 0,
-                "performance_icone": "🚀",
-                "valor_total_vendido": 0,
-                "loja_id": "fabrica",
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "updated_at": datetime.now(timezone.utc).isoformat(),
-                "created_by": current_user.get('username', '')
-            }
-        ]
-        
-        await db.projetos_marketplace.insert_many(projetos_iniciais)
-        projetos = projetos_iniciais
+                "created_at": agora,
+                "updated_at": agora,
+                "created_by": "sistema"
+            }},
+            upsert=True
+        )
+    print("✅ Projetos de marketplace padrão criados")
+    cache_projetos_marketplace.invalidar()
+
+@api_router.get("/gestao/marketplaces/projetos")
+async def get_projetos_marketplace(request: Request, current_user: dict = Depends(get_current_user)):
+    """Lista todos os projetos de marketplace.
+    Os cadastros vêm do cache de referência; as métricas de pedidos são calculadas a
+    cada chamada, e a ETag da resposta completa permite 304 quando nada mudou."""
+    cadastros = cache_projetos_marketplace.get('todos')
+    if cadastros is None:
+        versao = cache_projetos_marketplace.versao
+        cadastros = await buscar(db.projetos_marketplace, {}).to_list(None)
+        cache_projetos_marketplace.set('todos', cadastros, versao)
+    # Cópias rasas: as métricas abaixo não podem alterar os cadastros em cache
+    projetos = [dict(projeto) for projeto in cadastros]
     
     # Atualizar métricas de cada projeto
     for projeto in projetos:
@@ -4733,20 +5118,16 @@ async def get_projetos_marketplace(current_user: dict = Depends(get_current_user
             projeto['performance_icone'] = "🚀"
         elif em_producao > 20:
             projeto['performance_icone'] = "🔥"
-        
-        if '_id' in projeto:
-            del projeto['_id']
     
-    return projetos
+    return resposta_com_etag(request, *serializar_com_etag(projetos))
 
 @api_router.post("/gestao/marketplaces/projetos")
 async def create_projeto_marketplace(projeto: ProjetoMarketplace, current_user: dict = Depends(get_current_user)):
     """Cria um novo projeto de marketplace"""
     projeto.created_by = current_user.get('username', '')
     projeto_dict = projeto.model_dump()
-    await db.projetos_marketplace.insert_one(projeto_dict)
-    if '_id' in projeto_dict:
-        del projeto_dict['_id']
+    await inserir(db.projetos_marketplace, projeto_dict)
+    cache_projetos_marketplace.invalidar()
     return projeto_dict
 
 @api_router.put("/gestao/marketplaces/projetos/{projeto_id}")
@@ -4755,6 +5136,7 @@ async def update_projeto_marketplace(projeto_id: str, projeto: ProjetoMarketplac
     projeto_dict = projeto.model_dump()
     projeto_dict['updated_at'] = datetime.now(timezone.utc).isoformat()
     await db.projetos_marketplace.update_one({"id": projeto_id}, {"$set": projeto_dict})
+    cache_projetos_marketplace.invalidar()
     return {"message": "Projeto atualizado com sucesso"}
 
 @api_router.patch("/gestao/marketplaces/projetos/{projeto_id}/horarios")
@@ -4774,6 +5156,7 @@ async def update_horarios_postagem(
             "updated_at": datetime.now(timezone.utc).isoformat()
         }}
     )
+    cache_projetos_marketplace.invalidar()
     return {"message": "Horários atualizados com sucesso", "horarios": horarios}
 
 @api_router.delete("/gestao/marketplaces/projetos/{projeto_id}")
@@ -4784,6 +5167,7 @@ async def delete_projeto_marketplace(projeto_id: str, current_user: dict = Depen
     
     # Deletar o projeto
     await db.projetos_marketplace.delete_one({"id": projeto_id})
+    cache_projetos_marketplace.invalidar()
     
     return {
         "message": "Projeto excluído com sucesso",
@@ -4816,54 +5200,92 @@ async def get_pedidos_marketplace(
     if status_montagem:
         query['status_montagem'] = status_montagem
     
-    pedidos = await db.pedidos_marketplace.find(query).sort("created_at", -1).to_list(None)
+    # atrasado vem gravado (escrita + agendador); dias_atraso é calculado pelo banco
+    pedidos = await db.pedidos_marketplace.aggregate([
+        {"$match": query},
+        {"$sort": {"created_at": -1}},
+        {"$project": {"_id": 0}},
+        {"$addFields": {"dias_atraso": pedidos_atrasados.expressao_dias_atraso(datetime.now(timezone.utc))}}
+    ]).to_list(None)
     
-    for pedido in pedidos:
-        if '_id' in pedido:
-            del pedido['_id']
-        
-        # Verificar atraso
-        if pedido.get('status') not in ['Entregue', 'Cancelado']:
-            prazo = pedido.get('prazo_entrega')
-            if prazo:
-                try:
-                    prazo_dt = None
-                    if isinstance(prazo, str):
-                        # Handle ISO format strings
-                        if prazo.endswith('Z'):
-                            prazo_dt = datetime.fromisoformat(prazo.replace('Z', '+00:00'))
-                        elif '+' in prazo:
-                            prazo_dt = datetime.fromisoformat(prazo)
-                        else:
-                            # Assume UTC if no timezone info
-                            try:
-                                prazo_dt = datetime.fromisoformat(prazo).replace(tzinfo=timezone.utc)
-                            except:
-                                # If parsing fails, skip
-                                pass
-                    elif isinstance(prazo, datetime):
-                        # Ensure timezone awareness
-                        prazo_dt = prazo if prazo.tzinfo else prazo.replace(tzinfo=timezone.utc)
-                    
-                    if prazo_dt and prazo_dt < datetime.now(timezone.utc):
-                        dias_atraso = (datetime.now(timezone.utc) - prazo_dt).days
-                        pedido['atrasado'] = True
-                        pedido['dias_atraso'] = dias_atraso
-                except Exception as e:
-                    # If any parsing fails, skip atraso check for this pedido
-                    print(f"Error parsing prazo_entrega: {e}")
-                    pass
+    return RespostaJSON(pedidos)
+
+@api_router.get("/gestao/marketplaces/pedidos/busca")
+async def buscar_pedidos_marketplace(
+    projeto_id: Optional[str] = None,
+    busca: Optional[str] = None,
+    numero_pedido: Optional[str] = None,
+    sku: Optional[str] = None,
+    cliente_nome: Optional[str] = None,
+    campo_data: str = "created_at",
+    data_inicio: Optional[str] = None,
+    data_fim: Optional[str] = None,
+    status: Optional[str] = None,
+    atrasado: Optional[bool] = None,
+    status_producao: Optional[str] = None,
+    status_logistica: Optional[str] = None,
+    status_montagem: Optional[str] = None,
+    ordenar: str = "created_at",
+    direcao: str = "desc",
+    cursor: Optional[str] = None,
+    limite: int = Query(50, ge=1, le=busca_pedidos.LIMITE_MAXIMO),
+    facetas: bool = True,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Busca paginada de pedidos de marketplace, filtrada e ordenada no banco.
+    Retorna {pedidos, proximo_cursor}; a primeira página (sem cursor) traz também
+    as facetas de status_producao/status_logistica/status_montagem e o total,
+    exceto com facetas=false (telas que só querem os pedidos, como o polling).
+    data_fim só com a data (AAAA-MM-DD) inclui o dia inteiro.
+    """
+    inicio, fim = para_datetime(data_inicio), para_datetime(data_fim)
+    if not isinstance(inicio, (datetime, type(None))) or not isinstance(fim, (datetime, type(None))):
+        raise HTTPException(status_code=400, detail="data_inicio/data_fim devem estar no formato ISO")
+    if fim is not None and len(data_fim) == 10:
+        fim += timedelta(days=1)
+    selecionadas = {
+        "status_producao": status_producao,
+        "status_logistica": status_logistica,
+        "status_montagem": status_montagem,
+    }
     
-    return pedidos
+    try:
+        filtro = busca_pedidos.filtro_busca(
+            projeto_id=projeto_id, busca=busca, numero_pedido=numero_pedido, sku=sku,
+            cliente_nome=cliente_nome, campo_data=campo_data, data_inicio=inicio, data_fim=fim,
+            status=status, atrasado=atrasado
+        )
+        pagina = busca_pedidos.pipeline_pagina(filtro, selecionadas, ordenar, direcao, cursor, limite)
+    except busca_pedidos.BuscaInvalida as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    consultas = [db.pedidos_marketplace.aggregate(pagina).to_list(None)]
+    if facetas and not cursor:
+        consultas.append(db.pedidos_marketplace.aggregate(busca_pedidos.pipeline_facetas(filtro, selecionadas)).to_list(None))
+    resultados = await asyncio.gather(*consultas)
+    
+    contagens = resultados[1][0] if len(resultados) > 1 else None
+    return RespostaJSON(busca_pedidos.montar_resposta(resultados[0], limite, ordenar, contagens))
+
+# Datas do pedido de marketplace gravadas como datetime BSON (filtros, ordenação e cursor da busca)
+CAMPOS_DATA_PEDIDO_MARKETPLACE = ('prazo_entrega', 'data_prevista_envio', 'created_at', 'updated_at')
+
+def preparar_pedido_marketplace(pedido: dict, agora: Optional[datetime] = None) -> dict:
+    """Grava as datas do pedido como datetime BSON e calcula a flag atrasado"""
+    for campo in CAMPOS_DATA_PEDIDO_MARKETPLACE:
+        if pedido.get(campo):
+            pedido[campo] = para_datetime(pedido[campo])
+    pedido['atrasado'] = pedidos_atrasados.esta_atrasado(pedido, agora)
+    return pedido
 
 @api_router.post("/gestao/marketplaces/pedidos")
 async def create_pedido_marketplace(pedido: PedidoMarketplace, current_user: dict = Depends(get_current_user)):
     """Cria um novo pedido de marketplace"""
     pedido.created_by = current_user.get('username', '')
-    pedido_dict = pedido.model_dump()
-    await db.pedidos_marketplace.insert_one(pedido_dict)
-    if '_id' in pedido_dict:
-        del pedido_dict['_id']
+    pedido_dict = preparar_pedido_marketplace(pedido.model_dump())
+    await inserir(db.pedidos_marketplace, pedido_dict)
+    pedidos_atrasados.reagendar()
     return pedido_dict
 
 @api_router.post("/gestao/marketplaces/pedidos/bulk")
@@ -4883,11 +5305,12 @@ async def create_pedidos_bulk(pedidos: list[PedidoMarketplace], current_user: di
             # Calcular valor líquido
             pedido.valor_liquido = pedido.preco_acordado - pedido.valor_taxa_comissao - pedido.valor_taxa_servico
         
-        pedido_dict = pedido.model_dump()
+        pedido_dict = preparar_pedido_marketplace(pedido.model_dump())
         pedidos_dict.append(pedido_dict)
     
     if pedidos_dict:
-        await db.pedidos_marketplace.insert_many(pedidos_dict)
+        await db.pedidos_marketplace.insert_many([dict(pedido) for pedido in pedidos_dict])
+        pedidos_atrasados.reagendar()
     
     return {"message": f"{len(pedidos_dict)} pedidos criados com sucesso", "pedidos": pedidos_dict}
 
@@ -5513,7 +5936,10 @@ async def upload_planilha_pedidos(
         
         # Inserir no banco
         if pedidos_criados:
+            for pedido_criado in pedidos_criados:
+                preparar_pedido_marketplace(pedido_criado)
             await db.pedidos_marketplace.insert_many(pedidos_criados)
+            pedidos_atrasados.reagendar()
         
         # Criar mensagem detalhada
         mensagem = f"{len(pedidos_criados)} pedidos importados com sucesso"
@@ -5539,51 +5965,174 @@ async def upload_planilha_pedidos(
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Erro ao processar planilha: {str(e)}")
 
+# Status do pedido de marketplace -> data carimbada na primeira vez que o pedido chega nele
+DATAS_STATUS_MARKETPLACE = {
+    "Em Produção": 'data_producao',
+    "Pronto": 'data_pronto',
+    "Embalagem": 'data_embalagem',
+    "Enviado": 'data_envio',
+    "Entregue": 'data_entrega',
+}
+
+def carimbar_data_status_marketplace(status: str, pedido_atual: dict) -> dict:
+    """Data a gravar quando o pedido entra em `status`, se ainda não estiver preenchida"""
+    campo = DATAS_STATUS_MARKETPLACE.get(status)
+    if campo and not pedido_atual.get(campo):
+        return {campo: datetime.now(timezone.utc)}
+    return {}
+
+# Campos do pedido lidos para montar o lançamento de venda
+CAMPOS_VENDA_MARKETPLACE = (
+    'id', 'projeto_id', 'plataforma', 'numero_pedido', 'sku', 'produto_nome', 'quantidade',
+    'preco_acordado', 'valor_taxa_comissao', 'valor_taxa_servico', 'valor_liquido'
+)
+
+def montar_venda_marketplace(pedido: dict, agora: Optional[datetime] = None) -> dict:
+    """Lançamento de venda do pedido enviado (vendas_marketplace)"""
+    agora = (agora or datetime.now(timezone.utc)).isoformat()
+    return {
+        "id": str(uuid.uuid4()),
+        "origem": "marketplace",
+        "origem_id": pedido.get('id'),
+        "projeto_marketplace": pedido.get('projeto_id'),
+        "plataforma": pedido.get('plataforma'),
+        "numero_pedido": pedido.get('numero_pedido'),
+        "sku": pedido.get('sku'),
+        "produto_nome": pedido.get('produto_nome'),
+        "quantidade": pedido.get('quantidade', 1),
+        "valor_bruto": pedido.get('preco_acordado', 0) * pedido.get('quantidade', 1),
+        "taxa_comissao": pedido.get('valor_taxa_comissao', 0),
+        "taxa_servico": pedido.get('valor_taxa_servico', 0),
+        "valor_liquido": pedido.get('valor_liquido', 0),
+        "data_venda": agora,
+        "data_envio": agora,
+        "status": "enviado",
+        "created_at": agora
+    }
+
+async def inserir_vendas_marketplace(vendas: List[dict]) -> int:
+    """Grava as vendas; as de pedidos que já têm venda (índice único em origem_id) são ignoradas"""
+    try:
+        resultado = await db.vendas_marketplace.insert_many(vendas, ordered=False)
+        return len(resultado.inserted_ids)
+    except BulkWriteError as e:
+        if any(erro['code'] != 11000 for erro in e.details['writeErrors']):
+            raise
+        return e.details['nInserted']
+
+async def registrar_venda_marketplace(pedido_id: str):
+    """Cria o lançamento de venda no sistema principal quando o pedido é enviado"""
+    pedido_completo = await db.pedidos_marketplace.find_one({"id": pedido_id})
+    if pedido_completo and pedido_completo.get('preco_acordado'):
+        await inserir_vendas_marketplace([montar_venda_marketplace(pedido_completo)])
+
 @api_router.put("/gestao/marketplaces/pedidos/{pedido_id}")
 async def update_pedido_marketplace(pedido_id: str, pedido: PedidoMarketplace, current_user: dict = Depends(get_current_user)):
     """Atualiza um pedido de marketplace"""
-    pedido_dict = pedido.model_dump()
-    pedido_dict['updated_at'] = datetime.now(timezone.utc).isoformat()
+    pedido_dict = preparar_pedido_marketplace(pedido.model_dump())
+    pedido_dict['updated_at'] = datetime.now(timezone.utc)
     
     # Atualizar datas conforme status
-    if pedido.status == "Em Produção" and not pedido_dict.get('data_producao'):
-        pedido_dict['data_producao'] = datetime.now(timezone.utc).isoformat()
-    elif pedido.status == "Pronto" and not pedido_dict.get('data_pronto'):
-        pedido_dict['data_pronto'] = datetime.now(timezone.utc).isoformat()
-    elif pedido.status == "Embalagem" and not pedido_dict.get('data_embalagem'):
-        pedido_dict['data_embalagem'] = datetime.now(timezone.utc).isoformat()
-    elif pedido.status == "Enviado" and not pedido_dict.get('data_envio'):
-        pedido_dict['data_envio'] = datetime.now(timezone.utc).isoformat()
-        
-        # Criar lançamento de venda no sistema principal
-        pedido_completo = await db.pedidos_marketplace.find_one({"id": pedido_id})
-        if pedido_completo and pedido_completo.get('preco_acordado'):
-            venda_data = {
-                "id": str(uuid.uuid4()),
-                "origem": "marketplace",
-                "origem_id": pedido_id,
-                "projeto_marketplace": pedido_completo.get('projeto_id'),
-                "plataforma": pedido_completo.get('plataforma'),
-                "numero_pedido": pedido_completo.get('numero_pedido'),
-                "sku": pedido_completo.get('sku'),
-                "produto_nome": pedido_completo.get('produto_nome'),
-                "quantidade": pedido_completo.get('quantidade', 1),
-                "valor_bruto": pedido_completo.get('preco_acordado', 0) * pedido_completo.get('quantidade', 1),
-                "taxa_comissao": pedido_completo.get('valor_taxa_comissao', 0),
-                "taxa_servico": pedido_completo.get('valor_taxa_servico', 0),
-                "valor_liquido": pedido_completo.get('valor_liquido', 0),
-                "data_venda": datetime.now(timezone.utc).isoformat(),
-                "data_envio": datetime.now(timezone.utc).isoformat(),
-                "status": "enviado",
-                "created_at": datetime.now(timezone.utc).isoformat()
-            }
-            await db.vendas_marketplace.insert_one(venda_data)
-    elif pedido.status == "Entregue" and not pedido_dict.get('data_entrega'):
-        pedido_dict['data_entrega'] = datetime.now(timezone.utc).isoformat()
+    datas = carimbar_data_status_marketplace(pedido.status, pedido_dict)
+    pedido_dict.update(datas)
     
-    await db.pedidos_marketplace.update_one({"id": pedido_id}, {"$set": pedido_dict})
+    resultado = await db.pedidos_marketplace.update_one(
+        filtro_versao_put(pedido_id, pedido.version), {"$set": pedido_dict, "$inc": {"version": 1}}
+    )
+    if resultado.matched_count == 0:
+        await recusar_put_sem_match(db.pedidos_marketplace, pedido_id)
+    if 'data_envio' in datas:
+        await registrar_venda_marketplace(pedido_id)
+    pedidos_atrasados.reagendar()
     return {"message": "Pedido atualizado com sucesso"}
 
+@api_router.patch("/gestao/marketplaces/pedidos/{pedido_id}")
+async def patch_pedido_marketplace(pedido_id: str, dados: dict, current_user: dict = Depends(get_current_user)):
+    """Atualização parcial de um pedido de marketplace.
+    Recebe apenas os campos alterados e a `version` lida; retorna só o que mudou
+    (incluindo a data carimbada pela mudança de status)."""
+    versao = dados.pop('version', None)
+    # atrasado/dias_atraso são calculados pelo servidor a partir de status e prazo_entrega
+    campos = validar_campos_patch(PedidoMarketplace, dados, protegidos={'atrasado', 'dias_atraso'})
+    
+    def datas_do_status(anterior, alteracoes):
+        extras = {'updated_at': datetime.now(timezone.utc)}
+        if 'status' in alteracoes:
+            extras.update(carimbar_data_status_marketplace(alteracoes['status'], anterior))
+        if 'status' in alteracoes or 'prazo_entrega' in alteracoes:
+            extras['atrasado'] = pedidos_atrasados.esta_atrasado({**anterior, **alteracoes})
+        return extras
+    
+    _, alteracoes, versao = await aplicar_patch(
+        db.pedidos_marketplace, pedido_id, campos, versao,
+        extras=datas_do_status, campos_leitura=(*DATAS_STATUS_MARKETPLACE.values(), 'status', 'prazo_entrega')
+    )
+    if 'prazo_entrega' in alteracoes or 'status' in alteracoes:
+        pedidos_atrasados.reagendar()
+    if alteracoes.get('status') == "Enviado" and 'data_envio' in alteracoes:
+        await registrar_venda_marketplace(pedido_id)
+    
+    return {"id": pedido_id, "version": versao, **alteracoes}
+
+class TransicaoPedidosMarketplace(BaseModel):
+    """Mudança de status/setor de um lote de pedidos de marketplace"""
+    pedido_ids: List[str] = Field(min_length=1, max_length=1000)
+    status: Optional[str] = None
+    status_producao: Optional[str] = None  # Setor
+    status_logistica: Optional[str] = None
+    status_montagem: Optional[str] = None
+
+@api_router.post("/gestao/marketplaces/pedidos/transicao")
+async def transicionar_pedidos_marketplace(transicao: TransicaoPedidosMarketplace, current_user: dict = Depends(get_current_user)):
+    """Move um lote de pedidos para um status/setor em poucas escritas.
+    Um update_many carimba a data do status só nos pedidos que ainda não a têm, outro
+    aplica a mudança (e incrementa a version de cada pedido), e as vendas dos pedidos
+    que este lote carimbou como enviados são gravadas com um único insert_many."""
+    alteracoes = transicao.model_dump(exclude={'pedido_ids'}, exclude_none=True)
+    if not alteracoes:
+        raise HTTPException(status_code=400, detail="Informe o status ou setor de destino")
+    
+    agora = datetime.now(timezone.utc)
+    # O BSON guarda milissegundos: o carimbo lido de volta precisa ser igual ao gravado
+    agora = agora.replace(microsecond=agora.microsecond // 1000 * 1000)
+    filtro = {"id": {"$in": list(dict.fromkeys(transicao.pedido_ids))}}
+    campo_data = DATAS_STATUS_MARKETPLACE.get(transicao.status)
+    
+    carimbados = 0
+    if campo_data:
+        resultado = await db.pedidos_marketplace.update_many(
+            {**filtro, campo_data: {"$in": [None, ""]}}, {"$set": {campo_data: agora}, "$inc": {"version": 1}}
+        )
+        carimbados = resultado.modified_count
+    
+    # Vendas só dos pedidos que este lote carimbou como enviados: um lote simultâneo
+    # não carimba os mesmos pedidos (e o índice único em origem_id barra o que escapar)
+    vendas = []
+    if campo_data == 'data_envio' and carimbados:
+        enviados = await buscar(
+            db.pedidos_marketplace, {**filtro, "data_envio": agora, "preco_acordado": {"$nin": [None, 0]}},
+            {campo: 1 for campo in CAMPOS_VENDA_MARKETPLACE}
+        ).to_list(None)
+        vendas = [montar_venda_marketplace(pedido, agora) for pedido in enviados]
+    
+    alteracoes['updated_at'] = agora
+    if transicao.status in pedidos_atrasados.STATUS_FINALIZADOS:
+        alteracoes['atrasado'] = False
+    resultado = await db.pedidos_marketplace.update_many(filtro, {"$set": alteracoes, "$inc": {"version": 1}})
+    
+    vendas_registradas = await inserir_vendas_marketplace(vendas) if vendas else 0
+    if transicao.status:
+        # Pedido reaberto com prazo vencido volta a ser marcado pelo agendador
+        pedidos_atrasados.reagendar()
+    
+    return {
+        "message": f"{resultado.matched_count} pedidos atualizados com sucesso",
+        "atualizados": resultado.matched_count,
+        "nao_encontrados": len(filtro['id']['$in']) - resultado.matched_count,
+        "datas_carimbadas": carimbados,
+        "vendas_registradas": vendas_registradas
+    }
+
 @api_router.delete("/gestao/marketplaces/pedidos/{pedido_id}")
 async def delete_pedido_marketplace(pedido_id: str, current_user: dict = Depends(get_current_user)):
     """Deleta um pedido de marketplace"""
@@ -6091,10 +6640,7 @@ async def get_mensagem_do_dia(current_user: dict = Depends(get_current_user)):
             "created_by": "sistema",
             "created_at": datetime.now(timezone.utc).isoformat()
         }
-        await db.mensagens_do_dia.insert_one(mensagem)
-    
-    if '_id' in mensagem:
-        del mensagem['_id']
+        await inserir(db.mensagens_do_dia, mensagem)
     
     return mensagem
 
@@ -6127,10 +6673,10 @@ async def create_mensagem_do_dia(mensagem: MensagemDoDia, current_user: dict = D
         mensagem_dict['id'] = mensagem_existente['id']
     else:
         # Criar nova mensagem
-        await db.mensagens_do_dia.insert_one(mensagem_dict)
+        await inserir(db.mensagens_do_dia, mensagem_dict)
     
-    if '_id' in mensagem_dict:
-        del mensagem_dict['_id']
+    # Os terminais veem a nova mensagem já na próxima leitura, sem esperar o TTL
+    cache_respostas.invalidar("/api/gestao/marketplaces/mensagem-do-dia")
     
     return mensagem_dict
 
@@ -6211,44 +6757,48 @@ class RelatorioProgresso(BaseModel):
     tarefas_concluidas: List[str] = []  # IDs das tarefas concluídas no dia
     total_pontos_dia: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+# Status padrão, criados na inicialização para os tipos que ainda não têm nenhum status
+STATUS_CUSTOMIZADOS_PADRAO = {
+    "geral": [
+        {"label": "Aguardando Produção", "valor": "aguardando_producao", "cor": "#94A3B8"},
+        {"label": "Em Produção", "valor": "em_producao", "cor": "#F59E0B"},
+        {"label": "Pronto", "valor": "pronto", "cor": "#8B5CF6"},
+        {"label": "Embalagem", "valor": "embalagem", "cor": "#FBBF24"},
+        {"label": "Enviado", "valor": "enviado", "cor": "#3B82F6"},
+        {"label": "Entregue", "valor": "entregue", "cor": "#10B981"}
+    ],
+    "impressao": [
+        {"label": "Aguardando Impressão", "valor": "aguardando_impressao", "cor": "#94A3B8"},
+        {"label": "Imprimindo", "valor": "imprimindo", "cor": "#F59E0B"},
+        {"label": "Impresso", "valor": "impresso", "cor": "#10B981"}
+    ]
+}
+
+async def semear_status_customizados():
+    """Cria os status padrão dos tipos sem nenhum status. Upsert por (tipo, valor),
+    para que vários workers iniciando juntos não dupliquem os registros."""
+    for tipo, padroes in STATUS_CUSTOMIZADOS_PADRAO.items():
+        if await db.status_customizados.count_documents({"tipo": tipo}, limit=1):
+            continue
+        for ordem, padrao in enumerate(padroes):
+            await db.status_customizados.update_one(
+                {"tipo": tipo, "valor": padrao['valor']},
+                {"$setOnInsert": {"id": str(uuid.uuid4()), "tipo": tipo, **padrao, "ordem": ordem, "ativo": True}},
+                upsert=True
+            )
+        print(f"✅ Status padrão '{tipo}' criados")
+    cache_status_customizados.invalidar()
+
 @api_router.get("/gestao/marketplaces/status")
-async def get_status_customizados(tipo: str = None, current_user: dict = Depends(get_current_user)):
-    """Retorna lista de status customizados"""
+async def get_status_customizados(request: Request, tipo: str = None, current_user: dict = Depends(get_current_user)):
+    """Retorna lista de status customizados (cache de referência com ETag)"""
     query = {}
     if tipo:
         query['tipo'] = tipo
     
-    status_list = await db.status_customizados.find(query).sort("ordem", 1).to_list(None)
-    
-    # Remover _id do MongoDB
-    for status in status_list:
-        if '_id' in status:
-            del status['_id']
-    
-    # Se não houver status, retornar padrões
-    if not status_list:
-        status_padrao = []
-        if not tipo or tipo == "geral":
-            status_padrao.extend([
-                {"id": str(uuid.uuid4()), "tipo": "geral", "label": "Aguardando Produção", "valor": "aguardando_producao", "cor": "#94A3B8", "ordem": 0, "ativo": True},
-                {"id": str(uuid.uuid4()), "tipo": "geral", "label": "Em Produção", "valor": "em_producao", "cor": "#F59E0B", "ordem": 1, "ativo": True},
-                {"id": str(uuid.uuid4()), "tipo": "geral", "label": "Pronto", "valor": "pronto", "cor": "#8B5CF6", "ordem": 2, "ativo": True},
-                {"id": str(uuid.uuid4()), "tipo": "geral", "label": "Embalagem", "valor": "embalagem", "cor": "#FBBF24", "ordem": 3, "ativo": True},
-                {"id": str(uuid.uuid4()), "tipo": "geral", "label": "Enviado", "valor": "enviado", "cor": "#3B82F6", "ordem": 4, "ativo": True},
-                {"id": str(uuid.uuid4()), "tipo": "geral", "label": "Entregue", "valor": "entregue", "cor": "#10B981", "ordem": 5, "ativo": True}
-            ])
-        if not tipo or tipo == "impressao":
-            status_padrao.extend([
-                {"id": str(uuid.uuid4()), "tipo": "impressao", "label": "Aguardando Impressão", "valor": "aguardando_impressao", "cor": "#94A3B8", "ordem": 0, "ativo": True},
-                {"id": str(uuid.uuid4()), "tipo": "impressao", "label": "Imprimindo", "valor": "imprimindo", "cor": "#F59E0B", "ordem": 1, "ativo": True},
-                {"id": str(uuid.uuid4()), "tipo": "impressao", "label": "Impresso", "valor": "impresso", "cor": "#10B981", "ordem": 2, "ativo": True}
-            ])
-        # Inserir status padrão no banco
-        if status_padrao:
-            await db.status_customizados.insert_many(status_padrao)
-        return status_padrao
-    
-    return status_list
+    async def carregar():
+        return await buscar(db.status_customizados, query).sort("ordem", 1).to_list(None)
+    return await responder_referencia(request, cache_status_customizados, tipo, carregar)
 
 @api_router.post("/gestao/marketplaces/status")
 async def create_status_customizado(status: StatusCustomizado, current_user: dict = Depends(get_current_user)):
@@ -6257,10 +6807,8 @@ async def create_status_customizado(status: StatusCustomizado, current_user: dic
         raise HTTPException(status_code=403, detail="Apenas Director ou Manager podem criar status")
     
     status_dict = status.model_dump()
-    await db.status_customizados.insert_one(status_dict)
-    
-    if '_id' in status_dict:
-        del status_dict['_id']
+    await inserir(db.status_customizados, status_dict)
+    cache_status_customizados.invalidar()
     
     return status_dict
 
@@ -6277,9 +6825,7 @@ async def update_status_customizado(status_id: str, status: StatusCustomizado, c
         {"id": status_id},
         {"$set": status_dict}
     )
-    
-    if '_id' in status_dict:
-        del status_dict['_id']
+    cache_status_customizados.invalidar()
     
     return status_dict
 
@@ -6290,6 +6836,7 @@ async def delete_status_customizado(status_id: str, current_user: dict = Depends
         raise HTTPException(status_code=403, detail="Apenas Director ou Manager podem deletar status")
     
     await db.status_customizados.delete_one({"id": status_id})
+    cache_status_customizados.invalidar()
     return {"message": "Status deletado com sucesso"}
 
 # DASHBOARD MARKETPLACES
@@ -6641,6 +7188,7 @@ async def ml_import_to_system(
                     pedido_sistema['quantidade'] = total_qty
                 
                 # Inserir no sistema
+                preparar_pedido_marketplace(pedido_sistema)
                 await db.pedidos_marketplace.insert_one(pedido_sistema)
                 
                 # Marcar como importado (usar o ObjectId original)
@@ -6759,13 +7307,13 @@ async def create_pedido_loja(pedido_data: dict, credentials: HTTPAuthorizationCr
             "data_inicio_producao": None,
             "data_finalizacao": None,
             "data_entrega": None,
-            "prazo_entrega": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
+            "prazo_entrega": datetime.now(timezone.utc) + timedelta(days=7),
             "fotos": pedido_data.get('fotos', []),
             "observacoes": pedido_data.get('observacoes', ''),
             "prioridade": pedido_data.get('prioridade', 'Normal'),
             "atrasado": pedido_data.get('atrasado', False),
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "created_at": datetime.now(timezone.utc),
+            "updated_at": datetime.now(timezone.utc),
             "created_by": user['username']
         }
         
@@ -6806,7 +7354,7 @@ async def get_pedidos_loja(
         if status:
             query['status'] = status
         
-        pedidos = await db.pedidos_lojas.find(query, {"_id": 0}).sort('created_at', -1).to_list(length=1000)
+        pedidos = await buscar(db.pedidos_lojas, query).sort('created_at', -1).to_list(length=1000)
         
         return {"success": True, "pedidos": pedidos}
     except Exception as e:
@@ -6823,7 +7371,8 @@ async def update_pedido_loja(
     try:
         user = decode_token(credentials.credentials)
         
-        pedido['updated_at'] = datetime.now(timezone.utc).isoformat()
+        pedido['updated_at'] = datetime.now(timezone.utc)
+        normalizar_datas(pedido)
         
         result = await db.pedidos_lojas.update_one(
             {'id': pedido_id},
@@ -6869,14 +7418,9 @@ async def delete_pedido_loja(
 async def get_membros_marketing(current_user: dict = Depends(get_current_user)):
     """Lista todos os membros da equipe de marketing"""
     try:
-        membros = await db.membros_marketing.find().to_list(None)
-        
-        # Remover _id do MongoDB
-        for membro in membros:
-            if '_id' in membro:
-                del membro['_id']
+        membros = await buscar(db.membros_marketing).to_list(None)
         
-        return membros
+        return RespostaJSON(membros)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -6889,11 +7433,10 @@ async def criar_membro_marketing(membro: MembroMarketing, current_user: dict = D
         membro_data = membro.model_dump()
         membro_data['updated_at'] = datetime.now(timezone.utc).isoformat()
         membro_data['created_at'] = datetime.now(timezone.utc).isoformat()
+        # O placar começa zerado e só muda pelos incrementos das tarefas/relatórios
+        membro_data.update({campo: 0 for campo in placar_marketing.CAMPOS_PLACAR})
         
-        await db.membros_marketing.insert_one(membro_data)
-        
-        if '_id' in membro_data:
-            del membro_data['_id']
+        await inserir(db.membros_marketing, membro_data)
         
         return membro_data
     
@@ -6917,6 +7460,8 @@ async def atualizar_membro_marketing(
             del membro_data['id']
         if 'created_at' in membro_data:
             del membro_data['created_at']
+        for campo in placar_marketing.CAMPOS_PLACAR:
+            membro_data.pop(campo, None)
         
         resultado = await db.membros_marketing.update_one(
             {"id": membro_id},
@@ -6962,26 +7507,21 @@ async def deletar_membro_marketing(membro_id: str, current_user: dict = Depends(
 
 # ========== TAREFAS MARKETING ==========
 
-async def atualizar_status_tarefas_atrasadas():
-    """Função auxiliar para atualizar status de tarefas atrasadas"""
-    agora = datetime.now(timezone.utc)
-    
-    # Atualizar tarefas que passaram do prazo e não estão concluídas
-    await db.tarefas_marketing.update_many(
-        {
-            "data_hora": {"$lt": agora.isoformat()},
-            "status": {"$in": ["A Fazer", "Em Andamento"]}
-        },
-        {"$set": {"status": "Atrasado"}}
-    )
+# Datas das tarefas gravadas como datetime BSON (consultas por faixa usam os índices)
+CAMPOS_DATA_TAREFA = ('data_hora', 'concluida_em', 'created_at', 'updated_at')
 
+# O status "Atrasado" é gravado em segundo plano pelo agendador (tarefas_atrasadas.py);
+# as rotas de leitura não escrevem no banco.
 
 async def contar_tarefas_atrasadas(membro_id: str) -> int:
-    """Conta quantas tarefas atrasadas um membro possui"""
-    await atualizar_status_tarefas_atrasadas()
+    """Conta quantas tarefas atrasadas um membro possui
+    (inclui as que venceram e o agendador ainda não marcou)"""
     count = await db.tarefas_marketing.count_documents({
         "membro_id": membro_id,
-        "status": "Atrasado"
+        "$or": [
+            {"status": "Atrasado"},
+            tarefas_atrasadas.filtro_vencidas(datetime.now(timezone.utc))
+        ]
     })
     return count
 
@@ -6991,8 +7531,9 @@ async def calcular_pontos_tarefa(tarefa: dict) -> int:
     if tarefa['status'] != 'Concluído':
         return 0
     
-    data_conclusao = datetime.fromisoformat(tarefa['concluida_em'].replace('Z', '+00:00')) if isinstance(tarefa['concluida_em'], str) else tarefa['concluida_em']
-    data_prevista = datetime.fromisoformat(tarefa['data_hora'].replace('Z', '+00:00')) if isinstance(tarefa['data_hora'], str) else tarefa['data_hora']
+    # Datas já são datetime (normalizadas ao gravar); para_datetime cobre tarefas antigas em string
+    data_conclusao = para_datetime(tarefa['concluida_em'])
+    data_prevista = para_datetime(tarefa['data_hora'])
     
     # Calcular diferença em dias
     diferenca = (data_conclusao - data_prevista).days
@@ -7008,59 +7549,6 @@ async def calcular_pontos_tarefa(tarefa: dict) -> int:
         return -5
 
 
-async def atualizar_estatisticas_membro(membro_id: str):
-    """Atualiza as estatísticas de um membro (tarefas concluídas, atrasadas, pontuação)"""
-    try:
-        # Atualizar status de tarefas atrasadas primeiro
-        await atualizar_status_tarefas_atrasadas()
-        
-        # Contar tarefas por status
-        tarefas_concluidas = await db.tarefas_marketing.count_documents({
-            "membro_id": membro_id,
-            "status": "Concluído"
-        })
-        
-        tarefas_atrasadas = await db.tarefas_marketing.count_documents({
-            "membro_id": membro_id,
-            "status": "Atrasado"
-        })
-        
-        tarefas_em_andamento = await db.tarefas_marketing.count_documents({
-            "membro_id": membro_id,
-            "status": "Em Andamento"
-        })
-        
-        # Calcular pontuação total
-        todas_tarefas = await db.tarefas_marketing.find({"membro_id": membro_id}).to_list(None)
-        pontuacao_total = 0
-        
-        for tarefa in todas_tarefas:
-            if tarefa.get('pontos_ganhos'):
-                pontuacao_total += tarefa['pontos_ganhos']
-        
-        # Adicionar pontos dos relatórios
-        relatorios = await db.relatorios_progresso.find({"membro_id": membro_id}).to_list(None)
-        for relatorio in relatorios:
-            pontuacao_total += relatorio.get('total_pontos_dia', 0)
-        
-        # Atualizar membro
-        await db.membros_marketing.update_one(
-            {"id": membro_id},
-            {
-                "$set": {
-                    "tarefas_concluidas": tarefas_concluidas,
-                    "tarefas_atrasadas": tarefas_atrasadas,
-                    "tarefas_em_andamento": tarefas_em_andamento,
-                    "pontuacao": pontuacao_total,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
-                }
-            }
-        )
-        
-    except Exception as e:
-        print(f"Erro ao atualizar estatísticas do membro: {e}")
-
-
 @api_router.get("/gestao/marketing/tarefas")
 async def get_tarefas_marketing(
     membro_id: Optional[str] = None,
@@ -7071,9 +7559,6 @@ async def get_tarefas_marketing(
 ):
     """Lista tarefas com filtros opcionais"""
     try:
-        # Atualizar status de tarefas atrasadas
-        await atualizar_status_tarefas_atrasadas()
-        
         query = {}
         
         if membro_id:
@@ -7084,18 +7569,13 @@ async def get_tarefas_marketing(
         
         if data_inicio and data_fim:
             query['data_hora'] = {
-                "$gte": data_inicio,
-                "$lte": data_fim
+                "$gte": para_datetime(data_inicio),
+                "$lte": para_datetime(data_fim)
             }
         
-        tarefas = await db.tarefas_marketing.find(query).sort("data_hora", 1).to_list(None)
-        
-        # Remover _id do MongoDB
-        for tarefa in tarefas:
-            if '_id' in tarefa:
-                del tarefa['_id']
+        tarefas = await buscar(db.tarefas_marketing, query).sort("data_hora", 1).to_list(None)
         
-        return tarefas
+        return RespostaJSON(tarefas)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -7121,20 +7601,15 @@ async def criar_tarefa_marketing(tarefa: TarefaMarketing, current_user: dict = D
         
         tarefa_data = tarefa.model_dump()
         tarefa_data['membro_nome'] = membro['nome']
-        tarefa_data['updated_at'] = datetime.now(timezone.utc).isoformat()
-        tarefa_data['created_at'] = datetime.now(timezone.utc).isoformat()
-        
-        # Converter datetime para ISO string
-        if isinstance(tarefa_data['data_hora'], datetime):
-            tarefa_data['data_hora'] = tarefa_data['data_hora'].isoformat()
-        
-        await db.tarefas_marketing.insert_one(tarefa_data)
+        tarefa_data['updated_at'] = datetime.now(timezone.utc)
+        tarefa_data['created_at'] = datetime.now(timezone.utc)
+        normalizar_datas(tarefa_data, CAMPOS_DATA_TAREFA)
         
-        # Atualizar estatísticas do membro
-        await atualizar_estatisticas_membro(tarefa.membro_id)
+        await inserir(db.tarefas_marketing, tarefa_data)
+        tarefas_atrasadas.reagendar()
         
-        if '_id' in tarefa_data:
-            del tarefa_data['_id']
+        # Atualizar o placar do membro
+        await placar_marketing.registrar_transicao_tarefa(db, None, tarefa_data)
         
         return tarefa_data
     
@@ -7157,15 +7632,12 @@ async def atualizar_tarefa_marketing(
             raise HTTPException(status_code=404, detail="Tarefa não encontrada")
         
         tarefa_data = tarefa.model_dump()
-        tarefa_data['updated_at'] = datetime.now(timezone.utc).isoformat()
-        
-        # Converter datetime para ISO string
-        if isinstance(tarefa_data['data_hora'], datetime):
-            tarefa_data['data_hora'] = tarefa_data['data_hora'].isoformat()
+        tarefa_data['updated_at'] = datetime.now(timezone.utc)
+        normalizar_datas(tarefa_data, CAMPOS_DATA_TAREFA)
         
         # Se mudou para Concluído, registrar data de conclusão e calcular pontos
         if tarefa.status == "Concluído" and tarefa_antiga['status'] != "Concluído":
-            tarefa_data['concluida_em'] = datetime.now(timezone.utc).isoformat()
+            tarefa_data['concluida_em'] = datetime.now(timezone.utc)
             
             # Calcular pontos
             pontos = await calcular_pontos_tarefa(tarefa_data)
@@ -7177,16 +7649,19 @@ async def atualizar_tarefa_marketing(
         if 'created_at' in tarefa_data:
             del tarefa_data['created_at']
         
-        resultado = await db.tarefas_marketing.update_one(
+        # Documento anterior devolvido pelo próprio update: base do incremento do placar
+        anterior = await db.tarefas_marketing.find_one_and_update(
             {"id": tarefa_id},
-            {"$set": tarefa_data}
+            {"$set": tarefa_data},
+            projection={"_id": 0, "membro_id": 1, "status": 1, "pontos_ganhos": 1}
         )
         
-        if resultado.modified_count == 0 and resultado.matched_count == 0:
+        if anterior is None:
             raise HTTPException(status_code=404, detail="Tarefa não encontrada")
+        tarefas_atrasadas.reagendar()
         
-        # Atualizar estatísticas do membro
-        await atualizar_estatisticas_membro(tarefa.membro_id)
+        # Atualizar o placar do membro (ou dos dois membros, se a tarefa foi reatribuída)
+        await placar_marketing.registrar_transicao_tarefa(db, anterior, {**anterior, **tarefa_data})
         
         return {"success": True, "message": "Tarefa atualizada com sucesso"}
     
@@ -7200,19 +7675,15 @@ async def atualizar_tarefa_marketing(
 async def deletar_tarefa_marketing(tarefa_id: str, current_user: dict = Depends(get_current_user)):
     """Deleta uma tarefa"""
     try:
-        tarefa = await db.tarefas_marketing.find_one({"id": tarefa_id})
+        tarefa = await db.tarefas_marketing.find_one_and_delete(
+            {"id": tarefa_id},
+            projection={"_id": 0, "membro_id": 1, "status": 1, "pontos_ganhos": 1}
+        )
         if not tarefa:
             raise HTTPException(status_code=404, detail="Tarefa não encontrada")
         
-        membro_id = tarefa['membro_id']
-        
-        resultado = await db.tarefas_marketing.delete_one({"id": tarefa_id})
-        
-        if resultado.deleted_count == 0:
-            raise HTTPException(status_code=404, detail="Tarefa não encontrada")
-        
-        # Atualizar estatísticas do membro
-        await atualizar_estatisticas_membro(membro_id)
+        # Atualizar o placar do membro
+        await placar_marketing.registrar_transicao_tarefa(db, tarefa, None)
         
         return {"success": True, "message": "Tarefa deletada com sucesso"}
     
@@ -7233,14 +7704,12 @@ async def adicionar_item_checklist(
     """Adiciona um item ao checklist da tarefa"""
     try:
         item_data = item.model_dump()
-        if isinstance(item_data.get('created_at'), datetime):
-            item_data['created_at'] = item_data['created_at'].isoformat()
         
         resultado = await db.tarefas_marketing.update_one(
             {"id": tarefa_id},
             {
                 "$push": {"checklist": item_data},
-                "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+                "$set": {"updated_at": datetime.now(timezone.utc)}
             }
         )
         
@@ -7269,7 +7738,7 @@ async def atualizar_item_checklist(
             {
                 "$set": {
                     "checklist.$.concluido": concluido,
-                    "updated_at": datetime.now(timezone.utc).isoformat()
+                    "updated_at": datetime.now(timezone.utc)
                 }
             }
         )
@@ -7294,14 +7763,12 @@ async def adicionar_comentario_tarefa(
     """Adiciona um comentário à tarefa"""
     try:
         comentario_data = comentario.model_dump()
-        if isinstance(comentario_data.get('created_at'), datetime):
-            comentario_data['created_at'] = comentario_data['created_at'].isoformat()
         
         resultado = await db.tarefas_marketing.update_one(
             {"id": tarefa_id},
             {
                 "$push": {"comentarios": comentario_data},
-                "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+                "$set": {"updated_at": datetime.now(timezone.utc)}
             }
         )
         
@@ -7338,18 +7805,19 @@ async def criar_relatorio_progresso(
             )
         
         relatorio_data = relatorio.model_dump()
-        relatorio_data['created_at'] = datetime.now(timezone.utc).isoformat()
+        relatorio_data['created_at'] = datetime.now(timezone.utc)
         
         # Dar 3 pontos por enviar relatório
         relatorio_data['total_pontos_dia'] = 3
         
-        await db.relatorios_progresso.insert_one(relatorio_data)
+        await inserir(db.relatorios_progresso, relatorio_data)
         
-        # Atualizar estatísticas do membro
-        await atualizar_estatisticas_membro(relatorio.membro_id)
+        # Atualizar o placar do membro
+        await placar_marketing.registrar_relatorio(db, relatorio_data)
         
-        if '_id' in relatorio_data:
-            del relatorio_data['_id']
+        # O modal confere "relatório já enviado" por esta listagem (e o placar entra no dashboard)
+        cache_respostas.invalidar("/api/gestao/marketing/relatorios")
+        cache_respostas.invalidar("/api/gestao/marketing/dashboard")
         
         return relatorio_data
     
@@ -7379,100 +7847,112 @@ async def get_relatorios_progresso(
                 "$lte": data_fim
             }
         
-        relatorios = await db.relatorios_progresso.find(query).sort("data", -1).to_list(None)
-        
-        # Remover _id do MongoDB
-        for relatorio in relatorios:
-            if '_id' in relatorio:
-                del relatorio['_id']
+        relatorios = await buscar(db.relatorios_progresso, query).sort("data", -1).to_list(None)
         
-        return relatorios
+        return RespostaJSON(relatorios)
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# ========== PLACAR (RECONCILIAÇÃO) ==========
+
+@api_router.get("/gestao/marketing/placar/reconciliacao")
+async def get_reconciliacao_placar(current_user: dict = Depends(get_current_user)):
+    """Resultado da última reconciliação do placar (divergências encontradas)"""
+    return placar_marketing.ultima_reconciliacao or {"executada_em": None, "divergencias": []}
+
+
+@api_router.post("/gestao/marketing/placar/reconciliar")
+async def reconciliar_placar_marketing(corrigir: bool = True, current_user: dict = Depends(get_current_user)):
+    """Recalcula o placar de todos os membros e reporta (e corrige) divergências"""
+    try:
+        return await placar_marketing.reconciliar_placar(db, corrigir=corrigir)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # ========== DASHBOARD E ESTATÍSTICAS ==========
 
+STATUS_TAREFAS_MARKETING = ["A Fazer", "Em Andamento", "Concluído", "Atrasado"]
+
 @api_router.get("/gestao/marketing/dashboard")
 async def get_dashboard_marketing(current_user: dict = Depends(get_current_user)):
-    """Retorna estatísticas e métricas do dashboard"""
+    """Retorna estatísticas e métricas do dashboard
+    (em cache por 10s no cache de respostas, invalidado quando um relatório é enviado)"""
     try:
-        # Atualizar status de tarefas atrasadas
-        await atualizar_status_tarefas_atrasadas()
+        inicio_hoje = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        inicio_30_dias = inicio_hoje - timedelta(days=30)
+        
+        # Uma única agregação: totais por status, concluídas hoje e produtividade por membro em 30 dias
+        resultado = await db.tarefas_marketing.aggregate([
+            {"$facet": {
+                "por_status": [
+                    {"$match": {"status": {"$in": STATUS_TAREFAS_MARKETING}}},
+                    {"$group": {"_id": "$status", "total": {"$sum": 1}}}
+                ],
+                "concluidas_hoje": [
+                    {"$match": {"status": "Concluído", "concluida_em": {"$gte": inicio_hoje, "$lt": inicio_hoje + timedelta(days=1)}}},
+                    {"$count": "total"}
+                ],
+                "por_membro_30d": [
+                    {"$match": {"status": "Concluído", "concluida_em": {"$gte": inicio_30_dias}}},
+                    {"$group": {
+                        "_id": "$membro_id",
+                        "concluidas": {"$sum": 1},
+                        "no_prazo": {"$sum": {"$cond": [{"$gt": ["$pontos_ganhos", 0]}, 1, 0]}}
+                    }}
+                ]
+            }}
+        ]).to_list(1)
+        resultado = resultado[0] if resultado else {}
         
         # Total de tarefas por status
-        total_a_fazer = await db.tarefas_marketing.count_documents({"status": "A Fazer"})
-        total_em_andamento = await db.tarefas_marketing.count_documents({"status": "Em Andamento"})
-        total_concluido = await db.tarefas_marketing.count_documents({"status": "Concluído"})
-        total_atrasado = await db.tarefas_marketing.count_documents({"status": "Atrasado"})
+        distribuicao_status = {status: 0 for status in STATUS_TAREFAS_MARKETING}
+        distribuicao_status.update({grupo['_id']: grupo['total'] for grupo in resultado.get('por_status', [])})
         
         # Tarefas concluídas hoje
-        hoje = datetime.now(timezone.utc).date().isoformat()
-        tarefas_concluidas_hoje = await db.tarefas_marketing.count_documents({
-            "status": "Concluído",
-            "concluida_em": {"$gte": f"{hoje}T00:00:00", "$lte": f"{hoje}T23:59:59"}
-        })
-        
-        # Produtividade por membro (últimos 30 dias)
-        data_30_dias_atras = (datetime.now(timezone.utc) - timedelta(days=30)).date().isoformat()
-        
-        membros = await db.membros_marketing.find({"ativo": True}).to_list(None)
-        produtividade_membros = []
-        
-        for membro in membros:
-            tarefas_concluidas_30d = await db.tarefas_marketing.count_documents({
-                "membro_id": membro['id'],
-                "status": "Concluído",
-                "concluida_em": {"$gte": f"{data_30_dias_atras}T00:00:00"}
-            })
-            
-            produtividade_membros.append({
+        tarefas_concluidas_hoje = resultado['concluidas_hoje'][0]['total'] if resultado.get('concluidas_hoje') else 0
+        
+        # Produtividade por membro (últimos 30 dias), juntando com a lista de membros ativos
+        por_membro = {grupo['_id']: grupo for grupo in resultado.get('por_membro_30d', [])}
+        membros = await db.membros_marketing.find(
+            {"ativo": True}, {"_id": 0, "id": 1, "nome": 1, "pontuacao": 1}
+        ).to_list(None)
+        produtividade_membros = [
+            {
                 "membro_id": membro['id'],
                 "membro_nome": membro['nome'],
-                "tarefas_concluidas": tarefas_concluidas_30d,
+                "tarefas_concluidas": por_membro.get(membro['id'], {}).get('concluidas', 0),
                 "pontuacao": membro.get('pontuacao', 0)
-            })
+            }
+            for membro in membros
+        ]
         
         # Ordenar por pontuação (ranking)
         produtividade_membros.sort(key=lambda x: x['pontuacao'], reverse=True)
         
         # Taxa de cumprimento de prazos (últimos 30 dias)
-        tarefas_concluidas_30d = await db.tarefas_marketing.count_documents({
-            "status": "Concluído",
-            "concluida_em": {"$gte": f"{data_30_dias_atras}T00:00:00"}
-        })
-        
-        tarefas_com_pontos_positivos = await db.tarefas_marketing.count_documents({
-            "status": "Concluído",
-            "pontos_ganhos": {"$gt": 0},
-            "concluida_em": {"$gte": f"{data_30_dias_atras}T00:00:00"}
-        })
+        tarefas_concluidas_30d = sum(grupo['concluidas'] for grupo in por_membro.values())
+        tarefas_com_pontos_positivos = sum(grupo['no_prazo'] for grupo in por_membro.values())
         
         taxa_cumprimento = 0
         if tarefas_concluidas_30d > 0:
             taxa_cumprimento = (tarefas_com_pontos_positivos / tarefas_concluidas_30d) * 100
         
-        # Distribuição de tarefas por status
-        distribuicao_status = {
-            "A Fazer": total_a_fazer,
-            "Em Andamento": total_em_andamento,
-            "Concluído": total_concluido,
-            "Atrasado": total_atrasado
-        }
-        
-        return {
-            "total_tarefas": total_a_fazer + total_em_andamento + total_concluido + total_atrasado,
+        dashboard = {
+            "total_tarefas": sum(distribuicao_status.values()),
             "tarefas_concluidas_hoje": tarefas_concluidas_hoje,
-            "tarefas_atrasadas": total_atrasado,
+            "tarefas_atrasadas": distribuicao_status["Atrasado"],
             "taxa_cumprimento_prazos": round(taxa_cumprimento, 1),
             "distribuicao_status": distribuicao_status,
             "produtividade_membros": produtividade_membros,
             "tarefas_por_status": {
-                "labels": ["A Fazer", "Em Andamento", "Concluído", "Atrasado"],
-                "valores": [total_a_fazer, total_em_andamento, total_concluido, total_atrasado]
+                "labels": STATUS_TAREFAS_MARKETING,
+                "valores": [distribuicao_status[status] for status in STATUS_TAREFAS_MARKETING]
             }
         }
+        return dashboard
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -7539,13 +8019,13 @@ class KanbanCard(BaseModel):
     titulo: str
     descricao: str = ""
     coluna_id: str  # ID da coluna onde o card está
-    posicao: int = 0  # Ordem do card dentro da coluna
+    rank: str = ""  # Chave de ordenação do card dentro da coluna (ver kanban_rank)
     labels: List[KanbanLabel] = []
     assignees: List[str] = []  # IDs dos usuários atribuídos
     checklist: List[dict] = []  # [{"id": "uuid", "texto": "...", "concluido": bool}]
     comentarios: List[dict] = []  # [{"id": "uuid", "autor": "...", "texto": "...", "data": "..."}]
     anexos: List[dict] = []  # [{"id": "uuid", "nome": "...", "url": "...", "tipo": "...", "data": "..."}]
-    atividades: List[dict] = []  # [{"id": "uuid", "tipo": "...", "descricao": "...", "usuario": "...", "data": "..."}]
+    # O histórico de atividades fica na coleção kanban_atividades (ver nova_atividade_kanban)
     data_vencimento: Optional[str] = None
     arquivado: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -7565,7 +8045,6 @@ class KanbanCardUpdate(BaseModel):
     titulo: Optional[str] = None
     descricao: Optional[str] = None
     coluna_id: Optional[str] = None
-    posicao: Optional[int] = None
     labels: Optional[List[KanbanLabel]] = None
     assignees: Optional[List[str]] = None
     checklist: Optional[List[dict]] = None
@@ -7577,7 +8056,7 @@ class KanbanColuna(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     titulo: str
-    posicao: int = 0  # Ordem da coluna no board
+    rank: str = ""  # Chave de ordenação da coluna no board (ver kanban_rank)
     board_id: str = "default"  # ID do board (permitir múltiplos boards no futuro)
     cor: Optional[str] = None  # Cor opcional para a coluna
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -7591,42 +8070,153 @@ class KanbanColunaCreate(BaseModel):
 class KanbanColunaUpdate(BaseModel):
     """Modelo para atualizar uma coluna"""
     titulo: Optional[str] = None
-    posicao: Optional[int] = None
     cor: Optional[str] = None
 
 # ============= ROTAS DO KANBAN =============
 
+# Ordenação de cards e colunas por rank (kanban_rank): mover um item grava apenas o
+# próprio item. Quando os ranks de uma coluna ficam longos demais, ela é redistribuída
+# em segundo plano.
+_rebalanceamentos_kanban = {}
+
+class RanksInconsistentes(Exception):
+    """Vizinho sem rank (coluna ainda não migrada) ou com rank igual ao do outro vizinho"""
+
+def _rank_vizinho(item: Optional[dict]) -> Optional[str]:
+    if item is None:
+        return None
+    if not item.get('rank'):
+        raise RanksInconsistentes()
+    return item['rank']
+
+async def ranks_vizinhos(colecao, filtro: dict, item_id: str, posicao: Optional[int] = None,
+                         anterior_id: Optional[str] = None, posterior_id: Optional[str] = None):
+    """
+    Ranks entre os quais o item deve ficar: pelos ids dos vizinhos (quando o cliente envia)
+    ou pela posição (índice) na lista, sem contar o próprio item.
+    Retorna (rank_antes, rank_depois); None indica início/fim da lista.
+    """
+    if anterior_id or posterior_id:
+        vizinhos = await colecao.find(
+            {**filtro, "id": {"$in": [i for i in (anterior_id, posterior_id) if i]}},
+            {"_id": 0, "id": 1, "rank": 1}
+        ).to_list(2)
+        ranks = {v['id']: v.get('rank') for v in vizinhos}
+        antes = ranks.get(anterior_id) if anterior_id else None
+        depois = ranks.get(posterior_id) if posterior_id else None
+        vizinhos_ok = (not anterior_id or antes) and (not posterior_id or depois)
+        if vizinhos_ok and (antes is None or depois is None or antes < depois):
+            return antes, depois
+        if posicao is None:
+            raise HTTPException(status_code=409, detail="Posição de destino desatualizada, recarregue o quadro")
+    
+    filtro = {**filtro, "id": {"$ne": item_id}}
+    posicao = max(int(posicao or 0), 0)
+    if posicao == 0:
+        primeiro = await colecao.find_one(filtro, {"_id": 0, "rank": 1}, sort=[("rank", 1)])
+        return None, _rank_vizinho(primeiro)
+    
+    vizinhos = await colecao.find(filtro, {"_id": 0, "rank": 1}).sort("rank", 1).skip(posicao - 1).limit(2).to_list(2)
+    if not vizinhos:
+        # Posição além do fim da lista: vai para o fim
+        ultimo = await colecao.find_one(filtro, {"_id": 0, "rank": 1}, sort=[("rank", -1)])
+        return _rank_vizinho(ultimo), None
+    antes, depois = _rank_vizinho(vizinhos[0]), _rank_vizinho(vizinhos[1] if len(vizinhos) > 1 else None)
+    if depois is not None and antes >= depois:
+        raise RanksInconsistentes()
+    return antes, depois
+
+async def rank_na_posicao(colecao, filtro: dict, item_id: str, **destino) -> str:
+    """Novo rank do item no destino. Se os vizinhos não tiverem ranks utilizáveis, a
+    coluna é redistribuída e o cálculo refeito; se ainda assim falhar, responde 409."""
+    for _ in range(2):
+        try:
+            antes, depois = await ranks_vizinhos(colecao, filtro, item_id, **destino)
+            return rank_entre(antes, depois, espalhar=True)
+        except RanksInconsistentes:
+            await rebalancear_ranks(colecao, filtro)
+    raise HTTPException(status_code=409, detail="Posição de destino desatualizada, recarregue o quadro")
+
+async def rebalancear_ranks(colecao, filtro: dict):
+    """Redistribui os ranks dos itens do filtro (uma coluna de cards ou um board) em uma escrita em lote.
+    Cada update confere o rank lido, para não sobrescrever um item movido no meio do processo;
+    nesse caso a redistribuição é refeita."""
+    for _ in range(3):
+        itens = await colecao.find(filtro, {"_id": 0, "id": 1, "rank": 1}).sort("rank", 1).to_list(None)
+        operacoes = [
+            UpdateOne({"id": item['id'], "rank": item.get('rank')}, {"$set": {"rank": rank}})
+            for item, rank in zip(itens, ranks_distribuidos(len(itens)))
+            if item.get('rank') != rank
+        ]
+        if not operacoes:
+            return
+        resultado = await colecao.bulk_write(operacoes, ordered=False)
+        if resultado.matched_count == len(operacoes):
+            return
+
+def agendar_rebalanceamento(colecao, filtro: dict, rank: str):
+    """Agenda a redistribuição em segundo plano se o rank recém-gerado ficou longo demais"""
+    if not precisa_rebalancear(rank):
+        return
+    chave = (colecao.name, tuple(sorted(filtro.items())))
+    if chave in _rebalanceamentos_kanban:
+        return
+    
+    async def executar():
+        try:
+            await rebalancear_ranks(colecao, filtro)
+        except Exception as e:
+            print(f"⚠️ Erro ao redistribuir ranks do kanban ({colecao.name}): {e}")
+        finally:
+            _rebalanceamentos_kanban.pop(chave, None)
+    
+    _rebalanceamentos_kanban[chave] = asyncio.create_task(executar())
+
+# Campos de um card exibidos no quadro: listas longas viram contadores
+CAMPOS_RESUMO_CARD = {
+    "_id": 0, "id": 1, "titulo": 1, "coluna_id": 1, "rank": 1, "labels": 1, "assignees": 1,
+    "data_vencimento": 1, "arquivado": 1, "capa_url": 1, "capa_cor": 1,
+    "total_checklist": {"$size": {"$ifNull": ["$checklist", []]}},
+    "checklist_concluidos": {"$size": {"$filter": {"input": {"$ifNull": ["$checklist", []]}, "cond": "$$this.concluido"}}},
+    "total_anexos": {"$size": {"$ifNull": ["$anexos", []]}},
+    "total_comentarios": {"$size": {"$ifNull": ["$comentarios", []]}}
+}
+
+def nova_atividade_kanban(card_id: str, tipo: str, descricao: str, usuario: dict) -> dict:
+    """Atividade de um card, gravada na coleção kanban_atividades (índice card_id + data)"""
+    return {
+        "id": str(uuid.uuid4()),
+        "card_id": card_id,
+        "tipo": tipo,
+        "descricao": descricao,
+        "usuario": usuario.get('username', 'Usuário'),
+        "data": datetime.now(timezone.utc)
+    }
+
 # COLUNAS
 @api_router.get("/kanban/colunas")
 async def get_kanban_colunas(board_id: str = "default", current_user: dict = Depends(get_current_user)):
-    """Lista todas as colunas do board ordenadas por posição"""
-    colunas = await db.kanban_colunas.find({"board_id": board_id}).sort("posicao", 1).to_list(None)
-    for coluna in colunas:
-        if '_id' in coluna:
-            del coluna['_id']
-    return colunas
+    """Lista todas as colunas do board ordenadas por rank"""
+    colunas = await buscar(db.kanban_colunas, {"board_id": board_id}).sort("rank", 1).to_list(None)
+    return RespostaJSON(colunas)
 
 @api_router.post("/kanban/colunas")
 async def create_kanban_coluna(coluna: KanbanColunaCreate, current_user: dict = Depends(get_current_user)):
     """Cria uma nova coluna"""
-    # Pegar a última posição
+    # Nova coluna vai para o fim do board
     ultima_coluna = await db.kanban_colunas.find_one(
         {"board_id": coluna.board_id},
-        sort=[("posicao", -1)]
+        {"_id": 0, "rank": 1},
+        sort=[("rank", -1)]
     )
     
-    nova_posicao = (ultima_coluna.get('posicao', -1) + 1) if ultima_coluna else 0
-    
     nova_coluna = KanbanColuna(
         **coluna.model_dump(),
-        posicao=nova_posicao
+        rank=rank_entre(ultima_coluna.get('rank') if ultima_coluna else None, None, espalhar=True)
     )
     
     coluna_dict = nova_coluna.model_dump()
-    await db.kanban_colunas.insert_one(coluna_dict)
-    
-    if '_id' in coluna_dict:
-        del coluna_dict['_id']
+    await inserir(db.kanban_colunas, coluna_dict)
     
     return coluna_dict
 
@@ -7646,8 +8236,11 @@ async def update_kanban_coluna(coluna_id: str, coluna: KanbanColunaUpdate, curre
 @api_router.delete("/kanban/colunas/{coluna_id}")
 async def delete_kanban_coluna(coluna_id: str, current_user: dict = Depends(get_current_user)):
     """Deleta uma coluna e todos os seus cards"""
-    # Deletar todos os cards da coluna
+    # Deletar todos os cards da coluna e suas atividades
+    card_ids = await db.kanban_cards.distinct("id", {"coluna_id": coluna_id})
     await db.kanban_cards.delete_many({"coluna_id": coluna_id})
+    if card_ids:
+        await db.kanban_atividades.delete_many({"card_id": {"$in": card_ids}})
     
     # Deletar a coluna
     await db.kanban_colunas.delete_one({"id": coluna_id})
@@ -7657,17 +8250,38 @@ async def delete_kanban_coluna(coluna_id: str, current_user: dict = Depends(get_
 @api_router.post("/kanban/colunas/reordenar")
 async def reordenar_colunas(reordenacao: dict, current_user: dict = Depends(get_current_user)):
     """Reordena as colunas
-    Espera: {"colunas": [{"id": "uuid1", "posicao": 0}, {"id": "uuid2", "posicao": 1}, ...]}
+    Espera: {"coluna_id": "uuid", "coluna_anterior_id": "uuid" | null, "coluna_posterior_id": "uuid" | null, "nova_posicao": 0}
+    (só a coluna movida é gravada), ou o formato antigo com a lista completa:
+    {"colunas": [{"id": "uuid1", "posicao": 0}, {"id": "uuid2", "posicao": 1}, ...]}
     """
-    colunas = reordenacao.get('colunas', [])
-    
-    for coluna in colunas:
-        await db.kanban_colunas.update_one(
-            {"id": coluna['id']},
-            {"$set": {"posicao": coluna['posicao']}}
-        )
+    colunas = reordenacao.get('colunas')
+    if colunas is not None:
+        # Formato antigo: redistribui os ranks na ordem recebida, em uma única escrita em lote
+        ordenadas = sorted(colunas, key=lambda c: c.get('posicao', 0))
+        operacoes = [
+            UpdateOne({"id": coluna['id']}, {"$set": {"rank": rank}})
+            for coluna, rank in zip(ordenadas, ranks_distribuidos(len(ordenadas)))
+        ]
+        if operacoes:
+            await db.kanban_colunas.bulk_write(operacoes, ordered=False)
+        return {"message": "Colunas reordenadas com sucesso"}
+    
+    coluna_id = reordenacao.get('coluna_id')
+    coluna = await db.kanban_colunas.find_one({"id": coluna_id}, {"_id": 0, "board_id": 1})
+    if not coluna:
+        raise HTTPException(status_code=404, detail="Coluna não encontrada")
+    
+    filtro_board = {"board_id": coluna.get('board_id', 'default')}
+    novo_rank = await rank_na_posicao(
+        db.kanban_colunas, filtro_board, coluna_id,
+        posicao=reordenacao.get('nova_posicao'),
+        anterior_id=reordenacao.get('coluna_anterior_id'),
+        posterior_id=reordenacao.get('coluna_posterior_id')
+    )
+    await db.kanban_colunas.update_one({"id": coluna_id}, {"$set": {"rank": novo_rank}})
+    agendar_rebalanceamento(db.kanban_colunas, filtro_board, novo_rank)
     
-    return {"message": "Colunas reordenadas com sucesso"}
+    return {"message": "Colunas reordenadas com sucesso", "rank": novo_rank}
 
 # CARDS
 @api_router.get("/kanban/cards")
@@ -7683,51 +8297,69 @@ async def get_kanban_cards(coluna_id: Optional[str] = None, board_id: str = "def
         coluna_ids = [c['id'] for c in colunas]
         query['coluna_id'] = {"$in": coluna_ids}
     
-    cards = await db.kanban_cards.find(query).sort("posicao", 1).to_list(None)
-    
-    for card in cards:
-        if '_id' in card:
-            del card['_id']
+    # Só os campos do quadro; detalhes e atividades são carregados ao abrir o card
+    cards = await db.kanban_cards.aggregate([
+        {"$match": query},
+        {"$sort": {"rank": 1}},
+        {"$project": CAMPOS_RESUMO_CARD}
+    ]).to_list(None)
     
     return cards
 
 @api_router.post("/kanban/cards")
 async def create_kanban_card(card: KanbanCardCreate, current_user: dict = Depends(get_current_user)):
     """Cria um novo card"""
-    # Pegar a última posição na coluna
+    # Novo card vai para o fim da coluna
     ultimo_card = await db.kanban_cards.find_one(
         {"coluna_id": card.coluna_id},
-        sort=[("posicao", -1)]
+        {"_id": 0, "rank": 1},
+        sort=[("rank", -1)]
     )
     
-    nova_posicao = (ultimo_card.get('posicao', -1) + 1) if ultimo_card else 0
-    
     novo_card = KanbanCard(
         **card.model_dump(),
-        posicao=nova_posicao
+        rank=rank_entre(ultimo_card.get('rank') if ultimo_card else None, None, espalhar=True)
     )
     
     card_dict = novo_card.model_dump()
-    await db.kanban_cards.insert_one(card_dict)
-    
-    if '_id' in card_dict:
-        del card_dict['_id']
+    await inserir(db.kanban_cards, card_dict)
     
     return card_dict
 
 @api_router.get("/kanban/cards/{card_id}")
 async def get_kanban_card(card_id: str, current_user: dict = Depends(get_current_user)):
-    """Obtém detalhes de um card específico"""
-    card = await db.kanban_cards.find_one({"id": card_id})
+    """Obtém detalhes de um card específico (as atividades ficam em /kanban/cards/{card_id}/atividades)"""
+    card = await db.kanban_cards.find_one({"id": card_id}, {"_id": 0, "atividades": 0})
     
     if not card:
         raise HTTPException(status_code=404, detail="Card não encontrado")
     
-    if '_id' in card:
-        del card['_id']
+    card['total_atividades'] = await db.kanban_atividades.count_documents({"card_id": card_id})
     
     return card
 
+@api_router.get("/kanban/cards/{card_id}/atividades")
+async def get_kanban_card_atividades(
+    card_id: str,
+    limite: int = Query(50, ge=1, le=200),
+    antes: Optional[datetime] = None,
+    antes_id: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Histórico de atividades do card, das mais recentes para as mais antigas.
+    Para paginar, envie em `antes` e `antes_id` a data e o id da última atividade recebida:
+    o id desempata atividades gravadas no mesmo instante, que não são puladas nem repetidas."""
+    query = {"card_id": card_id}
+    if antes:
+        antes = para_datetime(antes)
+        query["$or"] = [{"data": {"$lt": antes}}]
+        if antes_id:
+            query["$or"].append({"data": antes, "id": {"$lt": antes_id}})
+    
+    atividades = await buscar(db.kanban_atividades, query).sort([("data", -1), ("id", -1)]).limit(limite).to_list(limite)
+    
+    return RespostaJSON(atividades)
+
 @api_router.put("/kanban/cards/{card_id}")
 async def update_kanban_card(card_id: str, card: KanbanCardUpdate, current_user: dict = Depends(get_current_user)):
     """Atualiza um card"""
@@ -7753,50 +8385,48 @@ async def delete_kanban_card(card_id: str, current_user: dict = Depends(get_curr
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Card não encontrado")
     
+    await db.kanban_atividades.delete_many({"card_id": card_id})
+    
     return {"message": "Card deletado com sucesso"}
 
 @api_router.post("/kanban/cards/mover")
 async def mover_card(movimento: dict, current_user: dict = Depends(get_current_user)):
-    """Move um card para outra coluna ou posição
+    """Move um card para outra coluna ou posição. Só o card movido é gravado.
     Espera: {
         "card_id": "uuid",
         "coluna_destino_id": "uuid",
-        "nova_posicao": 0
+        "nova_posicao": 0,
+        "card_anterior_id": "uuid" | null,   # opcional: vizinhos no destino
+        "card_posterior_id": "uuid" | null
     }
     """
     card_id = movimento.get('card_id')
     coluna_destino_id = movimento.get('coluna_destino_id')
-    nova_posicao = movimento.get('nova_posicao', 0)
+    filtro_coluna = {"coluna_id": coluna_destino_id}
     
-    # Atualizar o card
-    await db.kanban_cards.update_one(
+    novo_rank = await rank_na_posicao(
+        db.kanban_cards, filtro_coluna, card_id,
+        posicao=movimento.get('nova_posicao', 0),
+        anterior_id=movimento.get('card_anterior_id'),
+        posterior_id=movimento.get('card_posterior_id')
+    )
+    
+    result = await db.kanban_cards.update_one(
         {"id": card_id},
         {
             "$set": {
                 "coluna_id": coluna_destino_id,
-                "posicao": nova_posicao,
+                "rank": novo_rank,
                 "updated_at": datetime.now(timezone.utc)
             }
         }
     )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Card não encontrado")
     
-    # Reordenar os outros cards da coluna de destino
-    cards_destino = await db.kanban_cards.find(
-        {"coluna_id": coluna_destino_id, "id": {"$ne": card_id}}
-    ).sort("posicao", 1).to_list(None)
-    
-    posicao_atual = 0
-    for card in cards_destino:
-        if posicao_atual == nova_posicao:
-            posicao_atual += 1
-        
-        await db.kanban_cards.update_one(
-            {"id": card['id']},
-            {"$set": {"posicao": posicao_atual}}
-        )
-        posicao_atual += 1
+    agendar_rebalanceamento(db.kanban_cards, filtro_coluna, novo_rank)
     
-    return {"message": "Card movido com sucesso"}
+    return {"message": "Card movido com sucesso", "rank": novo_rank}
 
 @api_router.post("/kanban/cards/{card_id}/checklist")
 async def add_checklist_item(card_id: str, item: dict, current_user: dict = Depends(get_current_user)):
@@ -7811,21 +8441,12 @@ async def add_checklist_item(card_id: str, item: dict, current_user: dict = Depe
     }
     
     # Registrar atividade
-    atividade = {
-        "id": str(uuid.uuid4()),
-        "tipo": "adicionou_item_checklist",
-        "descricao": f"Adicionou item no checklist: {item.get('texto', '')}",
-        "usuario": current_user.get('username', 'Usuário'),
-        "data": datetime.now(timezone.utc).isoformat()
-    }
+    atividade = nova_atividade_kanban(card_id, "adicionou_item_checklist", f"Adicionou item no checklist: {item.get('texto', '')}", current_user)
     
     result = await db.kanban_cards.update_one(
         {"id": card_id},
         {
-            "$push": {
-                "checklist": novo_item,
-                "atividades": atividade
-            },
+            "$push": {"checklist": novo_item},
             "$set": {"updated_at": datetime.now(timezone.utc)}
         }
     )
@@ -7833,6 +8454,8 @@ async def add_checklist_item(card_id: str, item: dict, current_user: dict = Depe
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Card não encontrado")
     
+    await db.kanban_atividades.insert_one(atividade)
+    
     return novo_item
 
 @api_router.put("/kanban/cards/{card_id}/checklist/{item_id}")
@@ -7936,6 +8559,9 @@ async def copiar_card(card_id: str, destino: dict, current_user: dict = Depends(
         raise HTTPException(status_code=404, detail="Card não encontrado")
     
     coluna_destino_id = destino.get('coluna_destino_id', card_original['coluna_id'])
+    primeiro_card = await db.kanban_cards.find_one(
+        {"coluna_id": coluna_destino_id, "rank": {"$type": "string"}}, {"_id": 0, "rank": 1}, sort=[("rank", 1)]
+    )
     
     # Criar cópia
     novo_card = KanbanCard(
@@ -7946,48 +8572,34 @@ async def copiar_card(card_id: str, destino: dict, current_user: dict = Depends(
         assignees=card_original.get('assignees', []),
         checklist=card_original.get('checklist', []),
         data_vencimento=card_original.get('data_vencimento'),
-        posicao=0  # Colocar no topo
+        rank=rank_entre(None, primeiro_card.get('rank') if primeiro_card else None, espalhar=True)  # Colocar no topo
     )
     
     card_dict = novo_card.model_dump()
-    await db.kanban_cards.insert_one(card_dict)
-    
-    if '_id' in card_dict:
-        del card_dict['_id']
+    await inserir(db.kanban_cards, card_dict)
     
     # Registrar atividade
-    atividade = {
-        "id": str(uuid.uuid4()),
-        "tipo": "copiou",
-        "descricao": f"Copiou este card de {card_original['titulo']}",
-        "usuario": current_user.get('username', 'Usuário'),
-        "data": datetime.now(timezone.utc).isoformat()
-    }
-    
-    await db.kanban_cards.update_one(
-        {"id": card_dict['id']},
-        {"$push": {"atividades": atividade}}
-    )
+    atividade = nova_atividade_kanban(card_dict['id'], "copiou", f"Copiou este card de {card_original['titulo']}", current_user)
+    await db.kanban_atividades.insert_one(atividade)
     
     return card_dict
 
 @api_router.post("/kanban/cards/{card_id}/arquivar")
 async def arquivar_card(card_id: str, current_user: dict = Depends(get_current_user)):
     """Arquiva ou desarquiva um card"""
-    card = await db.kanban_cards.find_one({"id": card_id})
+    card = await db.kanban_cards.find_one({"id": card_id}, {"_id": 0, "arquivado": 1})
     if not card:
         raise HTTPException(status_code=404, detail="Card não encontrado")
     
     novo_estado = not card.get('arquivado', False)
     
     # Registrar atividade
-    atividade = {
-        "id": str(uuid.uuid4()),
-        "tipo": "arquivou" if novo_estado else "desarquivou",
-        "descricao": "Arquivou este card" if novo_estado else "Desarquivou este card",
-        "usuario": current_user.get('username', 'Usuário'),
-        "data": datetime.now(timezone.utc).isoformat()
-    }
+    atividade = nova_atividade_kanban(
+        card_id,
+        "arquivou" if novo_estado else "desarquivou",
+        "Arquivou este card" if novo_estado else "Desarquivou este card",
+        current_user
+    )
     
     await db.kanban_cards.update_one(
         {"id": card_id},
@@ -7995,10 +8607,10 @@ async def arquivar_card(card_id: str, current_user: dict = Depends(get_current_u
             "$set": {
                 "arquivado": novo_estado,
                 "updated_at": datetime.now(timezone.utc)
-            },
-            "$push": {"atividades": atividade}
+            }
         }
     )
+    await db.kanban_atividades.insert_one(atividade)
     
     return {"message": "Card arquivado" if novo_estado else "Card desarquivado", "arquivado": novo_estado}
 
@@ -8017,21 +8629,12 @@ async def add_anexo(card_id: str, anexo: dict, current_user: dict = Depends(get_
     }
     
     # Registrar atividade
-    atividade = {
-        "id": str(uuid.uuid4()),
-        "tipo": "anexou",
-        "descricao": f"Anexou {novo_anexo['nome']}",
-        "usuario": current_user.get('username', 'Usuário'),
-        "data": datetime.now(timezone.utc).isoformat()
-    }
+    atividade = nova_atividade_kanban(card_id, "anexou", f"Anexou {novo_anexo['nome']}", current_user)
     
     result = await db.kanban_cards.update_one(
         {"id": card_id},
         {
-            "$push": {
-                "anexos": novo_anexo,
-                "atividades": atividade
-            },
+            "$push": {"anexos": novo_anexo},
             "$set": {"updated_at": datetime.now(timezone.utc)}
         }
     )
@@ -8039,30 +8642,21 @@ async def add_anexo(card_id: str, anexo: dict, current_user: dict = Depends(get_
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Card não encontrado")
     
+    await db.kanban_atividades.insert_one(atividade)
+    
     return novo_anexo
 
 @api_router.post("/kanban/cards/{card_id}/anexo/upload")
 async def upload_anexo(card_id: str, file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
     """Upload de arquivo como anexo
-    Salva o arquivo localmente e retorna o path
+    Grava o arquivo no blob store em chunks e retorna o anexo criado
     """
     try:
-        # Criar diretório de uploads se não existir
-        upload_dir = Path("/app/uploads")
-        upload_dir.mkdir(exist_ok=True)
-        
-        # Gerar nome único para o arquivo
-        file_extension = Path(file.filename).suffix
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = upload_dir / unique_filename
-        
-        # Salvar arquivo
-        contents = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(contents)
+        blob = await blob_store.salvar_upload(file, tamanho_maximo=blob_store.TAMANHO_MAXIMO_ANEXO)
         
         # URL relativa para acesso
-        file_url = f"/uploads/{unique_filename}"
+        file_url = blob['url']
+        imagens.agendar_derivados(file_url)
         
         # Criar anexo
         novo_anexo = {
@@ -8070,27 +8664,18 @@ async def upload_anexo(card_id: str, file: UploadFile = File(...), current_user:
             "nome": file.filename,
             "url": file_url,
             "tipo": "upload",
-            "tamanho": len(contents),
+            "tamanho": blob['tamanho'],
             "data": datetime.now(timezone.utc).isoformat(),
             "usuario": current_user.get('username', 'Usuário')
         }
         
         # Registrar atividade
-        atividade = {
-            "id": str(uuid.uuid4()),
-            "tipo": "fez_upload",
-            "descricao": f"Fez upload de {file.filename}",
-            "usuario": current_user.get('username', 'Usuário'),
-            "data": datetime.now(timezone.utc).isoformat()
-        }
+        atividade = nova_atividade_kanban(card_id, "fez_upload", f"Fez upload de {file.filename}", current_user)
         
         result = await db.kanban_cards.update_one(
             {"id": card_id},
             {
-                "$push": {
-                    "anexos": novo_anexo,
-                    "atividades": atividade
-                },
+                "$push": {"anexos": novo_anexo},
                 "$set": {"updated_at": datetime.now(timezone.utc)}
             }
         )
@@ -8098,8 +8683,14 @@ async def upload_anexo(card_id: str, file: UploadFile = File(...), current_user:
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Card não encontrado")
         
+        await db.kanban_atividades.insert_one(atividade)
+        
         return novo_anexo
         
+    except blob_store.ArquivoMuitoGrande as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao fazer upload: {str(e)}")
 
@@ -8107,7 +8698,7 @@ async def upload_anexo(card_id: str, file: UploadFile = File(...), current_user:
 async def delete_anexo(card_id: str, anexo_id: str, current_user: dict = Depends(get_current_user)):
     """Remove um anexo do card"""
     # Buscar anexo para registrar atividade
-    card = await db.kanban_cards.find_one({"id": card_id})
+    card = await db.kanban_cards.find_one({"id": card_id}, {"_id": 0, "anexos": 1})
     if not card:
         raise HTTPException(status_code=404, detail="Card não encontrado")
     
@@ -8115,18 +8706,8 @@ async def delete_anexo(card_id: str, anexo_id: str, current_user: dict = Depends
     
     # Registrar atividade
     if anexo:
-        atividade = {
-            "id": str(uuid.uuid4()),
-            "tipo": "removeu_anexo",
-            "descricao": f"Removeu anexo {anexo.get('nome', 'Arquivo')}",
-            "usuario": current_user.get('username', 'Usuário'),
-            "data": datetime.now(timezone.utc).isoformat()
-        }
-        
-        await db.kanban_cards.update_one(
-            {"id": card_id},
-            {"$push": {"atividades": atividade}}
-        )
+        atividade = nova_atividade_kanban(card_id, "removeu_anexo", f"Removeu anexo {anexo.get('nome', 'Arquivo')}", current_user)
+        await db.kanban_atividades.insert_one(atividade)
     
     result = await db.kanban_cards.update_one(
         {"id": card_id},
@@ -8149,19 +8730,12 @@ async def add_membro(card_id: str, membro: dict, current_user: dict = Depends(ge
     usuario_id = membro.get('usuario_id') or membro.get('username', 'Usuário')
     
     # Registrar atividade
-    atividade = {
-        "id": str(uuid.uuid4()),
-        "tipo": "adicionou_membro",
-        "descricao": f"Adicionou {usuario_id} ao card",
-        "usuario": current_user.get('username', 'Usuário'),
-        "data": datetime.now(timezone.utc).isoformat()
-    }
+    atividade = nova_atividade_kanban(card_id, "adicionou_membro", f"Adicionou {usuario_id} ao card", current_user)
     
     result = await db.kanban_cards.update_one(
         {"id": card_id},
         {
             "$addToSet": {"assignees": usuario_id},
-            "$push": {"atividades": atividade},
             "$set": {"updated_at": datetime.now(timezone.utc)}
         }
     )
@@ -8169,25 +8743,20 @@ async def add_membro(card_id: str, membro: dict, current_user: dict = Depends(ge
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Card não encontrado")
     
+    await db.kanban_atividades.insert_one(atividade)
+    
     return {"message": "Membro adicionado"}
 
 @api_router.delete("/kanban/cards/{card_id}/membro/{usuario_id}")
 async def remove_membro(card_id: str, usuario_id: str, current_user: dict = Depends(get_current_user)):
     """Remove um membro do card"""
     # Registrar atividade
-    atividade = {
-        "id": str(uuid.uuid4()),
-        "tipo": "removeu_membro",
-        "descricao": f"Removeu {usuario_id} do card",
-        "usuario": current_user.get('username', 'Usuário'),
-        "data": datetime.now(timezone.utc).isoformat()
-    }
+    atividade = nova_atividade_kanban(card_id, "removeu_membro", f"Removeu {usuario_id} do card", current_user)
     
     result = await db.kanban_cards.update_one(
         {"id": card_id},
         {
             "$pull": {"assignees": usuario_id},
-            "$push": {"atividades": atividade},
             "$set": {"updated_at": datetime.now(timezone.utc)}
         }
     )
@@ -8195,6 +8764,8 @@ async def remove_membro(card_id: str, usuario_id: str, current_user: dict = Depe
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Card não encontrado")
     
+    await db.kanban_atividades.insert_one(atividade)
+    
     return {"message": "Membro removido"}
 
 @api_router.put("/kanban/cards/{card_id}/labels")
@@ -8208,13 +8779,7 @@ async def atualizar_labels(card_id: str, labels_data: dict, current_user: dict =
     labels_nomes = [l.get('name', '') for l in labels if l.get('name')]
     descricao_labels = ", ".join(labels_nomes) if labels_nomes else "etiquetas"
     
-    atividade = {
-        "id": str(uuid.uuid4()),
-        "tipo": "atualizou_etiquetas",
-        "descricao": f"Atualizou as etiquetas: {descricao_labels}",
-        "usuario": current_user.get('username', 'Usuário'),
-        "data": datetime.now(timezone.utc).isoformat()
-    }
+    atividade = nova_atividade_kanban(card_id, "atualizou_etiquetas", f"Atualizou as etiquetas: {descricao_labels}", current_user)
     
     result = await db.kanban_cards.update_one(
         {"id": card_id},
@@ -8222,14 +8787,15 @@ async def atualizar_labels(card_id: str, labels_data: dict, current_user: dict =
             "$set": {
                 "labels": labels,
                 "updated_at": datetime.now(timezone.utc)
-            },
-            "$push": {"atividades": atividade}
+            }
         }
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Card não encontrado")
     
+    await db.kanban_atividades.insert_one(atividade)
+    
     return {"message": "Labels atualizadas", "labels": labels}
 
 @api_router.put("/kanban/cards/{card_id}/descricao")
@@ -8240,13 +8806,7 @@ async def atualizar_descricao(card_id: str, descricao_data: dict, current_user:
     descricao = descricao_data.get('descricao', '')
     
     # Registrar atividade
-    atividade = {
-        "id": str(uuid.uuid4()),
-        "tipo": "atualizou_descricao",
-        "descricao": "Atualizou a descrição do card",
-        "usuario": current_user.get('username', 'Usuário'),
-        "data": datetime.now(timezone.utc).isoformat()
-    }
+    atividade = nova_atividade_kanban(card_id, "atualizou_descricao", "Atualizou a descrição do card", current_user)
     
     result = await db.kanban_cards.update_one(
         {"id": card_id},
@@ -8254,14 +8814,15 @@ async def atualizar_descricao(card_id: str, descricao_data: dict, current_user:
             "$set": {
                 "descricao": descricao,
                 "updated_at": datetime.now(timezone.utc)
-            },
-            "$push": {"atividades": atividade}
+            }
         }
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Card não encontrado")
     
+    await db.kanban_atividades.insert_one(atividade)
+    
     return {"message": "Descrição atualizada"}
 
 @api_router.post("/kanban/cards/{card_id}/checklist/{item_id}/subtarefa")
@@ -8349,17 +8910,13 @@ async def atualizar_capa(card_id: str, capa_data: dict, current_user: dict = Dep
     update_data = {}
     if capa_url is not None:
         update_data['capa_url'] = capa_url
+        # Capas apontando para /uploads ganham miniaturas para o quadro
+        imagens.agendar_derivados(capa_url)
     if capa_cor is not None:
         update_data['capa_cor'] = capa_cor
     
     # Registrar atividade
-    atividade = {
-        "id": str(uuid.uuid4()),
-        "tipo": "atualizou_capa",
-        "descricao": "Alterou a capa do card",
-        "usuario": current_user.get('username', 'Usuário'),
-        "data": datetime.now(timezone.utc).isoformat()
-    }
+    atividade = nova_atividade_kanban(card_id, "atualizou_capa", "Alterou a capa do card", current_user)
     
     result = await db.kanban_cards.update_one(
         {"id": card_id},
@@ -8367,47 +8924,96 @@ async def atualizar_capa(card_id: str, capa_data: dict, current_user: dict = Dep
             "$set": {
                 **update_data,
                 "updated_at": datetime.now(timezone.utc)
-            },
-            "$push": {"atividades": atividade}
+            }
         }
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Card não encontrado")
     
+    await db.kanban_atividades.insert_one(atividade)
+    
     return {"message": "Capa atualizada"}
 
 @api_router.delete("/kanban/cards/{card_id}/capa")
 async def remover_capa(card_id: str, current_user: dict = Depends(get_current_user)):
     """Remove a capa de um card"""
     # Registrar atividade
-    atividade = {
-        "id": str(uuid.uuid4()),
-        "tipo": "removeu_capa",
-        "descricao": "Removeu a capa do card",
-        "usuario": current_user.get('username', 'Usuário'),
-        "data": datetime.now(timezone.utc).isoformat()
-    }
+    atividade = nova_atividade_kanban(card_id, "removeu_capa", "Removeu a capa do card", current_user)
     
     result = await db.kanban_cards.update_one(
         {"id": card_id},
         {
             "$unset": {"capa_url": "", "capa_cor": ""},
-            "$set": {"updated_at": datetime.now(timezone.utc)},
-            "$push": {"atividades": atividade}
+            "$set": {"updated_at": datetime.now(timezone.utc)}
         }
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Card não encontrado")
     
+    await db.kanban_atividades.insert_one(atividade)
+    
     return {"message": "Capa removida"}
 
 # ============= FIM KANBAN BOARD =============
 
+# Cache HTTP das leituras pesadas (TTL por rota); limite configurável por ambiente
+cache_respostas = CacheRespostas(limite_bytes=int(os.environ.get('CACHE_RESPOSTAS_MB', '32')) * 1024 * 1024)
+
+ROTAS_CACHE_RESPOSTAS = {
+    "/api/dashboard/metrics": RegraCache(ttl_segundos=30),
+    "/api/dashboard/charts": RegraCache(ttl_segundos=30),
+    "/api/gestao/producao/dashboard/stats": RegraCache(ttl_segundos=5),
+    "/api/gestao/financeiro/resumo": RegraCache(ttl_segundos=10, variar_por="role"),
+    "/api/gestao/financeiro/dashboard": RegraCache(ttl_segundos=15, variar_por="role"),
+    "/api/gestao/marketplaces/dashboard": RegraCache(ttl_segundos=15),
+    "/api/gestao/marketplaces/relatorio-vendas": RegraCache(ttl_segundos=60),
+    "/api/gestao/marketplaces/mensagem-do-dia": RegraCache(ttl_segundos=60),
+    "/api/gestao/marketing/dashboard": RegraCache(ttl_segundos=10),
+    "/api/gestao/marketing/relatorios": RegraCache(ttl_segundos=15),
+}
+
+def identificar_token(token: str) -> Optional[dict]:
+    """Payload do JWT para o cache de respostas; None se o token for inválido"""
+    try:
+        return decode_token(token)
+    except HTTPException:
+        return None
+
+@api_router.get("/admin/cache-respostas")
+async def get_metricas_cache_respostas(current_user: dict = Depends(get_current_user)):
+    """Métricas do cache de respostas (acertos, esperas, uso de memória por rota)"""
+    if not is_director_or_manager(current_user):
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    return cache_respostas.metricas()
+
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(
+    CacheRespostasMiddleware,
+    cache=cache_respostas,
+    rotas=ROTAS_CACHE_RESPOSTAS,
+    identificar=identificar_token,
+)
+
+# Registrado antes do CORS: o CORS envolve o 413 e o navegador recebe a mensagem de erro
+@app.middleware("http")
+async def limitar_tamanho_anexo(request: Request, call_next):
+    """Recusa anexos acima do limite pelo Content-Length, antes de ler o corpo da requisição.
+    Sem Content-Length (upload chunked) o tamanho só seria conhecido depois de receber o
+    corpo inteiro, então o upload é recusado com 411."""
+    if request.method == "POST" and request.url.path.endswith("/anexo/upload"):
+        tamanho = request.headers.get("content-length", "")
+        if not tamanho.isdigit() or "chunked" in request.headers.get("transfer-encoding", "").lower():
+            return JSONResponse(status_code=411, content={"detail": "Envie o anexo com o cabeçalho Content-Length"})
+        # Margem para os cabeçalhos do multipart
+        if int(tamanho) > blob_store.TAMANHO_MAXIMO_ANEXO + 64 * 1024:
+            erro = blob_store.ArquivoMuitoGrande(blob_store.TAMANHO_MAXIMO_ANEXO)
+            return JSONResponse(status_code=413, content={"detail": str(erro)})
+    return await call_next(request)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -8417,9 +9023,9 @@ app.add_middleware(
 )
 
 # Montar pasta de uploads
-upload_dir = Path("/app/uploads")
+upload_dir = blob_store.UPLOAD_DIR
 upload_dir.mkdir(exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=str(upload_dir)), name="uploads")
+app.mount("/uploads", UploadsStaticFiles(directory=str(upload_dir)), name="uploads")
 
 # Configure logging
 logging.basicConfig(
@@ -8428,6 +9034,94 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def criar_indice_unico(colecao, campo: str):
+    """Índice único só nos documentos com o campo preenchido; substitui o índice simples de mesmo nome"""
+    nome = f"{campo}_1"
+    indices = await colecao.index_information()
+    if nome in indices and not indices[nome].get('unique'):
+        await colecao.drop_index(nome)
+    try:
+        await colecao.create_index([(campo, 1)], unique=True, partialFilterExpression={campo: {"$type": "string"}})
+    except OperationFailure as e:
+        print(f"⚠️ Índice único {colecao.name}.{campo} não criado (há valores duplicados?): {e}")
+
+async def criar_indice_texto_pedidos():
+    """Índice de texto da busca de pedidos; recriado quando a lista de campos muda (só pode haver um por coleção)"""
+    campos = set(busca_pedidos.CAMPOS_TEXTO)
+    for nome, indice in (await db.pedidos_marketplace.index_information()).items():
+        if indice.get('weights') and set(indice['weights']) != campos:
+            await db.pedidos_marketplace.drop_index(nome)
+    await db.pedidos_marketplace.create_index(
+        [(campo, "text") for campo in busca_pedidos.CAMPOS_TEXTO],
+        name="busca_pedidos_texto", default_language="portuguese"
+    )
+
+@app.on_event("startup")
+async def criar_indices():
+    """Garante os índices usados pelas consultas da aplicação"""
+    await db.contas_receber.create_index([("data_vencimento", 1)])
+    await db.contas_receber.create_index([("data_recebimento", 1)])
+    await db.contas_pagar.create_index([("data_vencimento", 1)])
+    await db.movimentacoes_financeiras.create_index([("conta_bancaria_id", 1), ("data", -1)])
+    await db.movimentacoes_financeiras.create_index([("data", 1)])
+    await db.pedidos_manufatura.create_index([("created_at", 1)])
+    await db.pedidos_manufatura.create_index([("status", 1), ("prazo_entrega", 1)])
+    await db.pedidos_manufatura.create_index([("data_abertura", 1)])
+    await db.pedidos_manufatura.create_index([("loja_id", 1), ("data_abertura", 1)])
+    await db.ordens_producao.create_index([("status_interno", 1), ("data_entrega_prometida", 1)])
+    await db.ordem_eventos.create_index([("ordem_id", 1), ("data_hora", 1)])
+    await db.ordens_producao.create_index([("aguardando_aprovacao", 1), ("responsavel_pendente", 1), ("updated_at", -1)])
+    await db.formas_pagamento_banco.create_index([("ativa", 1), ("conta_bancaria_id", 1)])
+    await criar_indices_contas_receber(db)
+    await outbox.criar_indices_outbox(db)
+    await criar_indice_unico(db.lancamentos_financeiros, "evento_id")
+    await criar_indice_unico(db.ordens_producao, "id_pedido_origem")
+    await criar_indice_unico(db.vendas_marketplace, "origem_id")
+    await db.outbox_falhas.create_index([("colecao", 1), ("documento_id", 1)])
+    await db.kanban_cards.create_index([("coluna_id", 1), ("rank", 1)])
+    await db.kanban_colunas.create_index([("board_id", 1), ("rank", 1)])
+    await db.kanban_atividades.create_index([("card_id", 1), ("data", -1), ("id", -1)])
+    # Substituído pelo índice acima, que cobre também o desempate por id da paginação
+    if "card_id_1_data_-1" in await db.kanban_atividades.index_information():
+        await db.kanban_atividades.drop_index("card_id_1_data_-1")
+    await db.tarefas_marketing.create_index([("status", 1), ("data_hora", 1)])
+    await db.tarefas_marketing.create_index([("membro_id", 1), ("status", 1), ("concluida_em", 1)])
+    await db.pedidos_marketplace.create_index([("status", 1), ("prazo_entrega", 1)])
+    # Busca de pedidos: ordenações com desempate por id (cursor), prefixos e texto livre
+    await db.pedidos_marketplace.create_index([("projeto_id", 1), ("created_at", -1), ("id", -1)])
+    await db.pedidos_marketplace.create_index([("projeto_id", 1), ("prazo_entrega", 1), ("id", 1)])
+    await db.pedidos_marketplace.create_index([("projeto_id", 1), ("numero_pedido", 1), ("id", 1)])
+    await db.pedidos_marketplace.create_index([("projeto_id", 1), ("sku", 1)])
+    await criar_indice_texto_pedidos()
+
+@app.on_event("startup")
+async def semear_dados_referencia():
+    """Status e projetos padrão eram criados na primeira leitura; agora na inicialização"""
+    await semear_status_customizados()
+    await semear_projetos_marketplace()
+
+@app.on_event("startup")
+async def iniciar_outbox():
+    arquivados = await outbox.arquivar_falhas_existentes(db)
+    if arquivados:
+        print(f"📦 Outbox: {arquivados} evento(s) com falha movido(s) para outbox_falhas")
+    outbox.iniciar_worker(db)
+
+async def placar_apos_atraso(membro_id: str, grupos):
+    """Tarefas do membro viraram "Atrasado" no agendador: atualiza o placar"""
+    await placar_marketing.registrar_atrasos(db, membro_id, grupos)
+
+@app.on_event("startup")
+async def iniciar_agendador_tarefas():
+    tarefas_atrasadas.iniciar_agendador(db, ao_marcar=placar_apos_atraso)
+    pedidos_atrasados.iniciar_agendador(db)
+    placar_marketing.iniciar_reconciliacao(db)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await outbox.parar_worker()
+    await tarefas_atrasadas.parar_agendador()
+    await pedidos_atrasados.parar_agendador()
+    await placar_marketing.parar_reconciliacao()
+    imagens.encerrar_pool()
     client.close()
\ No newline at end of file
@@ -0,0 +1,78 @@
+"""
+Tarefas Atrasadas Module
+Agendador que marca como "Atrasado" as tarefas de marketing cujo prazo passou
+
+As rotas de leitura não escrevem mais no banco: um worker em background varre as
+tarefas pendentes vencidas (índice status + data_hora) uma vez por minuto e, entre
+as varreduras, dorme só até o próximo prazo, para que a tarefa vire "Atrasado"
+poucos segundos depois de vencer. Rotas que criam ou alteram tarefas chamam
+reagendar() para o worker recalcular o próximo prazo.
+"""
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from agendador_prazos import AgendadorPrazos, ler_prazo
+
+STATUS_PENDENTES = ["A Fazer", "Em Andamento"]
+STATUS_ATRASADO = "Atrasado"
+
+# Callback async (membro_id, [(status_anterior, quantidade), ...]) chamado após cada marcação
+AoMarcar = Callable[[str, List[Tuple[str, int]]], Awaitable[None]]
+
+def filtro_vencidas(agora: datetime) -> dict:
+    """Tarefas pendentes com prazo vencido (ainda não marcadas como atrasadas)"""
+    return {"status": {"$in": STATUS_PENDENTES}, "data_hora": {"$lt": agora}}
+
+async def marcar_tarefas_atrasadas(db, agora: Optional[datetime] = None) -> dict:
+    """
+    Marca as tarefas vencidas como atrasadas.
+    Um update_many por (membro, status anterior), para saber exatamente quantas
+    tarefas de cada membro mudaram. Retorna {membro_id: [(status_anterior, quantidade), ...]}.
+    """
+    agora = agora or datetime.now(timezone.utc)
+    filtro = filtro_vencidas(agora)
+    grupos = await db.tarefas_marketing.aggregate([
+        {"$match": filtro},
+        {"$group": {"_id": {"membro_id": "$membro_id", "status": "$status"}}}
+    ]).to_list(None)
+
+    marcadas = {}
+    for grupo in grupos:
+        membro_id, status_anterior = grupo['_id'].get('membro_id'), grupo['_id']['status']
+        resultado = await db.tarefas_marketing.update_many(
+            {**filtro, "membro_id": membro_id, "status": status_anterior},
+            {"$set": {"status": STATUS_ATRASADO, "updated_at": agora}}
+        )
+        if resultado.modified_count:
+            marcadas.setdefault(membro_id, []).append((status_anterior, resultado.modified_count))
+    return marcadas
+
+async def proximo_prazo(db, agora: datetime) -> Optional[datetime]:
+    """Prazo da próxima tarefa pendente a vencer"""
+    tarefa = await db.tarefas_marketing.find_one(
+        {"status": {"$in": STATUS_PENDENTES}, "data_hora": {"$gte": agora}},
+        {"_id": 0, "data_hora": 1},
+        sort=[("data_hora", 1)]
+    )
+    return ler_prazo(tarefa['data_hora']) if tarefa else None
+
+async def _varrer(db, agora: datetime, ao_marcar: Optional[AoMarcar]):
+    marcadas = await marcar_tarefas_atrasadas(db, agora)
+    if marcadas:
+        print(f"⏰ Tarefas marketing: {sum(q for grupos in marcadas.values() for _, q in grupos)} tarefa(s) marcada(s) como atrasada(s)")
+    if ao_marcar:
+        for membro_id, grupos in marcadas.items():
+            await ao_marcar(membro_id, grupos)
+
+_agendador = AgendadorPrazos("Tarefas marketing", _varrer, proximo_prazo)
+
+def reagendar():
+    """Acorda o agendador para recalcular o próximo prazo (tarefa criada ou alterada)"""
+    _agendador.reagendar()
+
+def iniciar_agendador(db, ao_marcar: Optional[AoMarcar] = None):
+    """Inicia o agendador no event loop da aplicação"""
+    _agendador.iniciar(db, ao_marcar)
+
+async def parar_agendador():
+    await _agendador.parar()
@@ -0,0 +1,178 @@
+"""
+Uploads Static Module
+Serviço dos arquivos de /uploads: miniaturas (?size=small|medium), ETags fortes,
+Cache-Control imutável para nomes com hash, requisições Range e pré-compressão
+gzip de anexos de texto
+"""
+import os
+import re
+import gzip
+import shutil
+import stat
+import tempfile
+import mimetypes
+from pathlib import Path
+from typing import Optional, Tuple
+
+import anyio
+from fastapi.staticfiles import StaticFiles
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response, StreamingResponse
+from starlette.types import Scope
+
+from cache_respostas import etag_confere
+from imagens import derivado_para_requisicao
+
+# Blobs e seus derivados têm o SHA-256 do conteúdo no nome: o conteúdo de uma URL nunca muda
+CACHE_IMUTAVEL = "public, max-age=31536000, immutable"
+CACHE_REVALIDAR = "no-cache"
+NOME_COM_HASH = re.compile(r'^[0-9a-f]{64}(\.|$)')
+
+# Pré-compressão gzip (arquivo .gz ao lado do original) para anexos de texto
+PRECOMPRIMIR = os.environ.get('UPLOADS_PRECOMPRIMIR', '1') == '1'
+TIPOS_COMPRIMIVEIS = ('text/', 'application/json', 'application/xml', 'application/javascript', 'image/svg+xml')
+TAMANHO_MINIMO_COMPRESSAO = 1024
+
+TAMANHO_CHUNK = 64 * 1024
+
+# Anexos que o navegador executaria como página (scripts) são sempre baixados, nunca exibidos
+TIPOS_SOMENTE_DOWNLOAD = ('text/html', 'application/xhtml+xml', 'image/svg+xml', 'text/xml', 'application/xml')
+
+def tem_nome_com_hash(caminho: Path) -> bool:
+    return bool(NOME_COM_HASH.match(caminho.name))
+
+def calcular_etag(caminho: Path, stat_result: os.stat_result) -> str:
+    """ETag forte: o próprio hash quando está no nome do arquivo, senão tamanho + mtime em ns
+    (os arquivos de /uploads são sempre gravados por troca atômica, nunca editados no lugar)"""
+    if tem_nome_com_hash(caminho):
+        return f'"{caminho.name}"'
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+def interpretar_range(cabecalho: str, tamanho: int) -> Optional[Tuple[int, int]]:
+    """Interpreta um Range "bytes=inicio-fim" (um único intervalo).
+    Retorna (inicio, fim) inclusivos, ou None se o intervalo não puder ser atendido."""
+    unidade, _, intervalos = cabecalho.partition('=')
+    if unidade.strip() != 'bytes' or tamanho == 0:
+        return None
+    inicio_txt, _, fim_txt = intervalos.strip().partition('-')
+    try:
+        if not inicio_txt:
+            # Sufixo: últimos N bytes
+            sufixo = int(fim_txt)
+            if sufixo <= 0:
+                return None
+            return max(tamanho - sufixo, 0), tamanho - 1
+        inicio = int(inicio_txt)
+        fim = int(fim_txt) if fim_txt else tamanho - 1
+    except ValueError:
+        return None
+    if inicio > fim or inicio >= tamanho:
+        return None
+    return inicio, min(fim, tamanho - 1)
+
+def _gerar_gzip(caminho: Path, destino: Path):
+    """Comprime em um temporário exclusivo: requisições simultâneas ao mesmo arquivo
+    não escrevem no mesmo .tmp, e a troca atômica deixa o .gz de quem terminar por último"""
+    fd, temporario = tempfile.mkstemp(dir=destino.parent, prefix=destino.name + '.', suffix='.tmp')
+    try:
+        with open(caminho, 'rb') as origem, os.fdopen(fd, 'wb') as arquivo, \
+                gzip.GzipFile(filename=caminho.name, fileobj=arquivo, mode='wb', compresslevel=9) as saida:
+            shutil.copyfileobj(origem, saida)
+        os.replace(temporario, destino)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.unlink(temporario)
+        raise
+
+class UploadsStaticFiles(StaticFiles):
+    """StaticFiles com miniaturas, validadores fortes, Range e pré-compressão"""
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+
+        full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path)
+        if not (stat_result and stat.S_ISREG(stat_result.st_mode)):
+            # Diretórios e arquivos inexistentes seguem o tratamento padrão (404)
+            return await super().get_response(path, scope)
+
+        request = Request(scope)
+        caminho = Path(full_path)
+        headers = {"Accept-Ranges": "bytes", "X-Content-Type-Options": "nosniff"}
+        imutavel = tem_nome_com_hash(caminho)
+
+        tamanho = request.query_params.get('size')
+        if tamanho:
+            headers["Vary"] = "Accept"
+            derivado = derivado_para_requisicao(caminho, tamanho, request.headers.get('accept', ''))
+            if derivado is not None:
+                caminho = derivado
+                stat_result = await anyio.to_thread.run_sync(os.stat, caminho)
+            else:
+                # Miniatura ainda não gerada: o original não pode ficar em cache nesta URL
+                imutavel = False
+
+        headers["Cache-Control"] = CACHE_IMUTAVEL if imutavel else CACHE_REVALIDAR
+        return await self.responder_arquivo(request, caminho, stat_result, headers)
+
+    async def responder_arquivo(self, request: Request, caminho: Path, stat_result: os.stat_result, headers: dict) -> Response:
+        etag = calcular_etag(caminho, stat_result)
+        media_type = mimetypes.guess_type(caminho.name)[0] or 'application/octet-stream'
+        if media_type in TIPOS_SOMENTE_DOWNLOAD:
+            headers["Content-Disposition"] = "attachment"
+        comprimivel = PRECOMPRIMIR and media_type.startswith(TIPOS_COMPRIMIVEIS) and stat_result.st_size >= TAMANHO_MINIMO_COMPRESSAO
+        if comprimivel:
+            headers["Vary"] = ", ".join(filter(None, [headers.get("Vary"), "Accept-Encoding"]))
+
+        usar_gzip = comprimivel and 'gzip' in request.headers.get('accept-encoding', '')
+        cabecalho_range = request.headers.get('range')
+        if cabecalho_range and (',' in cabecalho_range or
+                                (request.headers.get('if-range') and request.headers['if-range'] != etag)):
+            # Múltiplos intervalos não são suportados, e If-Range divergente indica que o
+            # arquivo mudou desde o download parcial: nos dois casos envia o arquivo inteiro
+            cabecalho_range = None
+        if cabecalho_range:
+            usar_gzip = False
+        if usar_gzip:
+            etag = etag[:-1] + '-gzip"'
+        headers["ETag"] = etag
+
+        if etag_confere(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers=headers)
+
+        if cabecalho_range:
+            return await self.responder_intervalo(request, caminho, stat_result.st_size, cabecalho_range, headers, media_type)
+
+        if usar_gzip:
+            comprimido = caminho.with_name(caminho.name + '.gz')
+            if not comprimido.exists():
+                await anyio.to_thread.run_sync(_gerar_gzip, caminho, comprimido)
+            headers["Content-Encoding"] = "gzip"
+            return FileResponse(comprimido, headers=headers, media_type=media_type, method=request.method)
+
+        return FileResponse(caminho, stat_result=stat_result, headers=headers, media_type=media_type, method=request.method)
+
+    async def responder_intervalo(self, request: Request, caminho: Path, tamanho_total: int, cabecalho_range: str, headers: dict, media_type: str) -> Response:
+        intervalo = interpretar_range(cabecalho_range, tamanho_total)
+        if intervalo is None:
+            headers["Content-Range"] = f"bytes */{tamanho_total}"
+            return Response(status_code=416, headers=headers)
+
+        inicio, fim = intervalo
+        headers["Content-Range"] = f"bytes {inicio}-{fim}/{tamanho_total}"
+        headers["Content-Length"] = str(fim - inicio + 1)
+        if request.method == "HEAD":
+            return Response(status_code=206, headers=headers, media_type=media_type)
+
+        async def ler_intervalo():
+            restante = fim - inicio + 1
+            async with await anyio.open_file(caminho, 'rb') as arquivo:
+                await arquivo.seek(inicio)
+                while restante > 0:
+                    chunk = await arquivo.read(min(TAMANHO_CHUNK, restante))
+                    if not chunk:
+                        break
+                    restante -= len(chunk)
+                    yield chunk
+
+        return StreamingResponse(ler_intervalo(), status_code=206, headers=headers, media_type=media_type)
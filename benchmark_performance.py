@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Benchmarks de performance dos endpoints mais pesados do backend.
+
+Popula o MongoDB diretamente (MONGO_URL / DB_NAME do backend/.env) com documentos
+marcados com "benchmark": True, mede o tempo de resposta dos endpoints (primeira
+chamada e chamadas seguintes, já com cache) e remove os documentos ao final.
+
+Uso:
+    python benchmark_performance.py [relatorio_taxas] [kanban_board] [dashboard_marketing] [pedidos_marketplace]
+"""
+
+import os
+import sys
+import time
+import uuid
+import json
+import random
+import requests
+from datetime import datetime, timedelta, timezone
+from pymongo import MongoClient
+from dotenv import load_dotenv
+
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', '.env'))
+
+
+class PerformanceBenchmark:
+    def __init__(self, base_url=os.environ.get('BACKEND_URL', 'http://localhost:8001')):
+        self.base_url = base_url
+        self.api_url = f"{base_url}/api"
+        self.token = None
+        self.client = MongoClient(os.environ['MONGO_URL'])
+        self.db = self.client[os.environ.get('DB_NAME', 'gestao_manufatura')]
+        self.results = []
+
+    def authenticate(self):
+        """Autentica como diretor"""
+        response = requests.post(f"{self.api_url}/auth/login", json={"username": "diretor", "password": "123"})
+        if response.status_code != 200:
+            print(f"❌ Falha no login: {response.status_code}")
+            return False
+        self.token = response.json()['token']
+        return True
+
+    def inserir_em_lotes(self, colecao, gerar_documento, total, lote=5000):
+        """Insere `total` documentos gerados por gerar_documento(i) em lotes"""
+        for inicio in range(0, total, lote):
+            self.db[colecao].insert_many([gerar_documento(i) for i in range(inicio, min(inicio + lote, total))])
+
+    def limpar(self, colecao):
+        removidos = self.db[colecao].delete_many({"benchmark": True}).deleted_count
+        print(f"🧹 {colecao}: {removidos} documentos de benchmark removidos")
+
+    def medir(self, nome, caminho, params=None, repeticoes=5):
+        """Mede a primeira chamada (fria) e a média das chamadas seguintes"""
+        headers = {'Authorization': f'Bearer {self.token}'}
+        tempos = []
+        tamanho = 0
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            response = requests.get(f"{self.api_url}{caminho}", params=params, headers=headers)
+            tempos.append((time.perf_counter() - inicio) * 1000)
+            if response.status_code != 200:
+                print(f"❌ {nome}: HTTP {response.status_code} - {response.text[:200]}")
+                return None
+            tamanho = len(response.content)
+
+        resultado = {
+            'nome': nome,
+            'primeira_ms': tempos[0],
+            'seguintes_ms': sum(tempos[1:]) / max(len(tempos) - 1, 1),
+            'bytes': tamanho
+        }
+        self.results.append(resultado)
+        print(f"⏱️  {nome}: primeira {resultado['primeira_ms']:.0f} ms | "
+              f"seguintes {resultado['seguintes_ms']:.0f} ms | {tamanho} bytes")
+        return resultado
+
+    # ============= RELATÓRIO DE TAXAS =============
+
+    def benchmark_relatorio_taxas(self, total=200_000):
+        """GET /gestao/financeiro/relatorio-taxas sobre 200k pedidos"""
+        print(f"\n📊 Relatório de taxas - populando {total} pedidos...")
+        lojas = ['fabrica', 'mandaqui', 'lapa', 'tucuruvi']
+        formas = ['Crédito 1x', 'Crédito 3x', 'Crédito 10x', 'Débito', 'PIX', 'Boleto']
+        bancos = ['Itaú', 'Bradesco', 'Santander', 'Stone']
+        inicio_periodo = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+        def gerar_pedido(i):
+            valor_bruto = round(random.uniform(50, 5000), 2)
+            taxa = round(valor_bruto * random.uniform(0, 0.05), 2)
+            return {
+                "id": str(uuid.uuid4()),
+                "numero_pedido": 900000 + i,
+                "benchmark": True,
+                "loja_id": random.choice(lojas),
+                "data_abertura": inicio_periodo + timedelta(minutes=random.randint(0, 365 * 24 * 60)),
+                "forma_pagamento_id": str(uuid.uuid4()),
+                "forma_pagamento_nome": random.choice(formas),
+                "forma_pagamento_parcelas": random.choice([1, 1, 2, 3, 6, 10]),
+                "conta_bancaria_nome": random.choice(bancos),
+                "valor_bruto": valor_bruto,
+                "taxa_valor_real": taxa,
+                "valor_liquido_empresa": valor_bruto - taxa,
+                "status": "Criado"
+            }
+
+        self.inserir_em_lotes('pedidos_manufatura', gerar_pedido, total)
+        try:
+            self.medir("relatorio-taxas (ano, todas as lojas)", "/gestao/financeiro/relatorio-taxas",
+                       {"data_inicio": "2025-01-01T00:00:00", "data_fim": "2025-12-31T23:59:59"})
+            self.medir("relatorio-taxas (ano, loja mandaqui)", "/gestao/financeiro/relatorio-taxas",
+                       {"data_inicio": "2025-01-01T00:00:00", "data_fim": "2025-12-31T23:59:59", "loja": "mandaqui"})
+        finally:
+            self.limpar('pedidos_manufatura')
+
+    # ============= QUADRO KANBAN =============
+
+    def benchmark_kanban_board(self, total_cards=500, total_atividades=10_000):
+        """GET /kanban/cards de um board com 10k atividades acumuladas nos cards"""
+        print(f"\n📋 Quadro kanban - populando {total_cards} cards e {total_atividades} atividades...")
+        board_id = f"benchmark-{uuid.uuid4()}"
+        coluna_id = str(uuid.uuid4())
+        agora = datetime.now(timezone.utc)
+        self.db.kanban_colunas.insert_one({
+            "id": coluna_id, "titulo": "Benchmark", "board_id": board_id, "rank": "i", "benchmark": True
+        })
+        card_ids = [str(uuid.uuid4()) for _ in range(total_cards)]
+
+        def gerar_card(i):
+            return {
+                "id": card_ids[i],
+                "benchmark": True,
+                "titulo": f"Card benchmark {i}",
+                "descricao": "Descrição do card " * 10,
+                "coluna_id": coluna_id,
+                "rank": f"{i + 1:06d}",
+                "labels": [{"color": "blue", "name": "Benchmark"}],
+                "assignees": ["diretor"],
+                "checklist": [{"id": str(uuid.uuid4()), "texto": "Item", "concluido": bool(j % 2)} for j in range(5)],
+                "comentarios": [],
+                "anexos": [],
+                "arquivado": False,
+                "created_at": agora,
+                "updated_at": agora
+            }
+
+        def gerar_atividade(i):
+            return {
+                "id": str(uuid.uuid4()),
+                "benchmark": True,
+                "card_id": card_ids[i % total_cards],
+                "tipo": "atualizou_descricao",
+                "descricao": "Atualizou a descrição do card",
+                "usuario": "diretor",
+                "data": agora - timedelta(minutes=i)
+            }
+
+        self.inserir_em_lotes('kanban_cards', gerar_card, total_cards)
+        self.inserir_em_lotes('kanban_atividades', gerar_atividade, total_atividades)
+        try:
+            resultado = self.medir("kanban cards (board com 10k atividades)", "/kanban/cards", {"board_id": board_id})
+            # Referência: bytes que as mesmas atividades somariam embutidas no payload do board
+            embutidas = sum(
+                len(json.dumps({**gerar_atividade(i), "data": agora.isoformat()})) for i in range(total_atividades)
+            )
+            if resultado:
+                print(f"   atividades embutidas no card somariam ~{embutidas} bytes "
+                      f"({(resultado['bytes'] + embutidas) / max(resultado['bytes'], 1):.1f}x o payload atual)")
+            self.medir("atividades de um card", f"/kanban/cards/{card_ids[0]}/atividades")
+        finally:
+            self.limpar('kanban_atividades')
+            self.limpar('kanban_cards')
+            self.limpar('kanban_colunas')
+
+    # ============= DASHBOARD DE MARKETING =============
+
+    def benchmark_dashboard_marketing(self, total_membros=50, total_tarefas=100_000):
+        """GET /gestao/marketing/dashboard com 50 membros e 100k tarefas"""
+        print(f"\n📣 Dashboard de marketing - populando {total_membros} membros e {total_tarefas} tarefas...")
+        agora = datetime.now(timezone.utc)
+        membros = [{
+            "id": str(uuid.uuid4()),
+            "benchmark": True,
+            "nome": f"Membro benchmark {i}",
+            "funcao": "Designer",
+            "pontuacao": random.randint(0, 500),
+            "ativo": True
+        } for i in range(total_membros)]
+        self.db.membros_marketing.insert_many(membros)
+
+        def gerar_tarefa(i):
+            status = random.choice(["A Fazer", "Em Andamento", "Concluído", "Concluído", "Atrasado"])
+            data_hora = agora + timedelta(minutes=random.randint(-90 * 24 * 60, 30 * 24 * 60))
+            tarefa = {
+                "id": str(uuid.uuid4()),
+                "benchmark": True,
+                "titulo": f"Tarefa benchmark {i}",
+                "membro_id": random.choice(membros)["id"],
+                "status": status,
+                "prioridade": "Média",
+                "data_hora": data_hora
+            }
+            if status == "Concluído":
+                tarefa["concluida_em"] = min(data_hora + timedelta(hours=random.randint(-48, 48)), agora)
+                tarefa["pontos_ganhos"] = random.choice([15, 10, -5])
+            return tarefa
+
+        self.inserir_em_lotes('tarefas_marketing', gerar_tarefa, total_tarefas)
+        try:
+            # A primeira chamada mostra a agregação; as seguintes, o cache curto do dashboard
+            self.medir("dashboard marketing (50 membros, 100k tarefas)", "/gestao/marketing/dashboard")
+        finally:
+            self.limpar('tarefas_marketing')
+            self.limpar('membros_marketing')
+
+    # ============= PEDIDOS DE MARKETPLACE =============
+
+    def benchmark_pedidos_marketplace(self, total=10_000):
+        """GET /gestao/marketplaces/pedidos de um projeto com 10k pedidos (serialização da lista)"""
+        print(f"\n🛍️ Pedidos de marketplace - populando {total} pedidos...")
+        projeto_id = f"benchmark-{uuid.uuid4()}"
+        agora = datetime.now(timezone.utc)
+        status = ["Aguardando Produção", "Em Produção", "Pronto", "Embalagem", "Enviado", "Entregue"]
+
+        def gerar_pedido(i):
+            criado_em = agora - timedelta(minutes=random.randint(0, 60 * 24 * 60))
+            quantidade = random.randint(1, 3)
+            valor_unitario = round(random.uniform(30, 400), 2)
+            return {
+                "id": str(uuid.uuid4()),
+                "benchmark": True,
+                "projeto_id": projeto_id,
+                "plataforma": "shopee",
+                "numero_pedido": f"BENCH{i:08d}",
+                "sku": f"MOLD-{random.randint(1, 500):04d}",
+                "cliente_nome": f"Cliente benchmark {i}",
+                "produto_nome": "Moldura benchmark 30x40",
+                "nome_variacao": random.choice(["Preta", "Branca", "Madeira"]),
+                "quantidade": quantidade,
+                "valor_unitario": valor_unitario,
+                "valor_total": round(quantidade * valor_unitario, 2),
+                "tipo_envio": random.choice(["Flex Shopee", "Coleta"]),
+                "status": random.choice(status),
+                "status_producao": "Aguardando",
+                "status_logistica": "Aguardando",
+                "status_montagem": "Aguardando Montagem",
+                "prazo_entrega": criado_em + timedelta(days=random.randint(1, 10)),
+                "data_prevista_envio": criado_em + timedelta(days=2),
+                "atrasado": False,
+                "created_at": criado_em,
+                "updated_at": criado_em
+            }
+
+        self.inserir_em_lotes('pedidos_marketplace', gerar_pedido, total)
+        try:
+            self.medir(f"pedidos marketplace ({total // 1000}k pedidos)", "/gestao/marketplaces/pedidos",
+                       {"projeto_id": projeto_id})
+        finally:
+            self.limpar('pedidos_marketplace')
+
+    def run(self, selecionados=None):
+        if not self.authenticate():
+            return False
+
+        benchmarks = {
+            'relatorio_taxas': self.benchmark_relatorio_taxas,
+            'kanban_board': self.benchmark_kanban_board,
+            'dashboard_marketing': self.benchmark_dashboard_marketing,
+            'pedidos_marketplace': self.benchmark_pedidos_marketplace,
+        }
+        for nome, benchmark in benchmarks.items():
+            if not selecionados or nome in selecionados:
+                benchmark()
+
+        print("\n" + "=" * 60)
+        print("📈 RESUMO")
+        for r in self.results:
+            print(f"  {r['nome']}: {r['primeira_ms']:.0f} ms → {r['seguintes_ms']:.0f} ms ({r['bytes']} bytes)")
+        self.client.close()
+        return True
+
+
+if __name__ == "__main__":
+    PerformanceBenchmark().run(sys.argv[1:])
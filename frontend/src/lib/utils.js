@@ -4,3 +4,15 @@ import { twMerge } from "tailwind-merge"
 export function cn(...inputs) {
   return twMerge(clsx(inputs));
 }
+
+// Arquivos de /uploads são servidos pelo backend: URLs relativas ganham o endereço dele
+export function urlUpload(url) {
+  if (!url || !url.startsWith("/uploads/")) return url;
+  return `${process.env.REACT_APP_BACKEND_URL || ""}${url}`;
+}
+
+// Miniatura de uma imagem servida em /uploads (small | medium); outras URLs ficam como estão
+export function urlMiniatura(url, tamanho = "small") {
+  if (!url || !url.startsWith("/uploads/")) return url;
+  return `${urlUpload(url)}?size=${tamanho}`;
+}
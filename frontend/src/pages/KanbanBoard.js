@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { DragDropContext, Droppable, Draggable } from 'react-beautiful-dnd';
 import axios from 'axios';
 import { toast } from 'sonner';
+import { urlMiniatura, urlUpload } from '../lib/utils';
 import { Plus, X, Edit2, Trash2, MoreVertical, Tag, Calendar, CheckSquare, MessageSquare, Clock, User, Paperclip, Copy, Archive, ArrowRight, Activity } from 'lucide-react';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
@@ -27,6 +28,9 @@ export default function KanbanBoard() {
   const [cardSelecionado, setCardSelecionado] = useState(null);
   const [colunaIdParaNovoCard, setColunaIdParaNovoCard] = useState(null);
   const [abaAtiva, setAbaAtiva] = useState('detalhes'); // detalhes, atividades
+  const [atividadesCard, setAtividadesCard] = useState([]);
+  const [temMaisAtividades, setTemMaisAtividades] = useState(false);
+  const [carregandoAtividades, setCarregandoAtividades] = useState(false);
 
   // Form states
   const [formColuna, setFormColuna] = useState({ titulo: '', cor: null });
@@ -119,7 +123,7 @@ export default function KanbanBoard() {
       colunasResponse.data.forEach(col => {
         cardsOrganizados[col.id] = cardsResponse.data
           .filter(card => card.coluna_id === col.id && !card.arquivado)
-          .sort((a, b) => a.posicao - b.posicao);
+          .sort((a, b) => (a.rank < b.rank ? -1 : a.rank > b.rank ? 1 : 0));
       });
       
       setCards(cardsOrganizados);
@@ -139,12 +143,17 @@ export default function KanbanBoard() {
       const novasColunas = Array.from(colunas);
       const [removed] = novasColunas.splice(source.index, 1);
       novasColunas.splice(destination.index, 0, removed);
-      const colunasComPosicao = novasColunas.map((col, index) => ({ id: col.id, posicao: index }));
       setColunas(novasColunas);
 
       try {
         const token = localStorage.getItem('token');
-        await axios.post(`${BACKEND_URL}/api/kanban/colunas/reordenar`, { colunas: colunasComPosicao }, { headers: { Authorization: `Bearer ${token}` } });
+        // Só a coluna movida é gravada: o backend calcula o rank entre as vizinhas
+        await axios.post(`${BACKEND_URL}/api/kanban/colunas/reordenar`, {
+          coluna_id: removed.id,
+          coluna_anterior_id: novasColunas[destination.index - 1]?.id || null,
+          coluna_posterior_id: novasColunas[destination.index + 1]?.id || null,
+          nova_posicao: destination.index
+        }, { headers: { Authorization: `Bearer ${token}` } });
       } catch (error) {
         toast.error('Erro ao reordenar colunas');
         carregarDados();
@@ -152,15 +161,17 @@ export default function KanbanBoard() {
     } else {
       const colunaOrigemId = source.droppableId;
       const colunaDestinoId = destination.droppableId;
+      let cardsDestino;
 
       if (colunaOrigemId === colunaDestinoId) {
         const novosCards = Array.from(cards[colunaOrigemId]);
         const [cardMovido] = novosCards.splice(source.index, 1);
         novosCards.splice(destination.index, 0, cardMovido);
+        cardsDestino = novosCards;
         setCards({ ...cards, [colunaOrigemId]: novosCards });
       } else {
         const cardsOrigem = Array.from(cards[colunaOrigemId]);
-        const cardsDestino = Array.from(cards[colunaDestinoId] || []);
+        cardsDestino = Array.from(cards[colunaDestinoId] || []);
         const [cardMovido] = cardsOrigem.splice(source.index, 1);
         cardsDestino.splice(destination.index, 0, cardMovido);
         setCards({ ...cards, [colunaOrigemId]: cardsOrigem, [colunaDestinoId]: cardsDestino });
@@ -169,7 +180,14 @@ export default function KanbanBoard() {
       try {
         const token = localStorage.getItem('token');
         const cardId = cards[colunaOrigemId][source.index].id;
-        await axios.post(`${BACKEND_URL}/api/kanban/cards/mover`, { card_id: cardId, coluna_destino_id: colunaDestinoId, nova_posicao: destination.index }, { headers: { Authorization: `Bearer ${token}` } });
+        // Só o card movido é gravado: o backend calcula o rank entre os vizinhos
+        await axios.post(`${BACKEND_URL}/api/kanban/cards/mover`, {
+          card_id: cardId,
+          coluna_destino_id: colunaDestinoId,
+          nova_posicao: destination.index,
+          card_anterior_id: cardsDestino[destination.index - 1]?.id || null,
+          card_posterior_id: cardsDestino[destination.index + 1]?.id || null
+        }, { headers: { Authorization: `Bearer ${token}` } });
       } catch (error) {
         toast.error('Erro ao mover card');
         carregarDados();
@@ -560,6 +578,33 @@ export default function KanbanBoard() {
     }
   };
 
+  // Atividades ficam fora do card: carregadas só quando a aba é aberta, em páginas
+  const LIMITE_ATIVIDADES = 50;
+  const carregarAtividades = async (cardId, ultima = null) => {
+    try {
+      setCarregandoAtividades(true);
+      const token = localStorage.getItem('token');
+      const params = { limite: LIMITE_ATIVIDADES };
+      if (ultima) {
+        params.antes = ultima.data;
+        params.antes_id = ultima.id;
+      }
+      const response = await axios.get(`${BACKEND_URL}/api/kanban/cards/${cardId}/atividades`, { params, headers: { Authorization: `Bearer ${token}` } });
+      setAtividadesCard(atuais => ultima ? [...atuais, ...response.data] : response.data);
+      setTemMaisAtividades(response.data.length === LIMITE_ATIVIDADES);
+    } catch (error) {
+      toast.error('Erro ao carregar atividades');
+    } finally {
+      setCarregandoAtividades(false);
+    }
+  };
+
+  useEffect(() => {
+    if (cardDetalheAberto && abaAtiva === 'atividades' && cardSelecionado) {
+      carregarAtividades(cardSelecionado.id);
+    }
+  }, [cardDetalheAberto, abaAtiva, cardSelecionado]);
+
   const abrirDetalheCard = async (card) => {
     try {
       const token = localStorage.getItem('token');
@@ -867,7 +912,7 @@ export default function KanbanBoard() {
                                       {(card.capa_url || card.capa_cor) && (
                                         <div className="w-full h-32 -mt-0 -mx-0 mb-2">
                                           {card.capa_url ? (
-                                            <img src={card.capa_url} alt="Capa" className="w-full h-full object-cover" />
+                                            <img src={urlMiniatura(card.capa_url)} alt="Capa" className="w-full h-full object-cover" />
                                           ) : (
                                             <div className="w-full h-full" style={{ backgroundColor: card.capa_cor }} />
                                           )}
@@ -900,22 +945,22 @@ export default function KanbanBoard() {
                                             <span>{card.assignees.length}</span>
                                           </div>
                                         )}
-                                        {card.checklist && card.checklist.length > 0 && (
+                                        {card.total_checklist > 0 && (
                                           <div className="flex items-center gap-1">
                                             <CheckSquare className="w-3 h-3" />
-                                            <span>{card.checklist.filter(i => i.concluido).length}/{card.checklist.length}</span>
+                                            <span>{card.checklist_concluidos}/{card.total_checklist}</span>
                                           </div>
                                         )}
-                                        {card.anexos && card.anexos.length > 0 && (
+                                        {card.total_anexos > 0 && (
                                           <div className="flex items-center gap-1">
                                             <Paperclip className="w-3 h-3" />
-                                            <span>{card.anexos.length}</span>
+                                            <span>{card.total_anexos}</span>
                                           </div>
                                         )}
-                                        {card.comentarios && card.comentarios.length > 0 && (
+                                        {card.total_comentarios > 0 && (
                                           <div className="flex items-center gap-1">
                                             <MessageSquare className="w-3 h-3" />
-                                            <span>{card.comentarios.length}</span>
+                                            <span>{card.total_comentarios}</span>
                                           </div>
                                         )}
                                         {card.data_vencimento && (
@@ -1035,7 +1080,7 @@ export default function KanbanBoard() {
               <div className="flex border-b mb-4">
                 <button onClick={() => setAbaAtiva('detalhes')} className={`px-4 py-2 font-medium ${abaAtiva === 'detalhes' ? 'text-indigo-600 border-b-2 border-indigo-600' : 'text-gray-600'}`}>Detalhes</button>
                 <button onClick={() => setAbaAtiva('atividades')} className={`px-4 py-2 font-medium ${abaAtiva === 'atividades' ? 'text-indigo-600 border-b-2 border-indigo-600' : 'text-gray-600'}`}>
-                  Atividades {cardSelecionado.atividades && cardSelecionado.atividades.length > 0 && `(${cardSelecionado.atividades.length})`}
+                  Atividades {cardSelecionado.total_atividades > 0 && `(${cardSelecionado.total_atividades})`}
                 </button>
               </div>
 
@@ -1137,7 +1182,7 @@ export default function KanbanBoard() {
                             <div className="flex items-center gap-3">
                               <Paperclip className="w-4 h-4 text-gray-600" />
                               <div>
-                                <a href={anexo.url} target="_blank" rel="noopener noreferrer" className="text-sm font-medium text-indigo-600 hover:underline">{anexo.nome}</a>
+                                <a href={urlUpload(anexo.url)} target="_blank" rel="noopener noreferrer" className="text-sm font-medium text-indigo-600 hover:underline">{anexo.nome}</a>
                                 <p className="text-xs text-gray-500">Adicionado em {new Date(anexo.data).toLocaleDateString('pt-BR')}</p>
                               </div>
                             </div>
@@ -1309,8 +1354,8 @@ export default function KanbanBoard() {
 
               {abaAtiva === 'atividades' && (
                 <div className="space-y-3">
-                  {cardSelecionado.atividades && cardSelecionado.atividades.length > 0 ? (
-                    cardSelecionado.atividades.map((atividade) => (
+                  {atividadesCard.length > 0 ? (
+                    atividadesCard.map((atividade) => (
                       <div key={atividade.id} className="flex gap-3 p-3 bg-gray-50 rounded-lg">
                         <Activity className="w-5 h-5 text-gray-600 flex-shrink-0" />
                         <div>
@@ -1324,6 +1369,15 @@ export default function KanbanBoard() {
                   ) : (
                     <p className="text-gray-500 text-sm">Nenhuma atividade registrada</p>
                   )}
+                  {temMaisAtividades && (
+                    <button
+                      onClick={() => carregarAtividades(cardSelecionado.id, atividadesCard[atividadesCard.length - 1])}
+                      disabled={carregandoAtividades}
+                      className="w-full py-2 text-sm text-indigo-600 hover:bg-indigo-50 rounded disabled:opacity-50"
+                    >
+                      {carregandoAtividades ? 'Carregando...' : 'Carregar atividades anteriores'}
+                    </button>
+                  )}
                 </div>
               )}
             </div>
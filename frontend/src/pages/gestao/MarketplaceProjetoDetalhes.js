@@ -227,6 +227,42 @@ export default function MarketplaceProjetoDetalhes() {
     tarifas_envio: 0
   });
 
+  // 🔍 Filtros de setor/status são aplicados no servidor (/pedidos/busca, paginada por cursor).
+  // Sem nenhum deles a tela carrega a lista completa do projeto (kanban e visão por setor).
+  // Busca universal e SKU ficam no cliente (pedidosFiltrados): casam trechos em qualquer posição,
+  // sem diferenciar maiúsculas, o que o índice de texto e os prefixos do servidor não fazem.
+  const carregarPedidos = async (headers) => {
+    const params = new URLSearchParams({ projeto_id: projetoId });
+    if (filtros.status) params.append('status', filtros.status);
+    if (filtros.atrasado !== null && filtros.atrasado !== undefined) params.append('atrasado', filtros.atrasado);
+    
+    const filtrosServidor = {
+      status_producao: filtros.setor,
+      status_logistica: filtros.statusProducao || filtros.status_producao,
+      status_montagem: filtros.status_montagem
+    };
+    const ativos = Object.entries(filtrosServidor).filter(([, valor]) => valor);
+    if (ativos.length === 0) {
+      const response = await axios.get(`${API}/pedidos?${params}`, { headers });
+      return response.data || [];
+    }
+    
+    ativos.forEach(([campo, valor]) => params.append(campo, valor));
+    params.append('limite', '500');
+    // A tela não exibe as contagens por faceta: evita o $facet em cada polling
+    params.append('facetas', 'false');
+    const encontrados = [];
+    let cursor = null;
+    do {
+      const pagina = new URLSearchParams(params);
+      if (cursor) pagina.append('cursor', cursor);
+      const response = await axios.get(`${API}/pedidos/busca?${pagina}`, { headers });
+      encontrados.push(...response.data.pedidos);
+      cursor = response.data.proximo_cursor;
+    } while (cursor);
+    return encontrados;
+  };
+
   useEffect(() => {
     fetchDados();
     fetchStatusCustomizados();
@@ -256,12 +292,7 @@ export default function MarketplaceProjetoDetalhes() {
         const headers = { Authorization: `Bearer ${token}` };
         
         // Buscar pedidos atualizados
-        let url = `${API}/pedidos?projeto_id=${projetoId}`;
-        if (filtros.status) url += `&status=${filtros.status}`;
-        if (filtros.atrasado !== null) url += `&atrasado=${filtros.atrasado}`;
-        
-        const response = await axios.get(url, { headers });
-        const novosPedidos = response.data || [];
+        const novosPedidos = await carregarPedidos(headers);
         
         // Detectar mudanças comparando com estado anterior
         const pedidosAnteriores = pedidosRef.current;
@@ -414,12 +445,7 @@ export default function MarketplaceProjetoDetalhes() {
       setProjeto(projetoEncontrado);
 
       // Buscar pedidos
-      let url = `${API}/pedidos?projeto_id=${projetoId}`;
-      if (filtros.status) url += `&status=${filtros.status}`;
-      if (filtros.atrasado !== null) url += `&atrasado=${filtros.atrasado}`;
-      
-      const pedidosRes = await axios.get(url, { headers });
-      setPedidos(pedidosRes.data || []);
+      setPedidos(await carregarPedidos(headers));
     } catch (error) {
       console.error('Erro ao buscar dados:', error);
       if (showLoading) {
@@ -437,9 +463,9 @@ export default function MarketplaceProjetoDetalhes() {
       const token = localStorage.getItem('token');
       const pedido = pedidos.find(p => p.id === pedidoId);
       
-      await axios.put(
+      await axios.patch(
         `${API}/pedidos/${pedidoId}`,
-        { ...pedido, status: novoStatus },
+        { status: novoStatus, version: pedido?.version },
         { headers: { Authorization: `Bearer ${token}` } }
       );
       
@@ -447,7 +473,8 @@ export default function MarketplaceProjetoDetalhes() {
       fetchDados();
     } catch (error) {
       console.error('Erro ao atualizar status:', error);
-      toast.error('Erro ao atualizar status');
+      toast.error(error.response?.status === 409 ? error.response.data.detail.message : 'Erro ao atualizar status');
+      if (error.response?.status === 409) fetchDados();
     }
   };
 
@@ -716,20 +743,15 @@ export default function MarketplaceProjetoDetalhes() {
       
       if (!pedido) return;
       
-      const pedidoAtualizado = {
-        ...pedido,
-        [campo]: valor,
-        updated_at: new Date().toISOString()
-      };
-      
-      await axios.put(
+      // PATCH só do campo editado, com a version lida: 409 se outro usuário alterou o pedido
+      const response = await axios.patch(
         `${API}/pedidos/${pedidoId}`,
-        pedidoAtualizado,
+        { [campo]: valor, version: pedido.version },
         { headers: { Authorization: `Bearer ${token}` } }
       );
       
-      // Atualizar local
-      setPedidos(pedidos.map(p => p.id === pedidoId ? pedidoAtualizado : p));
+      // Atualizar local com o que o servidor gravou (nova version e datas carimbadas)
+      setPedidos(atuais => atuais.map(p => p.id === pedidoId ? { ...p, ...response.data } : p));
       
       // 🎓 APRENDIZADO: Se usuário mudou manualmente o setor, registrar feedback para IA aprender
       if (campo === 'status_producao' && pedido.status_producao !== valor) {
@@ -758,7 +780,12 @@ export default function MarketplaceProjetoDetalhes() {
       
     } catch (error) {
       console.error('Erro ao atualizar pedido:', error);
-      toast.error('Erro ao atualizar pedido');
+      if (error.response?.status === 409) {
+        toast.error(error.response.data.detail.message);
+        fetchDados();
+      } else {
+        toast.error('Erro ao atualizar pedido');
+      }
     }
   };
 
@@ -902,19 +929,10 @@ export default function MarketplaceProjetoDetalhes() {
       // Atualizar cada pedido selecionado
       await Promise.all(
         selectedPedidos.map(async (pedidoId) => {
-          // Buscar o pedido completo primeiro
-          const response = await axios.get(`${API}/pedidos/${pedidoId}`, {
-            headers: { Authorization: `Bearer ${token}` }
-          });
-          const pedido = response.data;
-          
-          // Atualizar o campo específico
-          pedido[campo] = valor;
-          
-          // Enviar atualização completa
-          return axios.put(
+          // Só o campo alterado: não regrava o restante do pedido
+          return axios.patch(
             `${API}/pedidos/${pedidoId}`,
-            pedido,
+            { [campo]: valor },
             { headers: { Authorization: `Bearer ${token}` } }
           );
         })
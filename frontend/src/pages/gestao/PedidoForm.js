@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import { X, Save, Calculator, Search, UserPlus, Package } from 'lucide-react';
 import axios from 'axios';
 import { toast } from 'sonner';
+import { urlUpload } from '../../lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api/gestao`;
@@ -390,7 +391,7 @@ export default function PedidoForm({ pedido, lojaAtual, onClose, onSave }) {
       toast.success('Imagem anexada com sucesso!');
     } catch (error) {
       console.error('Erro ao fazer upload:', error);
-      toast.error('Erro ao anexar imagem');
+      toast.error(error.response?.data?.detail || 'Erro ao anexar imagem');
     }
   };
 
@@ -678,7 +679,7 @@ export default function PedidoForm({ pedido, lojaAtual, onClose, onSave }) {
         
         if (pedido?.id) {
           console.log('🔄 Atualizando pedido ID:', pedido.id);
-          await axios.put(`${API}/pedidos/${pedido.id}`, dadosEnvio, {
+          await axios.put(`${API}/pedidos/${pedido.id}`, { ...dadosEnvio, version: pedido.version }, {
             headers: { Authorization: `Bearer ${token}` }
           });
           toast.success('Pedido atualizado!');
@@ -712,7 +713,7 @@ export default function PedidoForm({ pedido, lojaAtual, onClose, onSave }) {
         
         if (pedido?.id) {
           console.log('🔄 Atualizando pedido ID:', pedido.id);
-          await axios.put(`${API}/pedidos/${pedido.id}`, dadosEnvio, {
+          await axios.put(`${API}/pedidos/${pedido.id}`, { ...dadosEnvio, version: pedido.version }, {
             headers: { Authorization: `Bearer ${token}` }
           });
           toast.success('Pedido atualizado!');
@@ -732,7 +733,8 @@ export default function PedidoForm({ pedido, lojaAtual, onClose, onSave }) {
       console.error('❌ ERRO AO SALVAR:', error);
       console.error('Detalhes do erro:', error.response?.data);
       console.error('Status do erro:', error.response?.status);
-      toast.error('Erro ao salvar: ' + (error.response?.data?.detail || error.message));
+      const detalhe = error.response?.data?.detail;
+      toast.error('Erro ao salvar: ' + (detalhe?.message || detalhe || error.message));
     } finally {
       setLoading(false);
       console.log('=== FIM DO SALVAMENTO ===');
@@ -1452,7 +1454,7 @@ export default function PedidoForm({ pedido, lojaAtual, onClose, onSave }) {
                 <label>Anexar Foto do Objeto</label>
                 <input
                   type="file"
-                  accept="image/*"
+                  accept="image/jpeg,image/png,image/webp"
                   onChange={handleImagemUpload}
                   className="file-input"
                 />
@@ -1462,7 +1464,7 @@ export default function PedidoForm({ pedido, lojaAtual, onClose, onSave }) {
             {formData.imagem_anexada && (
               <div className="image-preview-box">
                 <div className="preview-title">Imagem Anexada:</div>
-                <img src={formData.imagem_anexada} alt="Objeto do cliente" className="preview-image" />
+                <img src={urlUpload(formData.imagem_anexada)} alt="Objeto do cliente" className="preview-image" />
               </div>
             )}
 
@@ -83,6 +83,31 @@ export default function Producao() {
     fetchOrdensPendentes();
   }, []);
 
+  // Fila de aprovação em tempo real (SSE): o servidor envia a fila inicial e depois cada mudança
+  useEffect(() => {
+    const token = localStorage.getItem('token');
+    const user = JSON.parse(localStorage.getItem('user') || '{}');
+    const nome = user.nome || user.username;
+    if (!token || !nome || typeof EventSource === 'undefined') return undefined;
+
+    const params = new URLSearchParams({ responsavel: nome, token });
+    const eventos = new EventSource(`${API}/producao/pendentes-aprovacao/stream?${params}`);
+
+    eventos.addEventListener('snapshot', (e) => {
+      setOrdensPendentes(JSON.parse(e.data).ordens || []);
+    });
+    eventos.addEventListener('pendente', (e) => {
+      const ordem = JSON.parse(e.data);
+      setOrdensPendentes(atuais => [ordem, ...atuais.filter(o => o.id !== ordem.id)]);
+    });
+    eventos.addEventListener('removida', (e) => {
+      const { id } = JSON.parse(e.data);
+      setOrdensPendentes(atuais => atuais.filter(o => o.id !== id));
+    });
+
+    return () => eventos.close();
+  }, []);
+
   useEffect(() => {
     filterOrdens();
   }, [ordens, searchTerm, lojaFilter, statusFilter, responsavelFilter, showAtrasados]);
@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react';
 import { X, Save, Clock } from 'lucide-react';
 import axios from 'axios';
 import { toast } from 'sonner';
+import { urlMiniatura } from '../../lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || '';
 const API = `${BACKEND_URL}/api/gestao`;
@@ -71,6 +72,17 @@ export default function ProducaoForm({ ordem, onClose, onSave }) {
     timeline: ordem?.timeline || []
   });
 
+  // Timeline completa fica em ordem_eventos; a listagem traz só os últimos eventos
+  useEffect(() => {
+    if (!ordem?.id) return;
+    const token = localStorage.getItem('token');
+    axios.get(`${API}/producao/${ordem.id}/eventos?tipo=timeline`, {
+      headers: { Authorization: `Bearer ${token}` }
+    }).then(response => {
+      setFormData(prev => ({ ...prev, timeline: [...response.data].reverse() }));
+    }).catch(error => console.error('Erro ao carregar timeline:', error));
+  }, [ordem?.id]);
+
   const handleChange = (e) => {
     const { name, value, type, checked } = e.target;
     setFormData(prev => ({
@@ -153,8 +165,9 @@ export default function ProducaoForm({ ordem, onClose, onSave }) {
       const token = localStorage.getItem('token');
       
       // Converter datas para ISO
+      const { timeline, ...dadosFormulario } = formData;
       const dadosEnvio = {
-        ...formData,
+        ...dadosFormulario,
         data_pedido: new Date(formData.data_pedido).toISOString(),
         data_pagamento: formData.data_pagamento ? new Date(formData.data_pagamento).toISOString() : null,
         data_entrega_prometida: formData.data_entrega_prometida ? new Date(formData.data_entrega_prometida).toISOString() : null,
@@ -164,7 +177,7 @@ export default function ProducaoForm({ ordem, onClose, onSave }) {
       };
 
       if (ordem?.id) {
-        await axios.put(`${API}/producao/${ordem.id}`, dadosEnvio, {
+        await axios.put(`${API}/producao/${ordem.id}`, { ...dadosEnvio, version: ordem.version }, {
           headers: { Authorization: `Bearer ${token}` }
         });
         toast.success('Ordem atualizada!');
@@ -178,7 +191,8 @@ export default function ProducaoForm({ ordem, onClose, onSave }) {
       onSave();
     } catch (error) {
       console.error('Erro ao salvar ordem:', error);
-      toast.error('Erro ao salvar ordem: ' + (error.response?.data?.detail || error.message));
+      const detalhe = error.response?.data?.detail;
+      toast.error('Erro ao salvar ordem: ' + (detalhe?.message || detalhe || error.message));
     } finally {
       setLoading(false);
     }
@@ -384,7 +398,7 @@ export default function ProducaoForm({ ordem, onClose, onSave }) {
                       {uploadingFoto ? 'Adicionando...' : '+ Adicionar Foto de Entrada'}
                       <input
                         type="file"
-                        accept="image/*"
+                        accept="image/jpeg,image/png,image/webp"
                         style={{display: 'none'}}
                         onChange={(e) => handleUploadFoto(e, 'entrada_material')}
                         disabled={uploadingFoto}
@@ -411,7 +425,7 @@ export default function ProducaoForm({ ordem, onClose, onSave }) {
                           overflow: 'hidden'
                         }}>
                           <img 
-                            src={foto} 
+                            src={urlMiniatura(foto)} 
                             alt={`Entrada ${index + 1}`}
                             style={{
                               width: '100%',
@@ -480,7 +494,7 @@ export default function ProducaoForm({ ordem, onClose, onSave }) {
                       {uploadingFoto ? 'Adicionando...' : '+ Adicionar Foto do Trabalho Pronto'}
                       <input
                         type="file"
-                        accept="image/*"
+                        accept="image/jpeg,image/png,image/webp"
                         style={{display: 'none'}}
                         onChange={(e) => handleUploadFoto(e, 'trabalho_pronto')}
                         disabled={uploadingFoto}
@@ -507,7 +521,7 @@ export default function ProducaoForm({ ordem, onClose, onSave }) {
                           overflow: 'hidden'
                         }}>
                           <img 
-                            src={foto} 
+                            src={urlMiniatura(foto)} 
                             alt={`Trabalho Pronto ${index + 1}`}
                             style={{
                               width: '100%',
@@ -577,7 +591,7 @@ export default function ProducaoForm({ ordem, onClose, onSave }) {
                       {uploadingFoto ? 'Adicionando...' : '+ Adicionar Comprovante'}
                       <input
                         type="file"
-                        accept="image/*"
+                        accept="image/jpeg,image/png,image/webp"
                         style={{display: 'none'}}
                         onChange={(e) => handleUploadFoto(e, 'comprovante_pagamento')}
                         disabled={uploadingFoto}
@@ -604,7 +618,7 @@ export default function ProducaoForm({ ordem, onClose, onSave }) {
                           overflow: 'hidden'
                         }}>
                           <img 
-                            src={foto} 
+                            src={urlMiniatura(foto)} 
                             alt={`Comprovante ${index + 1}`}
                             style={{
                               width: '100%',
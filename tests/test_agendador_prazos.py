@@ -0,0 +1,69 @@
+"""
+Testes do agendador de prazos compartilhado (backend/agendador_prazos.py)
+"""
+import asyncio
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'backend'))
+
+from agendador_prazos import AgendadorPrazos, ler_prazo  # noqa: E402
+
+
+def test_acorda_no_proximo_prazo_e_ao_reagendar():
+    # Cada varredura entra na fila; o teste espera por ela em vez de dormir um tempo fixo.
+    # O intervalo de 30s é bem maior que a espera máxima: se a varredura chega, foi o prazo
+    # ou o reagendar() que acordou o worker.
+    async def cenario():
+        varreduras = asyncio.Queue()
+        ciclos = []
+
+        async def varrer(db, agora, extra):
+            ciclos.append(agora)
+            varreduras.put_nowait(extra)
+
+        async def proximo_prazo(db, agora):
+            # Primeiro ciclo: prazo daqui a 50 ms; depois, nenhum prazo (dorme o intervalo)
+            return agora + timedelta(milliseconds=50) if len(ciclos) == 1 else None
+
+        agendador = AgendadorPrazos("Teste", varrer, proximo_prazo, intervalo_segundos=30)
+        agendador.iniciar(None, 'x')
+        try:
+            assert await asyncio.wait_for(varreduras.get(), 5) == 'x'
+            assert await asyncio.wait_for(varreduras.get(), 5) == 'x'
+            agendador.reagendar()
+            assert await asyncio.wait_for(varreduras.get(), 5) == 'x'
+        finally:
+            await agendador.parar()
+
+    asyncio.run(cenario())
+
+
+def test_erro_na_varredura_nao_derruba_o_worker():
+    async def cenario():
+        chamadas = []
+        tres_chamadas = asyncio.Event()
+
+        async def varrer(db, agora):
+            chamadas.append(agora)
+            if len(chamadas) == 3:
+                tres_chamadas.set()
+            raise RuntimeError("banco indisponível")
+
+        async def proximo_prazo(db, agora):
+            return None
+
+        agendador = AgendadorPrazos("Teste", varrer, proximo_prazo, intervalo_segundos=0.01)
+        agendador.iniciar(None)
+        try:
+            await asyncio.wait_for(tres_chamadas.wait(), 5)
+        finally:
+            await agendador.parar()
+
+    asyncio.run(cenario())
+
+
+def test_ler_prazo():
+    assert ler_prazo("2025-01-01") is None
+    assert ler_prazo(datetime(2025, 1, 1)).tzinfo == timezone.utc
@@ -0,0 +1,64 @@
+"""
+Testes da busca de pedidos de marketplace (backend/busca_pedidos.py)
+"""
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'backend'))
+
+from busca_pedidos import (  # noqa: E402
+    BuscaInvalida, codificar_cursor, decodificar_cursor, filtro_busca, montar_resposta,
+    pipeline_facetas, pipeline_pagina,
+)
+
+
+def test_cursor_ida_e_volta_com_data_e_texto():
+    data = datetime(2025, 3, 10, 14, 30)
+    assert decodificar_cursor(codificar_cursor(data, 'p-1')) == (data.replace(tzinfo=timezone.utc), 'p-1')
+    assert decodificar_cursor(codificar_cursor('MLB-123', 'p-2')) == ('MLB-123', 'p-2')
+    with pytest.raises(BuscaInvalida):
+        decodificar_cursor('nao-e-um-cursor')
+
+
+def test_filtros_de_prefixo_escapam_a_entrada():
+    filtro = filtro_busca(projeto_id='shopee', numero_pedido='25.03', cliente_nome='ana (loja)', busca='  moldura ')
+    assert filtro['projeto_id'] == 'shopee'
+    assert filtro['numero_pedido'] == {'$regex': r'^25\.03'}
+    assert filtro['cliente_nome'] == {'$regex': r'^ana\ \(loja\)', '$options': 'i'}
+    assert filtro['$text'] == {'$search': 'moldura'}
+    with pytest.raises(BuscaInvalida):
+        filtro_busca(campo_data='valor_liquido')
+
+
+def test_pagina_com_cursor_continua_apos_o_ultimo():
+    cursor = codificar_cursor(datetime(2025, 3, 10, tzinfo=timezone.utc), 'p-9')
+    etapas = pipeline_pagina({'$text': {'$search': 'quadro'}}, {'status_producao': 'Espelho'}, cursor=cursor, limite=20)
+    assert etapas[0] == {'$match': {'$text': {'$search': 'quadro'}, 'status_producao': 'Espelho'}}
+    assert etapas[1]['$match']['$or'][1] == {'created_at': datetime(2025, 3, 10, tzinfo=timezone.utc), 'id': {'$lt': 'p-9'}}
+    assert etapas[2] == {'$sort': {'created_at': -1, 'id': -1}}
+    assert etapas[3] == {'$limit': 21}
+    with pytest.raises(BuscaInvalida):
+        pipeline_pagina({}, {}, ordenar='cliente_nome')
+
+
+def test_faceta_conta_sem_o_proprio_filtro():
+    facetas = {'status_producao': 'Espelho', 'status_logistica': 'Enviado', 'status_montagem': None}
+    ramos = pipeline_facetas({'projeto_id': 'shopee'}, facetas)[1]['$facet']
+    assert ramos['status_producao'][0] == {'$match': {'status_logistica': 'Enviado'}}
+    assert ramos['status_montagem'][0] == {'$match': {'status_producao': 'Espelho', 'status_logistica': 'Enviado'}}
+    assert ramos['total'][0] == {'$match': {'status_producao': 'Espelho', 'status_logistica': 'Enviado'}}
+
+
+def test_montar_resposta_corta_excedente_e_gera_cursor():
+    pedidos = [{'id': f'p-{i}', 'numero_pedido': f'{100 + i}'} for i in range(4)]
+    contagens = {'status_producao': [{'_id': 'Espelho', 'total': 3}], 'total': [{'total': 4}]}
+    resposta = montar_resposta(pedidos, 3, 'numero_pedido', contagens)
+    assert [p['id'] for p in resposta['pedidos']] == ['p-0', 'p-1', 'p-2']
+    assert decodificar_cursor(resposta['proximo_cursor']) == ('102', 'p-2')
+    assert resposta['facetas']['status_producao'] == [{'valor': 'Espelho', 'total': 3}]
+    assert resposta['facetas']['status_montagem'] == []
+    assert resposta['total'] == 4
+    assert montar_resposta(pedidos, 10, 'numero_pedido')['proximo_cursor'] is None
@@ -0,0 +1,138 @@
+"""
+Testes do cache HTTP de respostas (backend/cache_respostas.py)
+"""
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'backend'))
+
+from cache_respostas import CacheRespostas, CacheRespostasMiddleware, RegraCache, etag_confere  # noqa: E402
+
+TOKENS = {
+    'token-ana': {'user_id': 'ana', 'role': 'manager'},
+    'token-bia': {'user_id': 'bia', 'role': 'production'},
+}
+
+
+def criar_middleware(rotas, limite_bytes=100_000, status=200):
+    chamadas = []
+
+    async def app(scope, receive, send):
+        chamadas.append(scope['path'])
+        await asyncio.sleep(0.01)
+        corpo = json.dumps({'path': scope['path'], 'query': scope['query_string'].decode(), 'n': len(chamadas)}).encode()
+        await send({'type': 'http.response.start', 'status': status, 'headers': [
+            (b'content-type', b'application/json'), (b'content-length', str(len(corpo)).encode())
+        ]})
+        await send({'type': 'http.response.body', 'body': corpo})
+
+    cache = CacheRespostas(limite_bytes=limite_bytes)
+    return CacheRespostasMiddleware(app, cache, rotas, TOKENS.get), cache, chamadas
+
+
+async def requisitar(middleware, path, token='token-ana', query=b'', if_none_match=None):
+    cabecalhos = [(b'authorization', f'Bearer {token}'.encode())]
+    if if_none_match:
+        cabecalhos.append((b'if-none-match', if_none_match))
+    mensagens = []
+
+    async def send(mensagem):
+        mensagens.append(mensagem)
+
+    await middleware({'type': 'http', 'method': 'GET', 'path': path, 'query_string': query, 'headers': cabecalhos}, None, send)
+    inicio, corpo = mensagens
+    return inicio['status'], dict(inicio['headers']), corpo['body']
+
+
+def test_requisicoes_simultaneas_calculam_uma_vez():
+    middleware, cache, chamadas = criar_middleware({'/api/dashboard': RegraCache(ttl_segundos=60)})
+
+    async def cenario():
+        return await asyncio.gather(*[requisitar(middleware, '/api/dashboard') for _ in range(20)])
+
+    respostas = asyncio.run(cenario())
+    assert len(chamadas) == 1
+    assert len({corpo for _, _, corpo in respostas}) == 1
+    assert cache.metricas()['misses'] == 1
+    assert cache.metricas()['hits'] == 19
+
+
+def test_etag_devolve_304_sem_corpo():
+    middleware, cache, _ = criar_middleware({'/api/dashboard': RegraCache(ttl_segundos=60)})
+    status, cabecalhos, corpo = asyncio.run(requisitar(middleware, '/api/dashboard'))
+    assert status == 200 and corpo
+    assert cabecalhos[b'x-cache'] == b'MISS'
+
+    status, cabecalhos_304, corpo = asyncio.run(requisitar(middleware, '/api/dashboard', if_none_match=cabecalhos[b'etag']))
+    assert status == 304 and corpo == b''
+    assert cabecalhos_304[b'etag'] == cabecalhos[b'etag']
+    assert cache.metricas()['respostas_304'] == 1
+
+
+def test_variacao_por_role_e_query_string():
+    middleware, _, chamadas = criar_middleware({'/api/financeiro': RegraCache(ttl_segundos=60, variar_por='role')})
+    asyncio.run(requisitar(middleware, '/api/financeiro', token='token-ana'))
+    asyncio.run(requisitar(middleware, '/api/financeiro', token='token-ana'))
+    asyncio.run(requisitar(middleware, '/api/financeiro', token='token-bia'))
+    asyncio.run(requisitar(middleware, '/api/financeiro', token='token-ana', query=b'loja=centro'))
+    assert len(chamadas) == 3
+
+
+def test_token_invalido_e_rotas_sem_regra_nao_usam_cache():
+    middleware, cache, chamadas = criar_middleware({'/api/dashboard': RegraCache(ttl_segundos=60)})
+    for _ in range(2):
+        asyncio.run(requisitar(middleware, '/api/dashboard', token='invalido'))
+        asyncio.run(requisitar(middleware, '/api/outra-rota'))
+    assert len(chamadas) == 4
+    assert cache.metricas()['entradas'] == 0
+
+
+def test_respostas_de_erro_nao_sao_guardadas():
+    middleware, cache, chamadas = criar_middleware({'/api/dashboard': RegraCache(ttl_segundos=60)}, status=500)
+    for _ in range(2):
+        status, cabecalhos, _ = asyncio.run(requisitar(middleware, '/api/dashboard'))
+        assert status == 500 and b'etag' not in cabecalhos
+    assert len(chamadas) == 2
+    assert cache.metricas()['entradas'] == 0
+
+
+def test_lru_respeita_limite_de_bytes():
+    rotas = {f'/api/relatorio/{i}': RegraCache(ttl_segundos=60) for i in range(50)}
+    middleware, cache, _ = criar_middleware(rotas, limite_bytes=4000)
+    for rota in rotas:
+        asyncio.run(requisitar(middleware, rota))
+    metricas = cache.metricas()
+    assert metricas['bytes'] <= 4000
+    assert metricas['removidas_lru'] > 0
+    # A mais recente continua em cache; a mais antiga foi removida
+    assert asyncio.run(requisitar(middleware, '/api/relatorio/49'))[1][b'x-cache'] == b'HIT'
+    assert asyncio.run(requisitar(middleware, '/api/relatorio/0'))[1][b'x-cache'] == b'MISS'
+
+
+def test_ttl_expira_e_invalidar_remove_por_prefixo():
+    middleware, cache, chamadas = criar_middleware({
+        '/api/expira': RegraCache(ttl_segundos=0),
+        '/api/mensagem': RegraCache(ttl_segundos=60),
+    })
+    asyncio.run(requisitar(middleware, '/api/expira'))
+    asyncio.run(requisitar(middleware, '/api/expira'))
+    assert chamadas.count('/api/expira') == 2
+
+    asyncio.run(requisitar(middleware, '/api/mensagem'))
+    cache.invalidar('/api/mensagem')
+    asyncio.run(requisitar(middleware, '/api/mensagem'))
+    assert chamadas.count('/api/mensagem') == 2
+
+
+def test_etag_confere_forte_e_fraca():
+    forte, fraca = '"abc-123"', 'W/"abc-123"'
+    for etag in (forte, fraca):
+        assert etag_confere('"abc-123"', etag)
+        assert etag_confere('W/"abc-123"', etag)
+        assert etag_confere('"outro", W/"abc-123"', etag)
+        assert etag_confere('*', etag)
+        assert not etag_confere('"abc-124"', etag)
+        assert not etag_confere(None, etag)
+        assert not etag_confere('', etag)
@@ -0,0 +1,112 @@
+"""
+Testes das chaves de ordenação fracionárias do kanban (backend/kanban_rank.py)
+"""
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'backend'))
+
+from kanban_rank import (  # noqa: E402
+    TAMANHO_MAXIMO_RANK,
+    precisa_rebalancear,
+    rank_entre,
+    ranks_distribuidos,
+    validar_rank,
+)
+
+
+def test_rank_entre_fica_entre_os_vizinhos():
+    gerador = random.Random(42)
+    ranks = ranks_distribuidos(50)
+    for _ in range(2000):
+        antes, depois = sorted(gerador.sample(ranks, 2))
+        novo = rank_entre(antes, depois)
+        assert antes < novo < depois
+        assert validar_rank(novo)
+
+
+def test_rank_nas_pontas_da_coluna():
+    assert validar_rank(rank_entre())
+    primeiro = rank_entre()
+    assert rank_entre(None, primeiro) < primeiro < rank_entre(primeiro, None)
+
+
+def test_rank_entre_rejeita_intervalo_invertido():
+    with pytest.raises(ValueError):
+        rank_entre('b', 'a')
+    with pytest.raises(ValueError):
+        rank_entre('a', 'a')
+
+
+def test_cards_criados_em_sequencia_nao_crescem():
+    ultimo = None
+    for _ in range(1000):
+        novo = rank_entre(ultimo, None)
+        assert ultimo is None or novo > ultimo
+        ultimo = novo
+    assert not precisa_rebalancear(ultimo)
+
+
+def test_ranks_distribuidos_sao_crescentes_e_curtos():
+    for quantidade in (0, 1, 2, 300, 50_000):
+        ranks = ranks_distribuidos(quantidade)
+        assert len(ranks) == quantidade
+        assert ranks == sorted(set(ranks))
+        assert all(validar_rank(rank) and not precisa_rebalancear(rank) for rank in ranks)
+
+
+def test_inserir_sempre_no_mesmo_intervalo_exige_rebalanceamento():
+    antes, depois = ranks_distribuidos(2)
+    for _ in range(200):
+        depois = rank_entre(antes, depois)
+    assert antes < depois
+    assert precisa_rebalancear(depois)
+
+
+def test_ordem_preservada_em_movimentos_aleatorios():
+    """Simula milhares de arrastes em uma coluna: só o card movido recebe rank novo,
+    e a ordem por rank deve ser sempre igual à ordem esperada da lista"""
+    gerador = random.Random(2024)
+    coluna = [f"card-{i}" for i in range(300)]
+    ranks = dict(zip(coluna, ranks_distribuidos(len(coluna))))
+    rebalanceamentos = 0
+
+    for _ in range(5000):
+        card = coluna.pop(gerador.randrange(len(coluna)))
+        # Arrastes concentrados no topo da coluna estressam o mesmo intervalo
+        destino = gerador.randrange(len(coluna) + 1) if gerador.random() < 0.5 else gerador.randrange(3)
+        coluna.insert(destino, card)
+
+        antes = ranks[coluna[destino - 1]] if destino > 0 else None
+        depois = ranks[coluna[destino + 1]] if destino + 1 < len(coluna) else None
+        ranks[card] = rank_entre(antes, depois)
+
+        if precisa_rebalancear(ranks[card]):
+            ranks = dict(zip(coluna, ranks_distribuidos(len(coluna))))
+            rebalanceamentos += 1
+
+        assert sorted(coluna, key=ranks.__getitem__) == coluna
+
+    assert len(set(ranks.values())) == len(coluna)
+    assert all(len(rank) <= TAMANHO_MAXIMO_RANK for rank in ranks.values())
+    assert rebalanceamentos > 0
+
+
+def test_rank_espalhado_evita_colisao_em_insercoes_simultaneas():
+    random.seed(7)
+    antes, depois = ranks_distribuidos(2)
+    for vizinhos in ((antes, depois), (antes, None), (None, depois), (antes, rank_entre(antes, rank_entre(antes, depois)))):
+        ranks = {rank_entre(*vizinhos, espalhar=True) for _ in range(50)}
+        assert len(ranks) == 50
+        assert all(validar_rank(rank) for rank in ranks)
+        assert all((vizinhos[0] is None or vizinhos[0] < rank) and (vizinhos[1] is None or rank < vizinhos[1]) for rank in ranks)
+
+    ultimo = None
+    for _ in range(1000):
+        novo = rank_entre(ultimo, None, espalhar=True)
+        assert ultimo is None or novo > ultimo
+        ultimo = novo
+    assert not precisa_rebalancear(ultimo)
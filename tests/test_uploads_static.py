@@ -0,0 +1,46 @@
+"""
+Testes do serviço de /uploads (backend/uploads_static.py)
+"""
+import gzip
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'backend'))
+
+from uploads_static import _gerar_gzip, interpretar_range  # noqa: E402
+
+
+def test_range_com_inicio_e_fim():
+    assert interpretar_range('bytes=0-99', 1000) == (0, 99)
+    assert interpretar_range('bytes=500-', 1000) == (500, 999)
+    assert interpretar_range('bytes=900-5000', 1000) == (900, 999)
+
+
+def test_range_sufixo():
+    assert interpretar_range('bytes=-100', 1000) == (900, 999)
+    assert interpretar_range('bytes=-5000', 1000) == (0, 999)
+    assert interpretar_range('bytes=-0', 1000) is None
+
+
+def test_range_fora_dos_limites_ou_invalido():
+    assert interpretar_range('bytes=1000-', 1000) is None
+    assert interpretar_range('bytes=50-10', 1000) is None
+    assert interpretar_range('bytes=-10', 0) is None
+    assert interpretar_range('items=0-10', 1000) is None
+    assert interpretar_range('bytes=abc-', 1000) is None
+    # Vários intervalos não são atendidos: quem chama envia o arquivo inteiro
+    assert interpretar_range('bytes=0-10,20-30', 1000) is None
+
+
+def test_gzip_simultaneo_nao_compartilha_temporario(tmp_path):
+    original = tmp_path / 'relatorio.txt'
+    conteudo = b'linha de texto\n' * 5000
+    original.write_bytes(conteudo)
+    destino = tmp_path / 'relatorio.txt.gz'
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(lambda _: _gerar_gzip(original, destino), range(8)))
+
+    assert gzip.decompress(destino.read_bytes()) == conteudo
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['relatorio.txt', 'relatorio.txt.gz']